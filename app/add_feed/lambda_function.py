@@ -1,10 +1,53 @@
 import boto3
 import json
+import os
+import time
+
+from boto3.dynamodb.conditions import Key
+
+# Index on rss_entries with feed_url as the partition key and date as the sort key
+FEED_INDEX_NAME = "FeedDateIndex"
+
+# How many of the newest entries of the feed are copied to the new subscriber's timeline
+SEED_SIZE = int(os.environ.get("TIMELINE_SEED_SIZE", 50))
+
+# How long timeline rows are kept before DynamoDB expires them, the same as common/timeline.py in the pollers
+TIMELINE_RETENTION_DAYS = int(os.environ.get("TIMELINE_RETENTION_DAYS", 30))
+
+
+def seed_timeline(dynamodb, user_id, feed_url):
+    """
+    Copy the newest entries of a feed to a user's timeline. The pollers only fan out entries that are new, so without
+    this the feed's entries would not show up in the timeline until it posts again.
+    :param dynamodb: The DynamoDB resource.
+    :param user_id: The user that subscribed to the feed.
+    :param feed_url: The URL of the feed.
+    :return: The number of entries added to the timeline.
+    """
+    response = dynamodb.Table("rss_entries").query(
+        IndexName=FEED_INDEX_NAME,
+        KeyConditionExpression=Key('feed_url').eq(feed_url),
+        ScanIndexForward=False,
+        Limit=SEED_SIZE,
+    )
+
+    expires_at = int(time.time()) + TIMELINE_RETENTION_DAYS * 24 * 60 * 60
+    with dynamodb.Table("user_timeline").batch_writer(overwrite_by_pkeys=["user", "sort_key"]) as batch:
+        for entry in response['Items']:
+            batch.put_item(Item={
+                **entry,
+                "user": user_id,
+                "sort_key": f"{entry['date']}#{entry['id']}",
+                "expires_at": expires_at,
+            })
+
+    return len(response['Items'])
 
 
 def lambda_handler(event, context):
     """
-    This function adds a new RSS feed to the user_feeds table in DynamoDB.
+    This function adds a new RSS feed to the user_feeds table in DynamoDB, and seeds the user's timeline with the
+    newest entries of the feed.
     :param event:  The event data from the Lambda trigger.
     :param context:  The context data from the Lambda trigger.
     :return: A message indicating the success or failure of the function.
@@ -17,6 +60,7 @@ def lambda_handler(event, context):
     feed_url = body['feed_url']
 
     table.put_item(Item={"user": user_id, "feed_url": feed_url})
+    seed_timeline(dynamodb, user_id, feed_url)
 
     return {
         'statusCode': 200,
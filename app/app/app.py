@@ -7,17 +7,23 @@ The function also checks for keywords in the entry title, and if any of the keyw
 found, the function will not add the entry to the database.
 """
 
+import hashlib
 import json
+import logging
 import os
 import time
-import boto3
-import requests
 
-from datetime import datetime, timedelta
-
-from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 
+# boto3, botocore and requests are imported on first use by the common modules, see tests/test_startup.py
+from common import archive, aws_cache, http, metrics, storage
 from common.init_logging import setup_logger
+from common.keyword_filter import KEYWORDS_TABLE_NAME, get_filter
+from common.lease import Lease
+from common.models import Thread
+from common.seen_cache import SeenCache
+from common.storage import StorageException
 
 # Get the logger
 logger = setup_logger(__name__)
@@ -29,9 +35,80 @@ DEBUG = os.environ.get("DEBUG", False)
 SLEEP_TIME = 60
 
 TABLE_NAME = 'politiloggen-entries'
+TABLE_KEY_NAMES = ("thread_id", "message_id")
+
+# Items with this thread_id hold the poller's own state rather than messages
+STATE_THREAD_ID = '#state'
+
+# The message_id of the summary item kept next to the messages of each thread, see thread_summary()
+SUMMARY_MESSAGE_ID = '#summary'
+
+# The tables archived by archive_handler, with their key attributes and the attribute holding the date of an entry
+ARCHIVED_TABLES = {
+    TABLE_NAME: (TABLE_KEY_NAMES, "createdOn"),
+    "rss_entries": (("id",), "date"),
+}
+
+# The default query sent to the politiloggen API, see get_query_specs()
+DISTRICT = "Sør-Vest politidistrikt"
+CATEGORIES = ["Savnet", "Redning"]
+
+# How many threads to ask for per page, and how many pages to follow in one run
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 10))
+MAX_PAGES = int(os.environ.get("MAX_PAGES", 10))
 
 CURRENT_TIME = time.strftime("%H:%M:%S")
 
+# How many Pushover notifications to send at the same time
+PUSHOVER_MAX_WORKERS = int(os.environ.get("PUSHOVER_MAX_WORKERS", 4))
+
+# Pushover rejects messages longer than this
+PUSHOVER_MESSAGE_LIMIT = 1024
+
+# Runs with more new messages than this are coalesced into one notification per thread
+DIGEST_THRESHOLD = int(os.environ.get("DIGEST_THRESHOLD", 5))
+
+# Threads with at least this many new messages in one run are always coalesced
+DIGEST_MIN_THREAD_UPDATES = int(os.environ.get("DIGEST_MIN_THREAD_UPDATES", 3))
+
+# How many district queries to poll at the same time
+QUERY_MAX_WORKERS = int(os.environ.get("QUERY_MAX_WORKERS", 4))
+
+# Seconds to wait for every query to be fetched, a district still going by then is counted as failed
+QUERY_TIMEOUT = int(os.environ.get("QUERY_TIMEOUT", 20))
+
+# How long the query specs from DynamoDB are cached
+QUERY_SPECS_TTL = int(os.environ.get("QUERY_SPECS_TTL", 300))
+
+# Seconds between polls within one invocation, 0 polls once per invocation and leaves the timing to the schedule
+POLL_INTERVAL = int(os.environ.get("POLL_INTERVAL", 0))
+
+# Seconds of the invocation left unused when polling repeatedly, so the last poll finishes before the timeout
+POLL_DEADLINE_MARGIN = int(os.environ.get("POLL_DEADLINE_MARGIN", 15))
+
+# How long to keep polling when there is no Lambda context to ask, e.g. when run locally
+POLL_DURATION = int(os.environ.get("POLL_DURATION", 55))
+
+# Seconds the polling lease is held after each heartbeat, it must outlast a slow poll
+LEASE_DURATION = int(os.environ.get("LEASE_DURATION", 60))
+
+# How many messages to claim at the same time
+CLAIM_MAX_WORKERS = int(os.environ.get("CLAIM_MAX_WORKERS", 8))
+
+# Digest of the last fully processed payload and high-water mark per query, kept across warm invocations
+_last_digests = {}
+_high_water_marks = {}
+
+# Query specs loaded from DynamoDB
+_query_specs = None
+_query_specs_loaded_at = 0.0
+
+# (thread_id, message_id) keys known to be stored, kept across warm invocations
+_seen = SeenCache()
+
+# How often the unchanged payload short-circuit fires in this container
+_run_stats = {"runs": 0, "short_circuits": 0}
+
 
 class ApiUnavailableException(Exception):
     """
@@ -40,50 +117,252 @@ class ApiUnavailableException(Exception):
     pass
 
 
+class DatabaseUnavailableException(Exception):
+    """
+    Exception for when the database can't be read or written.
+    """
+    pass
+
+
 def get_parameter(name):
     """
     Retrieve a parameter from AWS Systems Manager Parameter Store.
+    The value is cached across warm invocations, see common.aws_cache.
     :param name: The name of the parameter.
-    :return: The parameter's value.
+    :return: The parameter's value, or None if it could not be retrieved.
+    """
+    return aws_cache.get_secrets([name])[name]
+
+
+def query_key(district, categories):
     """
-    ssm = boto3.client("ssm")
+    Build a stable key for a district/category query, used to store per-query state.
+    :param district: The police district.
+    :param categories: The list of categories.
+    :return: The key as a string.
+    """
+    return f"{district}|{','.join(sorted(categories))}"
+
+
+def get_query_specs(entries):
+    """
+    Get the list of district/category queries to poll.
+    The POLITILOGGEN_QUERIES environment variable takes precedence, then the "queries" state item in DynamoDB,
+    and finally the built-in Sør-Vest query. The DynamoDB copy is cached for QUERY_SPECS_TTL seconds.
+    :param entries: The storage of the entries table.
+    :return: A list of dicts with "district" and "categories".
+    """
+    global _query_specs, _query_specs_loaded_at
+
+    if os.environ.get("POLITILOGGEN_QUERIES"):
+        return json.loads(os.environ["POLITILOGGEN_QUERIES"])
+
+    if _query_specs is not None and time.monotonic() - _query_specs_loaded_at < QUERY_SPECS_TTL:
+        return _query_specs
 
     try:
-        response = ssm.get_parameter(Name=name, WithDecryption=True)
-    except Exception as error:  # pylint: disable=broad-except
-        logger.error(f"Encountered an error while retrieving parameter: {error}")
-        return None  # FIXME - Should we return None or raise an exception?
-    return response["Parameter"]["Value"]
+        queries = (entries.get_item({"thread_id": STATE_THREAD_ID, "message_id": "queries"}) or {}).get("queries")
+    except StorageException as error:
+        logger.error("Error reading query specs: %s", error)
+        queries = None
+
+    _query_specs = queries or [{"district": DISTRICT, "categories": CATEGORIES}]
+    _query_specs_loaded_at = time.monotonic()
+    return _query_specs
 
 
-def fetch_api_data():
+def load_query_state(entries, keys):
     """
-    Fetches data from the API.
-    :return: The data from the API.
+    Load the high-water marks and payload digests for the queries into memory.
+    Warm containers already have them, cold ones read all of them with a single batched read.
+    :param entries: The storage of the entries table.
+    :param keys: The query keys, see query_key().
+    """
+    missing = [key for key in keys if key not in _high_water_marks or key not in _last_digests]
+    if not missing:
+        return
+
+    state_keys = []
+    for key in missing:
+        state_keys.append({"thread_id": STATE_THREAD_ID, "message_id": f"hwm#{key}"})
+        state_keys.append({"thread_id": STATE_THREAD_ID, "message_id": f"digest#{key}"})
+
+    try:
+        items = entries.get_items(state_keys)
+    except StorageException as error:
+        # Without state we just do a full run, so this is not fatal
+        logger.error("Error reading query state: %s", error)
+        return
+
+    found = {item["message_id"]: item for item in items}
+    for key in missing:
+        _high_water_marks[key] = found.get(f"hwm#{key}", {}).get("updatedOn")
+        _last_digests[key] = found.get(f"digest#{key}", {}).get("digest")
+
+
+def save_high_water_mark(entries, key, updated_on):
+    """
+    Store the newest "updatedOn" we have processed for a query. The mark only ever moves forward.
+    :param entries: The storage of the entries table.
+    :param key: The query key, see query_key().
+    :param updated_on: The new high-water mark.
     """
+    if _high_water_marks.get(key) is None or _high_water_marks[key] < updated_on:
+        _high_water_marks[key] = updated_on
+
+    try:
+        entries.put_item_if_newer(
+            {"thread_id": STATE_THREAD_ID, "message_id": f"hwm#{key}", "updatedOn": updated_on}, "updatedOn"
+        )
+    except StorageException as error:
+        logger.error("Error saving high-water mark: %s", error)
+
+
+def as_utc(value):
+    """
+    Convert a datetime to UTC. A datetime without a timezone is taken to be in UTC already.
+    :param value: The datetime.
+    :return: The datetime in UTC, with the timezone set.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def fetch_page(district, categories, page, date_from=None, date_to=None, page_size=None):
+    """
+    Fetches a single page of threads from the API.
+    :param district: The police district to fetch threads for.
+    :param categories: The categories to fetch threads for.
+    :param page: The page number, starting at 0.
+    :param date_from: The start of the date range as a datetime, see as_utc(). Defaults to 7 days ago.
+    :param date_to: The end of the date range as a datetime, see as_utc(). Defaults to no end.
+    :param page_size: The number of threads per page. Defaults to PAGE_SIZE.
+    :return: The list of threads on the page, newest first.
+    """
+    page_size = page_size or PAGE_SIZE
+    # The date filter is kept at a fixed window, as long-running threads are updated long after creation
+    date_from = as_utc(date_from or datetime.now(timezone.utc) - timedelta(days=7))
 
     url = "https://politiloggen-vis-frontend.bks-prod.politiet.no/api/messagethread"
     body = {
-        "Category": [
-            "Savnet",
-            "Redning"
-        ],
+        "Category": list(categories),
         "sortByEnum": "Date",
         "sortByAsc": False,
         "timeSpanType": "Custom",
-        "dateTimeFrom": (datetime.utcnow() - timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-        "dateTimeTo": "2099-12-24T23:59:00.000Z",
-        "skip": 0,
-        "take": 10,
-        "district": "Sør-Vest politidistrikt"
+        "dateTimeFrom": date_from.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "dateTimeTo": as_utc(date_to).strftime("%Y-%m-%dT%H:%M:%S.000Z") if date_to else "2099-12-24T23:59:00.000Z",
+        "skip": page * page_size,
+        "take": page_size,
+        "district": district
     }
 
-    response = requests.post(url, json=body, timeout=10)
+    try:
+        # The search is a POST, but it only reads, so it is safe to retry
+        response = http.request("POST", url, json=body, idempotent=True)
+    except http.RequestException as error:
+        raise ApiUnavailableException(f"Failed to fetch data from API: {error}") from error
 
     if response.status_code != 200:
         raise ApiUnavailableException(f"{response.status_code}: Failed to fetch data from API: {response.text}")
 
-    return response.json()
+    return response.json().get("messageThreads", [])
+
+
+def fetch_api_data(district=DISTRICT, categories=CATEGORIES, since=None, first_page=None):
+    """
+    Fetches data from the API.
+    Without a high-water mark only the first page is fetched. With one, pages are fetched with skip/take until we
+    reach threads we have already processed, so bursts of updates are not cut off at one page.
+    :param district: The police district to fetch threads for.
+    :param categories: The categories to fetch threads for.
+    :param since: The high-water mark, the newest "updatedOn" we have processed.
+    :param first_page: The first page, if it has already been fetched.
+    :return: The data from the API, with only the threads updated after the high-water mark.
+    """
+    threads = []
+
+    for page in range(MAX_PAGES):
+        if page == 0 and first_page is not None:
+            page_threads = first_page
+        else:
+            page_threads = fetch_page(district, categories, page)
+
+        if since is None:
+            # First run for this query, don't go digging through the whole history
+            threads.extend(page_threads)
+            break
+
+        new_threads = [thread for thread in page_threads if thread["updatedOn"] > since]
+        threads.extend(new_threads)
+
+        # Threads are sorted newest first, so stop once we see one we already know about
+        if len(new_threads) < len(page_threads) or len(page_threads) < PAGE_SIZE:
+            break
+    else:
+        logger.warning("Stopped after %d pages, some updates for %s may have been missed", MAX_PAGES, district)
+
+    return {"messageThreads": threads}
+
+
+def payload_digest(threads):
+    """
+    Compute a stable digest of a list of threads, independent of key order and whitespace.
+    :param threads: The threads from the API.
+    :return: The hex digest.
+    """
+    normalized = json.dumps(threads, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def save_payload_digest(entries, key, digest):
+    """
+    Store the digest of a payload that has been fully processed.
+    :param entries: The storage of the entries table.
+    :param key: The query key, see query_key().
+    :param digest: The digest of the payload.
+    """
+    _last_digests[key] = digest
+    try:
+        entries.put_item({"thread_id": STATE_THREAD_ID, "message_id": f"digest#{key}", "digest": digest})
+    except StorageException as error:
+        logger.error("Error saving payload digest: %s", error)
+
+
+def poll_query(spec, key):
+    """
+    Fetch the new threads for one district/category query.
+    Only talks to the API, all state is read before and written after, so queries can be polled in parallel.
+    :param spec: A dict with "district" and "categories".
+    :param key: The query key, see query_key().
+    :return: A dict with the "key", the "digest" of the first page and the new "threads", or None if unchanged.
+    """
+    first_page = fetch_page(spec["district"], spec["categories"], 0)
+
+    # Most minutes nothing has changed, so skip all the storage and notification work
+    digest = payload_digest(first_page)
+    if _last_digests.get(key) == digest:
+        return {"key": key, "digest": digest, "threads": None}
+
+    data = fetch_api_data(
+        spec["district"], spec["categories"], since=_high_water_marks.get(key), first_page=first_page
+    )
+    return {"key": key, "digest": digest, "threads": data["messageThreads"]}
+
+
+def merge_threads(thread_lists):
+    """
+    Merge threads from several queries, keeping the most recently updated copy of each thread.
+    :param thread_lists: Lists of threads.
+    :return: A single list of unique threads.
+    """
+    merged = {}
+    for threads in thread_lists:
+        for thread in threads:
+            existing = merged.get(thread["id"])
+            if existing is None or existing["updatedOn"] < thread["updatedOn"]:
+                merged[thread["id"]] = thread
+    return list(merged.values())
 
 
 def notify(
@@ -100,8 +379,11 @@ def notify(
         :param message: The body of the notification.
         :param user_key: The user key obtained from the Pushover app.
         :param api_token: The API token for your Pushover application.
+        :param sound: The sound to play.
+        :param priority: The Pushover priority. Priority 2 is repeated until acknowledged.
+        :return: A dict with "ok", "status_code" and "error" describing the delivery.
         """
-    logger.info(f"Priority {priority}")
+    logger.info("Priority %s", priority)
 
     if priority == 2:
         retry = 120
@@ -110,31 +392,187 @@ def notify(
         retry = 0
         expire = 0
 
-        data = {
-            "token": api_token,
-            "user": user_key,
-            "title": title,
-            "message": message,
-            "sound": sound,
-            "priority": priority,
-            "retry": retry,
-            "expire": expire
-        }
+    data = {
+        "token": api_token,
+        "user": user_key,
+        "title": title,
+        "message": message,
+        "sound": sound,
+        "priority": priority,
+        "retry": retry,
+        "expire": expire
+    }
 
-    logger.debug(f"Pushover data: {data}")
+    logger.debug("Pushover data: %s", data)
 
     try:
-        response = requests.post(
-            "https://api.pushover.net/1/messages.json", data=data, timeout=15
-        )
-        logger.debug(f"Pushover response: {response.text}")
-    except requests.exceptions.RequestException as error:
-        logger.error(f"Encountered an error while sending push notification: {error}")
-        # Return with the error status code so that the Lambda function will be retried
-        return error
+        response = http.request("POST", "https://api.pushover.net/1/messages.json", data=data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Pushover response: %s", response.text)
+    except http.RequestException as error:
+        logger.error("Encountered an error while sending push notification: %s", error)
+        return {"ok": False, "status_code": None, "error": str(error)}
 
     if response.status_code != 200:
-        logger.error(f"Failed to send push notification: {response.text}")
+        logger.error("Failed to send push notification: %s", response.text)
+        return {"ok": False, "status_code": response.status_code, "error": response.text}
+
+    return {"ok": True, "status_code": response.status_code, "error": None}
+
+
+def filter_ignored_messages(messages):
+    """
+    Drop the messages whose text or municipality contains an ignored keyword.
+    :param messages: The new messages, as returned by store_threads_and_messages.
+    :return: The messages that should be notified about.
+    """
+    keyword_filter = get_filter(storage.get_storage(KEYWORDS_TABLE_NAME, ("id",)))
+
+    kept = []
+    for message in messages:
+        keyword = keyword_filter.match(message.text, message.municipality)
+        if keyword:
+            logger.info("Message %s contains ignored keyword '%s', not notifying", message.id, keyword)
+        else:
+            kept.append(message)
+    return kept
+
+
+def truncate_message(text, limit=PUSHOVER_MESSAGE_LIMIT):
+    """
+    Shorten a text to fit in a Pushover message.
+    :param text: The text.
+    :param limit: The maximum number of characters.
+    :return: The text, cut off with an ellipsis if it was too long.
+    """
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1] + "…"
+
+
+def build_notification(message, index, count):
+    """
+    Build the Pushover notification for a new message.
+    :param message: The new message, as returned by store_threads_and_messages.
+    :param index: The position of the notification in this run.
+    :param count: The number of notifications in this run.
+    :return: A dict with the title, message, sound and priority, and the message ids it covers.
+    """
+    # Customizing the notification title based on the message type
+    title_prefix = "NY ALARM" if message.new_thread else "ALARM UPDATE"
+    title = f"{title_prefix} - {message.category}: {message.municipality}"
+
+    # Adjust sound for multiple notifications to avoid being annoying
+    sound = "none" if count > 1 and index > 0 else "MotorolaAlarm"
+
+    if message.new_thread:
+        # If this is a new thread, we want to send a high priority notification
+        # to make sure the user sees it
+        alarm_priority = 2
+    else:
+        # If this is an update to an existing thread, we want to send a normal priority notification
+        # to avoid being annoying
+        alarm_priority = 0
+
+    return {
+        "title": title,
+        "message": truncate_message(message.text),
+        "sound": sound,
+        "priority": alarm_priority,
+        "message_ids": [message.id],
+    }
+
+
+def build_digest_notification(messages, index, count):
+    """
+    Merge several messages from the same thread into one notification.
+    :param messages: The new messages of one thread, in the order they were returned.
+    :param index: The position of the notification in this run.
+    :param count: The number of notifications in this run.
+    :return: A notification like build_notification(), with the highest priority of the messages.
+    """
+    notifications = [build_notification(message, index, count) for message in messages]
+
+    # The first message decides the title, a new thread is always first in its thread
+    title = f"{notifications[0]['title']} ({len(messages)} meldinger)"
+    text = "\n\n".join(message.text for message in messages)
+
+    return {
+        "title": title,
+        "message": truncate_message(text),
+        "sound": notifications[0]["sound"],
+        "priority": max(notification["priority"] for notification in notifications),
+        "message_ids": [message.id for message in messages],
+    }
+
+
+def build_notifications(messages, threshold=None, min_thread_updates=None):
+    """
+    Build the notifications for a run, coalescing bursts into one digest per thread.
+    When the run has more than `threshold` messages, every thread's messages are merged. Otherwise only threads
+    with at least `min_thread_updates` new messages are merged.
+    :param messages: The new messages, as returned by store_threads_and_messages.
+    :param threshold: The number of messages above which every thread is merged. Defaults to DIGEST_THRESHOLD.
+    :param min_thread_updates: The number of messages in one thread that are always merged.
+        Defaults to DIGEST_MIN_THREAD_UPDATES.
+    :return: A list of notifications.
+    """
+    threshold = DIGEST_THRESHOLD if threshold is None else threshold
+    min_thread_updates = DIGEST_MIN_THREAD_UPDATES if min_thread_updates is None else min_thread_updates
+
+    threads = {}
+    for message in messages:
+        threads.setdefault(message.thread_id, []).append(message)
+
+    burst = len(messages) > threshold
+
+    # Each group becomes one notification
+    groups = []
+    for thread_messages in threads.values():
+        if burst or len(thread_messages) >= min_thread_updates:
+            groups.append(thread_messages)
+        else:
+            groups.extend([message] for message in thread_messages)
+
+    notifications = []
+    for index, group in enumerate(groups):
+        if len(group) == 1:
+            notifications.append(build_notification(group[0], index, len(groups)))
+        else:
+            notifications.append(build_digest_notification(group, index, len(groups)))
+
+    if len(notifications) < len(messages):
+        logger.info("Coalesced %d messages into %d notifications", len(messages), len(notifications))
+
+    return notifications
+
+
+def dispatch_notifications(notifications, user_key, api_token, max_workers=None):
+    """
+    Send several notifications concurrently over the shared keep-alive HTTP session.
+    :param notifications: A list of dicts from build_notifications().
+    :param user_key: The user key obtained from the Pushover app.
+    :param api_token: The API token for your Pushover application.
+    :param max_workers: The maximum number of notifications in flight. Defaults to PUSHOVER_MAX_WORKERS.
+    :return: A list of delivery results from notify(), in the same order as the notifications.
+    """
+    if not notifications:
+        return []
+
+    max_workers = min(max_workers or PUSHOVER_MAX_WORKERS, len(notifications))
+
+    def send(notification):
+        return notify(
+            title=notification["title"],
+            message=notification["message"],
+            user_key=user_key,
+            api_token=api_token,
+            sound=notification["sound"],
+            priority=notification["priority"],
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(send, notifications))
 
 
 def create_database(dynamodb, table_name=TABLE_NAME):
@@ -149,7 +587,7 @@ def create_database(dynamodb, table_name=TABLE_NAME):
     try:
         dynamodb.meta.client.describe_table(TableName=table_name)
     except dynamodb.meta.client.exceptions.ResourceNotFoundException as error:
-        logger.info(f"Table {table_name} does not exist. Creating table...")
+        logger.info("Table %s does not exist. Creating table...", table_name)
 
         try:
             # Create the DynamoDB table.
@@ -186,15 +624,16 @@ def create_database(dynamodb, table_name=TABLE_NAME):
                 # },
                 GlobalSecondaryIndexes=[
                     {
-                        'IndexName': 'DisctrictIndex',
+                        'IndexName': 'DistrictIndex',
                         'KeySchema': [
                             {
                                 'AttributeName': 'district',
                                 'KeyType': 'HASH'
                             }
                         ],
+                        # Only the keys, so the index doesn't hold a second copy of every message
                         'Projection': {
-                            'ProjectionType': 'ALL'
+                            'ProjectionType': 'KEYS_ONLY'
                         }
                     }
                 ]
@@ -202,150 +641,471 @@ def create_database(dynamodb, table_name=TABLE_NAME):
 
             table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
 
-            logger.info(f"Created table {table.table_name} successfully.")
+            # Let DynamoDB delete messages once they expire, see common.archive
+            table.meta.client.update_time_to_live(
+                TableName=table_name,
+                TimeToLiveSpecification={'Enabled': True, 'AttributeName': archive.TTL_ATTRIBUTE},
+            )
+
+            logger.info("Created table %s successfully.", table.table_name)
             return 200
 
-        except ClientError as e:
+        except dynamodb.meta.client.exceptions.ClientError as e:
             # Handle specific DynamoDB errors or general AWS service errors
             error_code = e.response['Error']['Code']
             if error_code == 'ResourceInUseException':
                 logger.warning("Table already exists. Cannot create the table.")
             else:
-                logger.error(f"An error occurred: {e.response['Error']['Message']}")
+                logger.error("An error occurred: %s", e.response['Error']['Message'])
 
         except Exception as e:
             # Handle other Python errors
-            logger.error(f"An unexpected error occurred: {str(e)}")
+            logger.error("An unexpected error occurred: %s", e)
 
-    logger.info(f"Table {table_name} already exists.")
+    logger.info("Table %s already exists.", table_name)
     return 200
 
 
-def store_thread_and_messages(table, thread_entry):
-    new_messages = []
-    thread_id = thread_entry["id"]
-    existing_thread = False
+def thread_summary(thread_entry):
+    """
+    Build the summary item of a thread, what we have stored of it in one small item.
+    :param thread_entry: The Thread.
+    :return: The item, with the "updatedOn", "messageCount" and "messageIds" of the thread.
+    """
+    summary = {
+        "thread_id": thread_entry.id,
+        "message_id": SUMMARY_MESSAGE_ID,
+        "updatedOn": thread_entry.updated_on,
+        "messageCount": len(thread_entry.messages),
+        "messageIds": {message.id for message in thread_entry.messages},
+    }
+    return with_expiry(summary)
+
+
+def with_expiry(item):
+    """
+    Set the TTL of an item, unless entries are kept forever.
+    :param item: The item.
+    :return: The item.
+    """
+    expiry = archive.expires_at()
+    if expiry is not None:
+        item[archive.TTL_ATTRIBUTE] = expiry
+    return item
 
+
+def summary_matches(summary, thread_entry):
+    """
+    Check if a thread is unchanged since its summary was stored.
+    :param summary: The summary item, see thread_summary().
+    :param thread_entry: The Thread.
+    :return: True if the thread has the same "updatedOn" and messages as the summary.
+    """
+    return (
+        summary.get("updatedOn") == thread_entry.updated_on
+        and summary.get("messageCount") == len(thread_entry.messages)
+        and all(message.id in summary["messageIds"] for message in thread_entry.messages)
+    )
+
+
+def load_thread_summaries(entries, thread_ids):
+    """
+    Read the summary items of threads with a single batched read.
+    :param entries: The storage of the entries table.
+    :param thread_ids: The IDs of the threads.
+    :return: A dict of thread ID to summary, with "messageIds" as a set. Threads without a summary are left out.
+    :raises DatabaseUnavailableException: If the database could not be read.
+    """
+    if not thread_ids:
+        return {}
+
+    keys = [{"thread_id": thread_id, "message_id": SUMMARY_MESSAGE_ID} for thread_id in thread_ids]
     try:
-        # Check if the thread already exists
-        response = table.get_item(Key={"thread_id": thread_id, "message_id": thread_id})
-        if "Item" in response:
-            existing_thread = True
-            logger.info(f"Thread {thread_id} already exists in the database")
-    except ClientError as error:
-        logger.debug(f"Key not found: {error.response['Error']['Message']}")
+        items = entries.get_items(keys)
+    except StorageException as error:
+        raise DatabaseUnavailableException(f"Error accessing database: {error}") from error
+
+    # DynamoDB hands back a string set, SQLite a list
+    return {item["thread_id"]: {**item, "messageIds": set(item.get("messageIds", ()))} for item in items}
+
+
+def store_threads_and_messages(entries, thread_entries, claim=False):
+    """
+    Stores all new messages from the API payload in the database.
+    Keys this container has already seen stored are skipped. The other threads are checked against their summary item
+    first, so a thread that hasn't changed costs one read however many messages it has. Only the messages missing from
+    the summaries are checked with a single batched read, and the new messages are written with a batch writer,
+    instead of one round trip per message.
+    With claim, each new message is written with a conditional put instead, so when two pollers overlap only the one
+    whose write lands reports the message as new.
+    :param entries: The storage of the entries table.
+    :param thread_entries: The list of Threads, see common.models.
+    :param claim: Claim each new message with a conditional write rather than batch writing them.
+    :return: A list of the new Messages, each with new_thread set.
+    :raises DatabaseUnavailableException: If the database could not be read or written.
+    """
+    new_messages = []
+
+    # Collect every key we haven't seen, the thread marker and all of its messages
+    existing = set()
+    unseen = {}
+    for thread_entry in thread_entries:
+        thread_id = thread_entry.id
+        for message_id in [thread_id] + [message.id for message in thread_entry.messages]:
+            if (thread_id, message_id) in _seen:
+                existing.add((thread_id, message_id))
+            else:
+                unseen.setdefault(thread_id, []).append(message_id)
+
+    # Everything in a summary is stored, and a thread with a summary exists, so only the rest is checked one by one
+    summaries = load_thread_summaries(entries, list(unseen))
+    changed_threads = []
+    keys = []
+    for thread_entry in thread_entries:
+        thread_id = thread_entry.id
+        if thread_id not in unseen:
+            continue
 
-    for index, message in enumerate(thread_entry["messages"]):
-        message_id = message["id"]
+        summary = summaries.get(thread_id)
+        if summary is not None:
+            known = {(thread_id, thread_id)} | {(thread_id, message_id) for message_id in summary["messageIds"]}
+            _seen.update(known)
+            existing |= known
+            if summary_matches(summary, thread_entry):
+                logger.debug("Thread %s is unchanged, skipping", thread_id)
+                metrics.add("UnchangedThreads")
+                continue
+
+        if thread_entry.messages:
+            changed_threads.append(thread_entry)
+        keys.extend(
+            {"thread_id": thread_id, "message_id": message_id}
+            for message_id in unseen[thread_id] if (thread_id, message_id) not in existing
+        )
 
+    if keys:
         try:
-            # Check if the message already exists
-            response = table.get_item(Key={"thread_id": thread_id, "message_id": message_id})
-            if "Item" not in response:
-                item = {
-                    "thread_id": thread_id,
-                    "message_id": message_id,
-                    "text": message["text"],
-                    "district": thread_entry["district"],
-                    "municipality": thread_entry["municipality"],
-                    "isActive": thread_entry["isActive"],
-                    "hasImage": message["hasImage"],
-                    "createdOn": thread_entry["createdOn"],
-                    "updatedOn": thread_entry["updatedOn"],
-                    "category": thread_entry["category"],
-                }
-                table.put_item(Item=item)
-                new_message_info = item.copy()
-                new_message_info["new_thread"] = not existing_thread and index == 0
-                new_messages.append(new_message_info)
-                logger.info(f"Stored new message {message_id} in the database")
+            existing_items = entries.get_items(keys, projection=["thread_id", "message_id"])
+        except StorageException as error:
+            raise DatabaseUnavailableException(f"Error accessing database: {error}") from error
+
+        found = {(item["thread_id"], item["message_id"]) for item in existing_items}
+        _seen.update(found)
+        existing |= found
+    new_items = []
+
+    for thread_entry in thread_entries:
+        thread_id = thread_entry.id
+        existing_thread = (thread_id, thread_id) in existing
+
+        if existing_thread:
+            logger.debug("Thread %s already exists in the database", thread_id)
+
+        for index, message in enumerate(thread_entry.messages):
+            message_id = message.id
+
+            if (thread_id, message_id) in existing:
+                logger.debug("Message %s already exists in the database", message_id)
+                continue
+
+            new_items.append(with_expiry(message.to_item()))
+
+            # Guard against the same message showing up twice in one payload
+            existing.add((thread_id, message_id))
+
+            # The Message itself is handed on to the notifications, it shares its fields with the thread
+            message.new_thread = not existing_thread and index == 0
+            new_messages.append(message)
+
+    if new_items:
+        try:
+            if claim:
+                new_items, new_messages = claim_messages(entries, new_items, new_messages)
             else:
-                logger.info(f"Message {message_id} already exists in the database")
-        except ClientError as error:
-            logger.error(f"Error accessing database: {error.response['Error']['Message']}")
+                entries.put_items(new_items)
+        except StorageException as error:
+            raise DatabaseUnavailableException(f"Error accessing database: {error}") from error
+
+        for item in new_items:
+            _seen.add((item["thread_id"], item["message_id"]))
+            logger.info("Stored new message %s in the database", item["message_id"])
+
+    # Only summarize threads once all of their messages are stored
+    if changed_threads:
+        try:
+            entries.put_items([thread_summary(thread_entry) for thread_entry in changed_threads])
+        except StorageException as error:
+            # Without a summary the thread is checked message by message next time, so this is not fatal
+            logger.error("Error saving thread summaries: %s", error)
 
     return new_messages
 
 
+def claim_messages(entries, items, messages):
+    """
+    Write new messages with a conditional put each, the claim and the store in one round trip.
+    :param entries: The storage of the entries table.
+    :param items: The items to write.
+    :param messages: The new Message of each item.
+    :return: The items and messages that were claimed, the rest were stored by someone else in the meantime.
+    :raises StorageException: If the database could not be written.
+    """
+    with ThreadPoolExecutor(max_workers=min(CLAIM_MAX_WORKERS, len(items))) as executor:
+        claimed = list(executor.map(entries.put_item_if_absent, items))
+
+    lost = len(items) - sum(claimed)
+    if lost:
+        metrics.add("LostClaims", lost)
+        logger.info("%d new messages were already claimed by another poller", lost)
+
+    for item, won in zip(items, claimed):
+        if not won:
+            _seen.add((item["thread_id"], item["message_id"]))
+
+    return (
+        [item for item, won in zip(items, claimed) if won],
+        [message for message, won in zip(messages, claimed) if won],
+    )
+
+
+def store_thread_and_messages(entries, thread_entry):
+    """
+    Stores the new messages of a single thread in the database.
+    :param entries: The storage of the entries table.
+    :param thread_entry: The Thread.
+    :return: A list of the new Messages, each with new_thread set.
+    """
+    return store_threads_and_messages(entries, [thread_entry])
+
+
+@metrics.emit_metrics("politiloggen")
 def lambda_handler(context, event):
     """
     The main AWS lambda function handler.
-    :param context: The context object. This is not used.
-    :param event: The event object. This is not used.
+    Phase durations and call counts are written as one EMF log line per invocation, see common.metrics.
+    With POLL_INTERVAL set the invocation keeps polling until it is close to its timeout, see poll_until().
+    :param context: The context object. Only used for the remaining time when polling repeatedly.
+    :param event: The event object. Only used for the remaining time when polling repeatedly.
     :return: 200 if the function executed successfully, 500 otherwise
     """
 
-    # Get the service resource.
-    dynamodb = boto3.resource("dynamodb")
+    # Check if the DynamoDB table exists, once per container. SQLite creates its tables when they are opened.
+    if storage.STORAGE_BACKEND == "dynamodb" and not aws_cache.is_table_verified(TABLE_NAME):
+        # Get the service resource, reused across warm invocations
+        dynamodb = aws_cache.get_resource("dynamodb")
+        try:
+            dynamodb.meta.client.describe_table(TableName=TABLE_NAME)
+        except dynamodb.meta.client.exceptions.ResourceNotFoundException as error:
+            logger.warning("%s", error)
+
+            create_database(dynamodb, TABLE_NAME)
+
+        aws_cache.mark_table_verified(TABLE_NAME)
+
+    # Select the storage for the 'politiloggen-entries' table
+    entries = storage.get_storage(TABLE_NAME, TABLE_KEY_NAMES)
 
-    # Check if the table exists
+    if POLL_INTERVAL <= 0:
+        return poll(entries)
+
+    return poll_until(entries, get_deadline(context, event))
+
+
+def get_deadline(*args):
+    """
+    Work out when to stop polling repeatedly, POLL_DEADLINE_MARGIN seconds before the invocation times out.
+    :param args: The handler arguments, the Lambda context object is picked out of them.
+    :return: The deadline as a time.monotonic() value.
+    """
+    # Lambda passes (event, context), look for the context by what it can do rather than where it is
+    lambda_context = next((arg for arg in args if hasattr(arg, "get_remaining_time_in_millis")), None)
+    if lambda_context is not None:
+        remaining = lambda_context.get_remaining_time_in_millis() / 1000
+    else:
+        remaining = POLL_DURATION + POLL_DEADLINE_MARGIN
+    return time.monotonic() + remaining - POLL_DEADLINE_MARGIN
+
+
+def poll_until(entries, deadline):
+    """
+    Poll every POLL_INTERVAL seconds until the deadline, for alerts faster than the once a minute schedule.
+    Only the invocation holding the polling lease polls, the others return right away. A heartbeat renews the lease
+    in the background, also while a slow poll runs, and it is released at the end. New messages are claimed with
+    conditional writes, so a poller that loses the lease while it is stalled can't notify about the same messages as
+    the one that took over.
+    :param entries: The storage of the entries table.
+    :param deadline: When to stop, as a time.monotonic() value.
+    :return: The response of the last poll.
+    """
+    lease = Lease(entries, {"thread_id": STATE_THREAD_ID, "message_id": "lease#poller"}, LEASE_DURATION)
     try:
-        dynamodb.meta.client.describe_table(TableName=TABLE_NAME)
-    except dynamodb.meta.client.exceptions.ResourceNotFoundException as error:
-        logger.warning(f"{error}")
+        acquired = lease.acquire()
+    except StorageException as error:
+        logger.error("Error acquiring the polling lease: %s", error)
+        return 500
+
+    if not acquired:
+        metrics.add("LeaseBusy")
+        logger.info("Another invocation holds the polling lease, skipping run")
+        return {"statusCode": 200, "body": json.dumps("Ran successfully!")}
+
+    response = None
+    try:
+        with lease.heartbeat():
+            while True:
+                started = time.monotonic()
+                response = poll(entries, claim=True)
+                metrics.add("Polls")
+
+                next_poll = started + POLL_INTERVAL
+                if next_poll < deadline:
+                    time.sleep(max(0.0, next_poll - time.monotonic()))
+
+                if lease.lost is not None:
+                    metrics.add("LeaseLost")
+                    logger.warning("Stopped polling: %s", lease.lost)
+                    break
+                if next_poll >= deadline:
+                    break
+    finally:
+        lease.release()
+
+    return response
+
+
+def poll(entries, claim=False):
+    """
+    Poll every query once, store the new messages and notify about them.
+    :param entries: The storage of the entries table.
+    :param claim: Claim new messages with conditional writes, see store_threads_and_messages().
+    :return: The handler response, 500 if nothing could be polled or stored.
+    """
+    with metrics.phase("LoadState"):
+        specs = get_query_specs(entries)
+        keys = [query_key(spec["district"], spec["categories"]) for spec in specs]
+        load_query_state(entries, keys)
+    _run_stats["runs"] += 1
+
+    # Poll every query at the same time, a slow or failing district must not hold up the others
+    results = []
+    with metrics.phase("Fetch"):
+        executor = ThreadPoolExecutor(max_workers=min(QUERY_MAX_WORKERS, len(specs)))
+        futures = [executor.submit(poll_query, spec, key) for spec, key in zip(specs, keys)]
+        done, _ = wait(futures, timeout=QUERY_TIMEOUT)
+        # Stragglers only talk to the API, so leave them to finish on their own, their district is polled again next run
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        for spec, future in zip(specs, futures):
+            if future not in done:
+                metrics.add("FailedQueries")
+                logger.error("Gave up on %s after %s seconds", spec["district"], QUERY_TIMEOUT)
+                continue
+            try:
+                results.append(future.result())
+            except (ApiUnavailableException, KeyError, ValueError) as error:
+                metrics.add("FailedQueries")
+                logger.error("Failed to poll %s: %s", spec["district"], error)
+
+    if not results:
+        return 500
 
-        create_database(dynamodb, TABLE_NAME)
+    changed = [result for result in results if result["threads"] is not None]
+    if not changed:
+        metrics.add("ShortCircuits")
+        _run_stats["short_circuits"] += 1
+        logger.info(
+            "Payload unchanged, skipping run (short-circuit rate %d/%d in this container)",
+            _run_stats["short_circuits"], _run_stats["runs"],
+        )
+        return {"statusCode": 200, "body": json.dumps("Ran successfully!")}
 
-    # Select the dynamodb table 'rss_entries'
-    table = dynamodb.Table(TABLE_NAME)
-    all_new_messages = []
+    # Parse the threads once, the storage and notifications work on the same Thread and Message objects
+    threads = [Thread.from_api(thread) for thread in merge_threads(result["threads"] for result in changed)]
+    metrics.add("Threads", len(threads))
 
-    # Parse the JSON response from the API
     try:
-        data = fetch_api_data()
-    except ApiUnavailableException as error:
-        logger.error(f"{error}")
+        with metrics.phase("Store"):
+            all_new_messages = store_threads_and_messages(entries, threads, claim=claim)
+    except DatabaseUnavailableException as error:
+        logger.error("%s", error)
         return 500
+    metrics.add("NewMessages", len(all_new_messages))
+
+    # Only move the high-water marks once everything up to them has been stored
+    with metrics.phase("SaveState"):
+        for result in changed:
+            if result["threads"]:
+                save_high_water_mark(entries, result["key"], max(thread["updatedOn"] for thread in result["threads"]))
+            save_payload_digest(entries, result["key"], result["digest"])
 
-    for entry in data["messageThreads"]:
-        new_messages = store_thread_and_messages(table, entry)
-        all_new_messages.extend(new_messages)
+    if all_new_messages:
+        # Messages matching an ignored keyword are stored, so they are not picked up again, but not notified about
+        all_new_messages = filter_ignored_messages(all_new_messages)
 
     # Check how many new messages were found
     new_message_count = len(all_new_messages)
 
-    # Send push notifications for new messages
-    for index, message in enumerate(all_new_messages):
-        logger.info(f"New message [{index}/{new_message_count}]: {message}")
+    if new_message_count:
+        with metrics.phase("Notify"):
+            # Get Pushover details from SSM Parameter Store, in one call and only when there is something to send
+            secrets = aws_cache.get_secrets(["pushover_user_key", "pushover_api_token"])
 
-        # Get Pushover details from SSM Parameter Store
-        pushover_user_key = get_parameter("pushover_user_key")
-        pushover_api_token = get_parameter("pushover_api_token")
+            for index, message in enumerate(all_new_messages):
+                logger.info("New message [%d/%d]: %s", index, new_message_count, message)
 
-        # Customizing the notification title based on the message type
-        title_prefix = "NY ALARM" if message.get("new_thread", False) else "ALARM UPDATE"
-        title = f"{title_prefix} - {message['category']}: {message['municipality']}"
+            notifications = build_notifications(all_new_messages)
+            for notification in notifications:
+                logger.info("Alarm sound: %s, priority: %s", notification["sound"], notification["priority"])
 
-        # Adjust sound for multiple notifications to avoid being annoying
-        sound = "none" if new_message_count > 1 and index > 0 else "MotorolaAlarm"
+            # Send the push notifications
+            results = dispatch_notifications(
+                notifications, secrets["pushover_user_key"], secrets["pushover_api_token"]
+            )
 
-        logger.info(f"Alarm sound: {sound}")
+            failed = [
+                message_id
+                for notification, result in zip(notifications, results) if not result["ok"]
+                for message_id in notification["message_ids"]
+            ]
+            if failed:
+                logger.error(
+                    "Failed to deliver notifications for %d/%d messages: %s", len(failed), new_message_count, failed
+                )
 
-        if message.get("new_thread", False):
-            # If this is a new thread, we want to send a high priority notification
-            # to make sure the user sees it
-            alarm_priority = 2
-        else:
-            # If this is an update to an existing thread, we want to send a normal priority notification
-            # to avoid being annoying
-            alarm_priority = 0
-
-        logger.info(f"Alarm priority: {alarm_priority}")
-
-        # Send the push notification
-        notify(
-            title=title,
-            message=message['text'],
-            user_key=pushover_user_key,
-            api_token=pushover_api_token,
-            sound=sound,
-            priority=alarm_priority
-        )
+            metrics.add("Notifications", len(notifications))
+            metrics.add("FailedNotifications", sum(not result["ok"] for result in results))
+
+    logger.info("HTTP connections: %s", http.connection_stats())
+    logger.info("Seen cache: %s", _seen.stats())
 
     # Return success!
     return {"statusCode": 200, "body": json.dumps("Ran successfully!")}
 
 
+@metrics.emit_metrics("archive")
+def archive_handler(event, context):
+    """
+    Copy the entries that are about to expire to the archive in S3, see common.archive. Run once a day.
+    :param event: The event object. This is not used.
+    :param context: The context object. This is not used.
+    :return: 200 if every table was archived, 500 otherwise
+    """
+    status = 200
+    for table_name, (key_names, date_attribute) in ARCHIVED_TABLES.items():
+        try:
+            with metrics.phase("Archive"):
+                result = archive.export_expiring(storage.get_storage(table_name, key_names), date_attribute)
+        except Exception as error:
+            logger.error("Failed to archive %s: %s", table_name, error)
+            status = 500
+            continue
+
+        metrics.add("ArchivedItems", result["items"])
+        metrics.add("ArchiveSegments", len(result["segments"]))
+
+    return {"statusCode": status, "body": json.dumps("Ran successfully!" if status == 200 else "Archive failed")}
+
+
 # Run the lambda function locally
 if __name__ == "__main__":
     logger.info(lambda_handler(None, None))
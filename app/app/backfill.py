@@ -0,0 +1,173 @@
+"""
+Backfill of the 'politiloggen-entries' table from the history of the API.
+The poller only looks at the last 7 days, so this is how to seed a new table or rebuild one after data loss. It pages
+through any date range with skip/take, holding one page in memory at a time, and stores the messages through the
+same path as the poller, at a limited write rate and without sending any notifications. Progress is checkpointed
+after every page, so running the same backfill again picks up where it stopped.
+
+Usage:
+    python backfill.py --from 2023-01-01 --to 2023-07-01 --district "Sør-Vest politidistrikt" --category Savnet
+"""
+
+import argparse
+import os
+
+from datetime import datetime, timedelta, timezone
+
+import app
+from common import storage
+from common.init_logging import setup_logger
+from common.models import Thread
+from common.storage import StorageException, ThrottledStorage
+
+# Get the logger
+logger = setup_logger(__name__)
+
+# How many threads to ask for per page
+BACKFILL_PAGE_SIZE = int(os.environ.get("BACKFILL_PAGE_SIZE", 50))
+
+# The maximum number of items written per second, so the backfill doesn't eat the capacity the poller needs
+BACKFILL_WRITE_RATE = float(os.environ.get("BACKFILL_WRITE_RATE", 25))
+
+# Backfilled messages are never notified, so a range reaching into the poller's window could swallow new messages
+RECENT_DAYS = 7
+
+
+def checkpoint_key(district, categories, date_from, date_to):
+    """
+    Build the key of the checkpoint item of a backfill, one per query and date range.
+    :return: The key dict.
+    """
+    query = app.query_key(district, categories)
+    return {
+        "thread_id": app.STATE_THREAD_ID,
+        "message_id": f"backfill#{query}#{date_from:%Y-%m-%d}#{date_to:%Y-%m-%d}",
+    }
+
+
+def load_checkpoint(entries, key):
+    """
+    Load how far a backfill has come.
+    :param entries: The storage of the entries table.
+    :param key: The key of the checkpoint item, see checkpoint_key().
+    :return: The checkpoint, a fresh one if the backfill hasn't started.
+    """
+    item = entries.get_item(key) or {}
+    return {
+        "page": int(item.get("page", 0)),
+        "pageSize": int(item["pageSize"]) if "pageSize" in item else None,
+        "threads": int(item.get("threads", 0)),
+        "messages": int(item.get("messages", 0)),
+        "done": bool(item.get("done", False)),
+    }
+
+
+def backfill(entries, district, categories, date_from, date_to, page_size=None, write_rate=None, max_pages=None,
+             allow_recent=False):
+    """
+    Store every message of the threads in a date range.
+    :param entries: The storage of the entries table.
+    :param district: The police district.
+    :param categories: The list of categories.
+    :param date_from: The start of the range, a datetime. Without a timezone it is taken to be in UTC.
+    :param date_to: The end of the range, a datetime. Without a timezone it is taken to be in UTC.
+    :param page_size: The number of threads per page. Defaults to BACKFILL_PAGE_SIZE, a resumed backfill keeps its own.
+    :param write_rate: The maximum number of items written per second. Defaults to BACKFILL_WRITE_RATE.
+    :param max_pages: Stop after this many pages, to be resumed later. Defaults to running to the end.
+    :param allow_recent: Allow a range within RECENT_DAYS, whose messages would then not be notified by the poller.
+    :return: The checkpoint, with the "page" reached, the "threads" and new "messages" seen and whether it is "done".
+    :raises ValueError: If the range reaches into the last RECENT_DAYS and allow_recent is not set.
+    :raises app.ApiUnavailableException: If a page could not be fetched, the backfill can be resumed.
+    :raises app.DatabaseUnavailableException: If a page could not be stored, the backfill can be resumed.
+    """
+    date_from, date_to = app.as_utc(date_from), app.as_utc(date_to)
+    if not allow_recent and date_to > datetime.now(timezone.utc) - timedelta(days=RECENT_DAYS):
+        raise ValueError(f"The range ends within the last {RECENT_DAYS} days, where the poller notifies new messages")
+
+    key = checkpoint_key(district, categories, date_from, date_to)
+    try:
+        checkpoint = load_checkpoint(entries, key)
+    except StorageException as error:
+        raise app.DatabaseUnavailableException(f"Error reading backfill checkpoint: {error}") from error
+
+    if checkpoint["done"]:
+        logger.info("Backfill of %s is already done", key["message_id"])
+        return checkpoint
+
+    # Pages are counted in the page size the backfill started with
+    page_size = checkpoint["pageSize"] = checkpoint["pageSize"] or page_size or BACKFILL_PAGE_SIZE
+    writer = ThrottledStorage(entries, write_rate or BACKFILL_WRITE_RATE)
+    pages = 0
+
+    while not checkpoint["done"] and (max_pages is None or pages < max_pages):
+        threads = [
+            Thread.from_api(thread)
+            for thread in app.fetch_page(district, categories, checkpoint["page"], date_from, date_to, page_size)
+        ]
+
+        # The same dedup as the poller, the new messages it returns are only counted, never notified
+        new_messages = app.store_threads_and_messages(writer, threads)
+
+        checkpoint["page"] += 1
+        checkpoint["threads"] += len(threads)
+        checkpoint["messages"] += len(new_messages)
+        checkpoint["done"] = len(threads) < page_size
+        pages += 1
+
+        try:
+            entries.put_item({**key, **checkpoint})
+        except StorageException as error:
+            raise app.DatabaseUnavailableException(f"Error saving backfill checkpoint: {error}") from error
+
+        logger.info(
+            "Backfilled page %d: %d threads, %d new messages (%d threads, %d messages so far)",
+            checkpoint["page"], len(threads), len(new_messages), checkpoint["threads"], checkpoint["messages"],
+        )
+
+    return checkpoint
+
+
+def parse_date(value):
+    """
+    Parse a date or timestamp from the command line, e.g. 2023-07-01, 2023-07-01T00:00+02:00 or 2023-07-01T00:00Z.
+    :param value: The ISO 8601 string.
+    :return: The datetime in UTC, see app.as_utc().
+    :raises argparse.ArgumentTypeError: If the value is not an ISO 8601 date.
+    """
+    # fromisoformat only understands the Z suffix from Python 3.11
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    try:
+        return app.as_utc(datetime.fromisoformat(value))
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"not an ISO 8601 date: {value!r}") from error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill politiloggen-entries from the history of the API.")
+    parser.add_argument("--from", dest="date_from", required=True, type=parse_date,
+                        help="The start of the range, e.g. 2023-01-01")
+    parser.add_argument("--to", dest="date_to", required=True, type=parse_date,
+                        help="The end of the range, e.g. 2023-07-01")
+    parser.add_argument("--district", default=app.DISTRICT)
+    parser.add_argument("--category", dest="categories", action="append",
+                        help=f"A category, can be repeated (default: {', '.join(app.CATEGORIES)})")
+    parser.add_argument("--page-size", type=int, default=BACKFILL_PAGE_SIZE)
+    parser.add_argument("--rate", type=float, default=BACKFILL_WRITE_RATE, help="Maximum items written per second")
+    parser.add_argument("--allow-recent", action="store_true",
+                        help=f"Allow a range within the last {RECENT_DAYS} days, its messages won't be notified")
+    args = parser.parse_args()
+
+    entries = storage.get_storage(app.TABLE_NAME, app.TABLE_KEY_NAMES)
+    try:
+        checkpoint = backfill(
+            entries, args.district, args.categories or app.CATEGORIES, args.date_from, args.date_to,
+            page_size=args.page_size, write_rate=args.rate, allow_recent=args.allow_recent,
+        )
+    except ValueError as error:
+        parser.error(str(error))
+    logger.info("Backfill stopped: %s", checkpoint)
+
+
+if __name__ == "__main__":
+    main()
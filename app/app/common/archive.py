@@ -0,0 +1,220 @@
+"""
+Retention and archiving of entries.
+Entries are written with an "expires_at" attribute, so DynamoDB deletes them through TTL after RETENTION_DAYS. Before
+they expire, the exporter copies them to S3 as gzipped JSON Lines, partitioned by the date of the entry:
+
+    <ARCHIVE_PREFIX>/<table>/dt=<YYYY-MM-DD>/part-<run>-<n>.jsonl.gz
+
+so the history stays queryable offline with anything that reads JSONL (Athena, DuckDB, jq). Any S3-compatible store
+works, point AWS_ENDPOINT_URL_S3 at it.
+"""
+
+import gzip
+import io
+import json
+import os
+import time
+import uuid
+
+from calendar import timegm
+
+from common import aws_cache
+from common.init_logging import setup_logger
+from common.storage import json_default
+
+# Get the logger
+logger = setup_logger(__name__)
+
+# The attribute DynamoDB TTL is enabled on, in epoch seconds
+TTL_ATTRIBUTE = "expires_at"
+
+# How long entries are kept before they expire, 0 keeps them forever
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 365))
+
+# Where the archive is written
+ARCHIVE_BUCKET = os.environ.get("ARCHIVE_BUCKET")
+ARCHIVE_PREFIX = os.environ.get("ARCHIVE_PREFIX", "archive")
+
+# Entries that expire within this many days are archived, it must be longer than the time between exports
+ARCHIVE_HORIZON_DAYS = int(os.environ.get("ARCHIVE_HORIZON_DAYS", 7))
+
+# Uncompressed bytes per segment before a new one is started
+ARCHIVE_SEGMENT_BYTES = int(os.environ.get("ARCHIVE_SEGMENT_BYTES", 8 * 1024 * 1024))
+
+DAY = 24 * 60 * 60
+
+
+def expires_at(retention_days=None, now=None):
+    """
+    Work out the TTL of an item written now.
+    :param retention_days: How many days to keep the item. Defaults to RETENTION_DAYS.
+    :param now: The current time in epoch seconds. Defaults to the wall clock.
+    :return: The expiry in epoch seconds, or None if items are kept forever.
+    """
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    if retention_days <= 0:
+        return None
+    return int(now if now is not None else time.time()) + retention_days * DAY
+
+
+def item_date(item, date_attribute):
+    """
+    Get the date an item is partitioned by.
+    :param item: The item.
+    :param date_attribute: The attribute holding an ISO 8601 date or timestamp, e.g. "createdOn".
+    :return: The date as YYYY-MM-DD, or None if the item has no date, like the pollers' state items.
+    """
+    value = item.get(date_attribute)
+    if not isinstance(value, str) or len(value) < 10:
+        return None
+    return value[:10]
+
+
+def item_expiry(item, date_attribute, retention_days=None):
+    """
+    Get when an item expires. Items written before TTL was introduced expire RETENTION_DAYS after their date.
+    :param item: The item.
+    :param date_attribute: The attribute holding the date of the item.
+    :param retention_days: How many days items are kept. Defaults to RETENTION_DAYS.
+    :return: The expiry in epoch seconds, or None if the item never expires.
+    """
+    if item.get(TTL_ATTRIBUTE) is not None:
+        return int(item[TTL_ATTRIBUTE])
+
+    date = item_date(item, date_attribute)
+    if date is None:
+        return None
+    return expires_at(retention_days, now=timegm(time.strptime(date, "%Y-%m-%d")))
+
+
+class SegmentWriter:
+    """
+    Writes the items of one date partition as gzipped JSONL segments, uploading each segment once it is full.
+    """
+
+    def __init__(self, client, bucket, key_prefix, segment_bytes):
+        """
+        :param client: The S3 client.
+        :param bucket: The bucket.
+        :param key_prefix: The key of the segments up to the part number.
+        :param segment_bytes: Uncompressed bytes per segment.
+        """
+        self.client = client
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        self.segment_bytes = segment_bytes
+        self.keys = []
+        self._start()
+
+    def _start(self):
+        self.buffer = io.BytesIO()
+        self.gzip = gzip.GzipFile(fileobj=self.buffer, mode="wb")
+        self.size = 0
+
+    def write(self, item):
+        line = json.dumps(item, separators=(",", ":"), ensure_ascii=False, default=json_default) + "\n"
+        encoded = line.encode("utf-8")
+        self.gzip.write(encoded)
+        self.size += len(encoded)
+        if self.size >= self.segment_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Upload the current segment, if it has anything in it, and start a new one.
+        """
+        if not self.size:
+            return
+
+        self.gzip.close()
+        key = f"{self.key_prefix}-{len(self.keys):04d}.jsonl.gz"
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=self.buffer.getvalue(),
+            ContentType="application/x-ndjson", ContentEncoding="gzip",
+        )
+        self.keys.append(key)
+        self._start()
+
+
+def load_watermark(client, bucket, key):
+    """
+    Read how far a table has been archived.
+    :return: The expiry in epoch seconds up to which every item has been archived, 0 if nothing has.
+    """
+    try:
+        return json.loads(client.get_object(Bucket=bucket, Key=key)["Body"].read())["expiresBefore"]
+    except client.exceptions.NoSuchKey:
+        return 0
+    except client.exceptions.ClientError as error:
+        # Without s3:ListBucket, S3 answers a missing key with 403 rather than NoSuchKey
+        if error.response["Error"]["Code"] in ("404", "403", "AccessDenied"):
+            logger.warning("No watermark at s3://%s/%s: %s", bucket, key, error)
+            return 0
+        raise
+
+
+def export_expiring(storage, date_attribute, bucket=None, prefix=None, horizon_days=None, segment_bytes=None,
+                    retention_days=None, now=None):
+    """
+    Archive the items of a table that expire before the horizon and haven't been archived yet.
+    A watermark next to the segments records the expiry up to which the table has been archived, so every item is
+    exported once however often this runs. Items without an expiry, written before TTL was introduced, get one.
+    :param storage: The storage of the table.
+    :param date_attribute: The attribute holding the date of each item, items without it are never archived.
+    :param bucket: The bucket. Defaults to ARCHIVE_BUCKET.
+    :param prefix: The key prefix. Defaults to ARCHIVE_PREFIX.
+    :param horizon_days: Archive items expiring within this many days. Defaults to ARCHIVE_HORIZON_DAYS.
+    :param segment_bytes: Uncompressed bytes per segment. Defaults to ARCHIVE_SEGMENT_BYTES.
+    :param retention_days: How many days items are kept. Defaults to RETENTION_DAYS.
+    :param now: The current time in epoch seconds. Defaults to the wall clock.
+    :return: A dict with the number of "items" archived, the "segments" written and the new "watermark".
+    """
+    bucket = bucket or ARCHIVE_BUCKET
+    prefix = prefix or ARCHIVE_PREFIX
+    horizon_days = ARCHIVE_HORIZON_DAYS if horizon_days is None else horizon_days
+    segment_bytes = segment_bytes or ARCHIVE_SEGMENT_BYTES
+    if not bucket:
+        raise ValueError("No archive bucket, set ARCHIVE_BUCKET")
+
+    client = aws_cache.get_client("s3")
+    watermark_key = f"{prefix}/{storage.name}/_watermark.json"
+    watermark = load_watermark(client, bucket, watermark_key)
+    cutoff = int(now if now is not None else time.time()) + horizon_days * DAY
+
+    # One file name per run, so a run never overwrites the segments of an earlier one
+    run = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + "-" + uuid.uuid4().hex[:8]
+    writers = {}
+    backfill = []
+    count = 0
+
+    for item in storage.scan():
+        expiry = item_expiry(item, date_attribute, retention_days)
+        if expiry is None or not watermark <= expiry < cutoff:
+            continue
+
+        date = item_date(item, date_attribute)
+        if date is None:
+            continue
+
+        if date not in writers:
+            key_prefix = f"{prefix}/{storage.name}/dt={date}/part-{run}"
+            writers[date] = SegmentWriter(client, bucket, key_prefix, segment_bytes)
+        writers[date].write(item)
+        count += 1
+
+        if item.get(TTL_ATTRIBUTE) is None:
+            backfill.append({**item, TTL_ATTRIBUTE: expiry})
+
+    for writer in writers.values():
+        writer.flush()
+
+    # Only move the watermark once every segment is uploaded. A failed run is repeated in full, which can archive an
+    # item twice but never skips one.
+    client.put_object(Bucket=bucket, Key=watermark_key, Body=json.dumps({"expiresBefore": cutoff}).encode("utf-8"))
+
+    if backfill:
+        storage.put_items(backfill)
+
+    segments = [key for writer in writers.values() for key in writer.keys]
+    logger.info("Archived %d items of %s in %d segments", count, storage.name, len(segments))
+    return {"items": count, "segments": segments, "watermark": cutoff}
@@ -0,0 +1,130 @@
+"""
+Module level cache for AWS clients, resources and secrets.
+Lambda keeps the module loaded between warm invocations, so anything stored here is only created once per container
+instead of once per invocation (or worse, once per message). boto3 is imported when the first client or resource is
+created rather than at module load.
+"""
+
+import os
+import time
+
+from common import metrics
+from common.init_logging import setup_logger
+
+# Get the logger
+logger = setup_logger(__name__)
+
+# How long secrets are kept before they are fetched again from SSM
+SECRETS_TTL = int(os.environ.get("SECRETS_TTL", 900))
+
+# GetParameters accepts at most 10 names per request
+GET_PARAMETERS_LIMIT = 10
+
+_clients = {}
+_resources = {}
+_verified_tables = set()
+_secrets = {}
+_secrets_fetched_at = None
+
+
+def get_client(service):
+    """
+    Get a cached boto3 client for a service.
+    :param service: The name of the service, e.g. "ssm".
+    :return: The boto3 client.
+    """
+    if service not in _clients:
+        import boto3
+
+        _clients[service] = metrics.instrument(boto3.client(service))
+    return _clients[service]
+
+
+def get_resource(service):
+    """
+    Get a cached boto3 resource for a service.
+    :param service: The name of the service, e.g. "dynamodb".
+    :return: The boto3 resource.
+    """
+    if service not in _resources:
+        import boto3
+
+        _resources[service] = boto3.resource(service)
+        metrics.instrument(_resources[service].meta.client)
+    return _resources[service]
+
+
+def is_table_verified(table_name):
+    """
+    Check if we have already verified that a table exists in this container.
+    :param table_name: The name of the table.
+    :return: True if the table is known to exist, False otherwise.
+    """
+    return table_name in _verified_tables
+
+
+def mark_table_verified(table_name):
+    """
+    Remember that a table exists so we don't have to describe it again.
+    :param table_name: The name of the table.
+    """
+    _verified_tables.add(table_name)
+
+
+def get_secrets(names):
+    """
+    Get decrypted parameters from SSM Parameter Store.
+    All names are fetched in one GetParameters call and cached for SECRETS_TTL seconds.
+    :param names: The names of the parameters.
+    :return: A dict of name to value. Parameters that could not be found are None.
+    """
+    global _secrets_fetched_at
+
+    from botocore.exceptions import ClientError
+
+    expired = _secrets_fetched_at is None or time.monotonic() - _secrets_fetched_at > SECRETS_TTL
+    missing = [name for name in names if name not in _secrets]
+
+    if expired or missing:
+        # When the cache has expired, refresh everything we know about together with the new names
+        wanted = sorted(set(names) | set(_secrets)) if expired else missing
+
+        fetched = {}
+        try:
+            for start in range(0, len(wanted), GET_PARAMETERS_LIMIT):
+                response = get_client("ssm").get_parameters(
+                    Names=wanted[start:start + GET_PARAMETERS_LIMIT], WithDecryption=True
+                )
+                for parameter in response["Parameters"]:
+                    fetched[parameter["Name"]] = parameter["Value"]
+                for name in response.get("InvalidParameters", []):
+                    # Remember missing parameters too, so we don't ask for them on every call
+                    logger.error("Parameter %s does not exist", name)
+                    fetched[name] = None
+        except ClientError as error:
+            logger.error("Encountered an error while retrieving parameters: %s", error)
+            # Keep serving the values we already have rather than failing the whole run
+            return {name: _secrets.get(name) for name in names}
+
+        if expired:
+            _secrets.clear()
+            _secrets_fetched_at = time.monotonic()
+        _secrets.update(fetched)
+
+    return {name: _secrets.get(name) for name in names}
+
+
+def invalidate(secrets_only=False):
+    """
+    Drop the cached state, e.g. after rotating the Pushover credentials.
+    :param secrets_only: Only drop the secrets and keep the clients, resources and verified tables.
+    """
+    global _secrets_fetched_at
+
+    _secrets.clear()
+    _secrets_fetched_at = None
+
+    if not secrets_only:
+        _clients.clear()
+        _resources.clear()
+        _verified_tables.clear()
@@ -0,0 +1,86 @@
+"""
+Helpers for talking to DynamoDB in bulk.
+"""
+
+import time
+
+from common.init_logging import setup_logger
+
+# Get the logger
+logger = setup_logger(__name__)
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+
+# How many times to retry unprocessed keys before giving up
+MAX_UNPROCESSED_RETRIES = 5
+
+
+class UnprocessedKeysException(Exception):
+    """
+    Exception for when DynamoDB keeps returning unprocessed keys.
+    """
+    pass
+
+
+def _chunks(items, size):
+    """
+    Split a list into chunks of at most `size` items.
+    :param items: The list to split.
+    :param size: The maximum size of each chunk.
+    :return: A generator of chunks.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def batch_get_items(table, keys, projection=None):
+    """
+    Fetch many items from a table with BatchGetItem.
+    The keys are de-duplicated, split into chunks of 100 and any unprocessed keys are retried with
+    exponential backoff.
+    :param table: The DynamoDB Table resource.
+    :param keys: A list of key dicts, e.g. [{"thread_id": "1", "message_id": "2"}].
+    :param projection: Optional list of attribute names to return. Defaults to the whole item.
+    :return: A list of the items that exist in the table.
+    """
+    client = table.meta.client
+
+    # BatchGetItem rejects requests that contain the same key twice
+    unique_keys = []
+    seen = set()
+    for key in keys:
+        marker = tuple(sorted(key.items()))
+        if marker not in seen:
+            seen.add(marker)
+            unique_keys.append(key)
+
+    items = []
+    for chunk in _chunks(unique_keys, BATCH_GET_LIMIT):
+        request = {"Keys": chunk}
+        if projection:
+            # Use expression attribute names so reserved words are safe to project
+            names = {f"#p{index}": name for index, name in enumerate(projection)}
+            request["ProjectionExpression"] = ", ".join(names)
+            request["ExpressionAttributeNames"] = names
+
+        request_items = {table.name: request}
+        attempt = 0
+
+        while True:
+            response = client.batch_get_item(RequestItems=request_items)
+            # The resource's client already converts between DynamoDB and Python types
+            items.extend(response.get("Responses", {}).get(table.name, []))
+
+            request_items = response.get("UnprocessedKeys") or {}
+            if not request_items:
+                break
+
+            attempt += 1
+            if attempt > MAX_UNPROCESSED_RETRIES:
+                raise UnprocessedKeysException(f"Gave up on {len(request_items[table.name]['Keys'])} unprocessed keys")
+
+            logger.warning("Retrying %d unprocessed keys (attempt %d)", len(request_items[table.name]["Keys"]), attempt)
+            time.sleep(min(0.05 * 2 ** attempt, 1))
+
+    return items
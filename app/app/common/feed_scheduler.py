@@ -0,0 +1,130 @@
+"""
+Adaptive per-feed polling for the long-running local notifier.
+Every feed has its own schedule. The interval follows how often the feed has posted lately, between FEED_MIN_INTERVAL
+and FEED_MAX_INTERVAL: it is halved right after a new post, as posts tend to come in bursts, and grows with jitter
+while the feed is quiet, so a feed that posts once a week isn't fetched as often as one that posts every few minutes.
+"""
+
+import asyncio
+import os
+import random
+import time
+
+from common.init_logging import setup_logger
+
+# Get the logger
+logger = setup_logger(__name__)
+
+# Bounds of the polling interval of a feed, in seconds
+FEED_MIN_INTERVAL = int(os.environ.get("FEED_MIN_INTERVAL", 30))
+FEED_MAX_INTERVAL = int(os.environ.get("FEED_MAX_INTERVAL", 1800))
+
+# How many times to poll a feed in the time it usually takes to post
+FEED_POLLS_PER_POST = 4
+
+# How much the interval of a quiet feed grows per poll
+FEED_BACKOFF = 1.5
+
+# Each wait is randomly up to this fraction shorter or longer, so feeds don't end up polled in lockstep
+FEED_JITTER = 0.2
+
+# How many of the latest posts the posting frequency is worked out from
+FEED_HISTORY = 20
+
+
+class FeedSchedule:
+    """
+    When to poll one feed next. Times are wall clock seconds, as the publish times of the posts are.
+    """
+
+    def __init__(self, feed_url, min_interval=None, max_interval=None, rng=None):
+        """
+        :param feed_url: The URL of the feed.
+        :param min_interval: The shortest interval. Defaults to FEED_MIN_INTERVAL.
+        :param max_interval: The longest interval. Defaults to FEED_MAX_INTERVAL.
+        :param rng: The random number generator for the jitter. Defaults to the random module.
+        """
+        self.feed_url = feed_url
+        self.min_interval = min_interval or FEED_MIN_INTERVAL
+        self.max_interval = max_interval or FEED_MAX_INTERVAL
+        self.rng = rng or random
+        self.interval = self.min_interval
+        self.next_poll = 0.0
+        # The publish times of the latest posts, oldest first
+        self.post_times = []
+
+    def clamp(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def frequency_interval(self, now):
+        """
+        The interval that follows the recent posting frequency of the feed.
+        The time since the last post counts as a gap too, so the interval of a feed that has gone quiet grows.
+        :param now: The current time.
+        :return: The interval in seconds, or None if we know of no posts.
+        """
+        if not self.post_times:
+            return None
+        mean_gap = max(now - self.post_times[0], 0) / len(self.post_times)
+        return mean_gap / FEED_POLLS_PER_POST
+
+    def update(self, post_times, now):
+        """
+        Work out the next poll after polling the feed.
+        :param post_times: The publish times of the posts in the feed, or None if it was unchanged or not fetched.
+        :param now: The current time.
+        :return: The number of seconds until the next poll.
+        """
+        new_post = bool(post_times) and (not self.post_times or max(post_times) > self.post_times[-1])
+        if post_times:
+            self.post_times = sorted(set(self.post_times) | set(post_times))[-FEED_HISTORY:]
+
+        target = self.frequency_interval(now) or self.max_interval
+        if new_post:
+            self.interval = self.clamp(min(self.interval, target) / 2)
+        else:
+            self.interval = self.clamp(min(self.interval * FEED_BACKOFF, target))
+
+        delay = self.interval * self.rng.uniform(1 - FEED_JITTER, 1 + FEED_JITTER)
+        self.next_poll = now + delay
+        return delay
+
+
+async def run_feed(schedule, poll, stop):
+    """
+    Poll one feed on its schedule until stopped.
+    :param schedule: The FeedSchedule of the feed.
+    :param poll: The function that checks a feed, see run().
+    :param stop: The asyncio.Event that stops polling.
+    """
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=max(schedule.next_poll - time.time(), 0))
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            post_times = await asyncio.to_thread(poll, schedule.feed_url)
+        except Exception as error:
+            # A broken feed backs off like a quiet one, it must not stop the others
+            logger.error("Error polling %s: %s", schedule.feed_url, error)
+            post_times = None
+
+        delay = schedule.update(post_times, time.time())
+        logger.info("Polling %s again in %.0f seconds", schedule.feed_url, delay)
+
+
+async def run(feed_urls, poll, stop=None):
+    """
+    Poll every feed on its own adaptive schedule.
+    :param feed_urls: The URLs of the feeds.
+    :param poll: The function that checks a feed, run in a worker thread. It is called with the URL of the feed and
+        returns the publish times of the posts in it, or None if the feed was unchanged or could not be fetched.
+    :param stop: Optional asyncio.Event that stops the scheduler. Runs forever without one.
+    :return: The schedule of each feed.
+    """
+    stop = stop or asyncio.Event()
+    schedules = [FeedSchedule(feed_url) for feed_url in feed_urls]
+    await asyncio.gather(*(run_feed(schedule, poll, stop) for schedule in schedules))
+    return schedules
@@ -0,0 +1,182 @@
+"""
+Shared HTTP client for all outbound calls.
+The session lives at module level, so connections are kept alive across warm Lambda invocations. Idempotent requests
+are retried on timeouts, connection errors and 5xx responses with jittered exponential backoff, within a total deadline.
+Other requests, like a POST to Pushover, are only retried when the connection could not be made, so nothing was sent.
+requests is only imported when the first request is sent, to keep it out of the cold start.
+"""
+
+import os
+import random
+import time
+
+from urllib.parse import urlsplit
+
+from common import metrics
+from common.init_logging import setup_logger
+
+# Get the logger
+logger = setup_logger(__name__)
+
+# How many connections to keep open per host, at least as many as we send concurrently
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 10))
+
+# Timeout in seconds for a single attempt, per host
+HOST_TIMEOUTS = {
+    "politiloggen-vis-frontend.bks-prod.politiet.no": 10,
+    "api.pushover.net": 15,
+    "nitter.net": 10,
+}
+DEFAULT_TIMEOUT = 10
+
+# Total time in seconds we are willing to spend on one request, including retries
+DEFAULT_DEADLINE = 30
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 4
+
+# Methods that are safe to send again after a failure that may have reached the server
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_session = None
+
+
+def get_session():
+    """
+    Get the shared requests session, creating it on first use.
+    :return: The requests session.
+    """
+    global _session
+
+    if _session is None:
+        import requests
+
+        from requests.adapters import HTTPAdapter
+
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def get_timeout(url):
+    """
+    Get the timeout for a single attempt against the host of a URL.
+    :param url: The URL.
+    :return: The timeout in seconds.
+    """
+    return HOST_TIMEOUTS.get(urlsplit(url).hostname, DEFAULT_TIMEOUT)
+
+
+def backoff_delay(attempt):
+    """
+    Get the delay before the next attempt, using exponential backoff with full jitter.
+    :param attempt: The number of attempts made so far, starting at 1.
+    :return: The delay in seconds.
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def was_not_sent(error):
+    """
+    Check if a failed request never reached the server, so it can be sent again whatever its method.
+    :param error: The exception raised by requests.
+    :return: True if the connection could not be made.
+    """
+    import requests
+    import urllib3
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # A refused connection or failed DNS lookup, rather than a connection dropped while waiting for the response
+        return isinstance(getattr(error.args[0], "reason", None), urllib3.exceptions.NewConnectionError)
+    return False
+
+
+def request(method, url, deadline=DEFAULT_DEADLINE, max_attempts=MAX_ATTEMPTS, idempotent=None, **kwargs):
+    """
+    Send a request over the shared session, retrying transient failures.
+    :param method: The HTTP method, e.g. "GET".
+    :param url: The URL.
+    :param deadline: The total time budget in seconds, including retries and backoff.
+    :param max_attempts: The maximum number of attempts.
+    :param idempotent: Whether the request can be sent twice, e.g. a POST that only runs a search. Defaults to
+        whether the method is in IDEMPOTENT_METHODS. Other requests are only retried if they were never sent.
+    :param kwargs: Passed on to requests, e.g. json, data or headers.
+    :return: The response. A 5xx response is returned as is once we run out of attempts or time.
+    :raises requests.exceptions.RequestException: If the last attempt failed without a response.
+    """
+    import requests
+
+    session = get_session()
+    started = time.monotonic()
+    timeout = kwargs.pop("timeout", None) or get_timeout(url)
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    attempt = 0
+
+    while True:
+        attempt += 1
+        remaining = deadline - (time.monotonic() - started)
+
+        try:
+            response = session.request(method, url, timeout=min(timeout, max(remaining, 0.1)), **kwargs)
+            error = None
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exception:
+            response = None
+            error = exception
+
+        metrics.record_http_status(response.status_code if response is not None else None)
+
+        if error is None and response.status_code < 500:
+            return response
+
+        # The server may have acted on the request already, sending it again would repeat that
+        retryable = idempotent or (error is not None and was_not_sent(error))
+
+        delay = backoff_delay(attempt)
+        remaining = deadline - (time.monotonic() - started)
+        if not retryable or attempt >= max_attempts or delay >= remaining:
+            if error is not None:
+                raise error
+            return response
+
+        reason = error if error is not None else f"HTTP {response.status_code}"
+        logger.warning("%s %s failed (%s), retrying in %.2fs (attempt %d)", method, url, reason, delay, attempt)
+        time.sleep(delay)
+
+
+def connection_stats():
+    """
+    Count the connections opened and reused by the shared session since it was created.
+    :return: A dict with "requests", "opened" and "reused".
+    """
+    if _session is None:
+        return {"requests": 0, "opened": 0, "reused": 0}
+
+    opened = 0
+    sent = 0
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            sent += pool.num_requests
+
+    return {"requests": sent, "opened": opened, "reused": max(sent - opened, 0)}
+
+
+def __getattr__(name):
+    """
+    Expose requests' RequestException as http.RequestException, without importing requests until it is used.
+    :param name: The name of the attribute.
+    :return: The exception class.
+    """
+    if name == "RequestException":
+        import requests
+
+        return requests.exceptions.RequestException
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,5 +1,21 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import sys
+import time
+
+# INFO unless LOG_LEVEL says otherwise, DEBUG logs whole payloads
+DEFAULT_LOG_LEVEL = "INFO"
+
+# Set LOG_QUEUE=1 to hand records to a background thread, so writing them never blocks the caller.
+# Best for the local runners, in Lambda the thread is frozen between invocations and lines show up late.
+LOG_QUEUE = os.environ.get("LOG_QUEUE", "").lower() in ("1", "true", "yes")
+
+_handler = None
+_listener = None
 
 
 class CustomFormatter(logging.Formatter):
@@ -21,12 +37,83 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + error_format + reset,
     }
 
+    def __init__(self):
+        super().__init__()
+        # Build the formatters once, not for every record
+        self.formatters = {level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno) or self.formatters[logging.INFO]
         return formatter.format(record)
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    One compact JSON object per record, for CloudWatch Logs Insights.
+    """
+
+    def format(self, record):
+        document = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.levelno >= logging.WARNING:
+            document["location"] = f"{record.filename}:{record.lineno}"
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        return json.dumps(document, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class JsonMessageFormatter(logging.Formatter):
+    def format(self, record):
+        # The message is the document itself, the record's own fields are left out
+        return json.dumps(record.msg, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def get_handler():
+    """
+    Get the handler shared by every module logger, creating it on first use.
+    Lambda gets JSON lines on stdout, anywhere else gets coloured text on stderr. With LOG_QUEUE the real handler sits
+    behind a QueueHandler and a QueueListener thread.
+    :return: The handler
+    """
+    global _handler, _listener
+
+    if _handler is not None:
+        return _handler
+
+    # Check if running in AWS Lambda
+    if os.environ.get("AWS_EXECUTION_ENV") is not None:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler = logging.StreamHandler()
+        handler.setFormatter(CustomFormatter())
+
+    if LOG_QUEUE:
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_listener)
+        handler = logging.handlers.QueueHandler(log_queue)
+
+    _handler = handler
+    return _handler
+
+
+def stop_listener():
+    """
+    Stop the queue listener thread, if there is one, after it has written every queued record.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def setup_logger(name):
     """
     Set up a logger for the module
@@ -35,19 +122,36 @@ def setup_logger(name):
     """
     # Set up logging
     logger = logging.getLogger(name)
-    logger.setLevel(os.environ.get("LOG_LEVEL", "DEBUG"))
+    logger.setLevel(os.environ.get("LOG_LEVEL", DEFAULT_LOG_LEVEL))
 
     # If the logger already has handlers, we don't need to add them again.
     if logger.handlers:
         return logger
 
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
+    logger.addHandler(get_handler())
 
-    # Check if running in AWS Lambda
-    if os.environ.get("AWS_EXECUTION_ENV") is None:
-        ch.setFormatter(CustomFormatter())
-        logger.addHandler(ch)
+    # Lambda also puts a handler on the root logger, don't write every line twice
+    logger.propagate = False
+
+    return logger
+
+
+def setup_metrics_logger():
+    """
+    Set up the logger for metrics in CloudWatch Embedded Metric Format.
+    Every record is written to stdout as a bare JSON line, as CloudWatch only extracts metrics from log lines that are
+    a JSON object.
+    :return: The logger
+    """
+    logger = logging.getLogger("metrics")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    if logger.handlers:
+        return logger
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonMessageFormatter())
+    logger.addHandler(handler)
 
     return logger
@@ -0,0 +1,147 @@
+"""
+Filter for ignored keywords.
+The keywords are loaded from the 'ignored_keywords' DynamoDB table and compiled into a single regular expression, so
+a text is checked against every keyword in one pass. The compiled filter is cached across warm invocations and only
+rebuilt when the version of the keywords changes.
+"""
+
+import os
+import re
+import time
+import unicodedata
+
+from common.init_logging import setup_logger
+from common.storage import StorageException
+
+# Get the logger
+logger = setup_logger(__name__)
+
+KEYWORDS_TABLE_NAME = 'ignored_keywords'
+
+# How long a compiled filter is used before checking if the keywords have changed
+KEYWORD_CACHE_TTL = int(os.environ.get("KEYWORD_CACHE_TTL", 60))
+
+# Swedish and Danish spellings of the Norwegian letters show up in names and places
+_NORWEGIAN_FOLDS = str.maketrans({"ö": "ø", "ä": "æ"})
+
+_filter = None
+_loaded_at = 0.0
+
+
+def normalize(text):
+    """
+    Normalize a text for case-insensitive matching of Norwegian text.
+    Composes characters (so "å" typed as "a" and a combining ring matches "å"), folds case and maps ö/ä to ø/æ.
+    :param text: The text.
+    :return: The normalized text.
+    """
+    return unicodedata.normalize("NFC", text).casefold().translate(_NORWEGIAN_FOLDS)
+
+
+class KeywordFilter:
+    """
+    A compiled set of ignored keywords.
+    """
+
+    def __init__(self, keywords, version=None):
+        """
+        :param keywords: The keywords to ignore. Matching is case-insensitive and matches anywhere in the text.
+        :param version: The version of the keywords in DynamoDB, used to tell when they have changed.
+        """
+        self.version = version
+
+        # Map the normalized form back to the keyword as it was configured, for reporting
+        self.keywords = {normalize(keyword): keyword for keyword in keywords if keyword.strip()}
+
+        if self.keywords:
+            # Longest first, so "oslofjorden" is reported rather than "oslo"
+            alternatives = sorted(self.keywords, key=len, reverse=True)
+            self.pattern = re.compile("|".join(re.escape(keyword) for keyword in alternatives))
+        else:
+            self.pattern = None
+
+    def match(self, *texts):
+        """
+        Find the first ignored keyword in any of the texts.
+        :param texts: The texts to check. None is allowed and ignored.
+        :return: The keyword that matched, or None if no keyword matched.
+        """
+        if self.pattern is None:
+            return None
+
+        for text in texts:
+            if not text:
+                continue
+            found = self.pattern.search(normalize(text))
+            if found:
+                return self.keywords[found.group(0)]
+        return None
+
+
+def load_version(storage):
+    """
+    Load only the version of the ignored keywords, which is bumped on every change.
+    :param storage: The storage of the 'ignored_keywords' table.
+    :return: The version, or None if there are no keywords.
+    """
+    item = storage.get_item({"id": "keywords"}, projection=["version"]) or {}
+    return item.get("version")
+
+
+def load_keywords(storage):
+    """
+    Load the ignored keywords from DynamoDB.
+    All keywords live in a single item, {"id": "keywords", "keywords": <string set>, "version": <number>}, maintained by
+    add_keyword and remove_keyword.
+    :param storage: The storage of the 'ignored_keywords' table.
+    :return: A tuple of the list of keywords and the version, (None, None) if the keywords item doesn't exist.
+    """
+    item = storage.get_item({"id": "keywords"})
+    if item is None:
+        return None, None
+    return list(item.get("keywords", [])), item.get("version")
+
+
+def get_filter(storage, default=()):
+    """
+    Get the compiled keyword filter.
+    Once KEYWORD_CACHE_TTL has passed, the version is checked and the keywords are only loaded and compiled again if
+    they have changed.
+    :param storage: The storage of the 'ignored_keywords' table.
+    :param default: Keywords to use if the table can't be read and nothing is cached, or has no keywords item, like
+        a table that hasn't been seeded with db/generate_ignored_keywords_table.py yet.
+    :return: The KeywordFilter.
+    """
+    global _filter, _loaded_at
+
+    if _filter is not None and time.monotonic() - _loaded_at < KEYWORD_CACHE_TTL:
+        return _filter
+
+    try:
+        if _filter is not None and load_version(storage) == _filter.version:
+            _loaded_at = time.monotonic()
+            return _filter
+
+        keywords, version = load_keywords(storage)
+        if keywords is None:
+            # An unseeded table is not the same as a deliberately empty keyword set
+            logger.warning("No ignored keywords item in %s, using the %d default keywords", storage.name, len(default))
+            keywords = default
+    except StorageException as error:
+        logger.error("Encountered an error while loading ignored keywords: %s", error)
+        # Keep using the filter we have rather than suddenly notifying about everything
+        return _filter or KeywordFilter(default)
+
+    _filter = KeywordFilter(keywords, version)
+    _loaded_at = time.monotonic()
+    logger.info("Loaded %d ignored keywords (version %s)", len(_filter.keywords), version)
+    return _filter
+
+
+def invalidate():
+    """
+    Drop the cached filter, so the keywords are loaded again on the next call.
+    """
+    global _filter
+
+    _filter = None
@@ -0,0 +1,131 @@
+"""
+A lease kept in a storage item, so only one poller runs at a time.
+The holder writes its owner ID and an expiry time with a conditional write, and renews it from a background thread
+(the heartbeat) while it keeps polling, so a slow poll doesn't outlive the lease. Anyone can take over a lease that has
+expired, so a crashed poller only blocks the others until then.
+"""
+
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+
+from common.init_logging import setup_logger
+from common.storage import StorageException
+
+# Get the logger
+logger = setup_logger(__name__)
+
+
+class LeaseLostException(Exception):
+    """
+    Exception for when a lease has been taken over by someone else.
+    """
+    pass
+
+
+def now_ms():
+    """
+    The wall clock time in milliseconds, shared by every poller holding or waiting for a lease.
+    :return: The time as an int.
+    """
+    return int(time.time() * 1000)
+
+
+class Lease:
+    """
+    A lease on a single item, held for a number of seconds at a time.
+    """
+
+    def __init__(self, storage, key, duration, owner=None):
+        """
+        :param storage: The storage the lease item is kept in.
+        :param key: The key dict of the lease item.
+        :param duration: How many seconds the lease is held after each acquire or renew.
+        :param owner: The ID of the holder. Defaults to a random one.
+        """
+        self.storage = storage
+        self.key = key
+        self.duration = duration
+        self.owner = owner or uuid.uuid4().hex
+        self.expires_at = 0
+        # Why the heartbeat stopped renewing the lease, None while it is held
+        self.lost = None
+
+    def acquire(self):
+        """
+        Take the lease if it is free or expired, or extend it if we already hold it.
+        :return: True if we hold the lease, False if someone else does.
+        :raises StorageException: If the storage could not be written.
+        """
+        now = now_ms()
+        expires_at = now + int(self.duration * 1000)
+        item = {**self.key, "owner": self.owner, "expiresAt": expires_at}
+
+        if not self.storage.put_item_if_expired(item, "expiresAt", now, "owner"):
+            return False
+
+        self.expires_at = expires_at
+        return True
+
+    def renew(self):
+        """
+        Extend the lease, the heartbeat of the holder.
+        :raises LeaseLostException: If someone else has taken over the lease.
+        """
+        if not self.acquire():
+            self.expires_at = 0
+            raise LeaseLostException(f"Lease {self.key} was taken over")
+
+    @contextmanager
+    def heartbeat(self, interval=None):
+        """
+        Keep renewing the lease from a background thread for as long as the block runs.
+        If a renewal fails, the heartbeat stops and the reason is left in `lost`, for the holder to check when it can
+        stop safely.
+        :param interval: Seconds between renewals. Defaults to a third of the duration, so one missed renewal is
+            survived.
+        :return: A context manager yielding the lease.
+        """
+        interval = interval or self.duration / 3
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.renew()
+                except (LeaseLostException, StorageException) as error:
+                    logger.warning("Heartbeat of lease %s stopped: %s", self.key, error)
+                    self.lost = error
+                    return
+
+        thread = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self):
+        """
+        Give up the lease, so the next poller can take it right away instead of waiting for it to expire.
+        """
+        if not self.held:
+            return
+
+        item = {**self.key, "owner": self.owner, "expiresAt": 0}
+        try:
+            self.storage.put_item_if_expired(item, "expiresAt", now_ms(), "owner")
+        except StorageException as error:
+            # It expires on its own
+            logger.warning("Error releasing lease %s: %s", self.key, error)
+        self.expires_at = 0
+
+    @property
+    def held(self):
+        """
+        Whether we hold the lease, as far as we know.
+        """
+        return self.expires_at > now_ms()
@@ -0,0 +1,181 @@
+"""
+Per-invocation metrics in CloudWatch Embedded Metric Format (EMF).
+Each handler run collects phase durations and counters in memory and writes them as a single JSON log line at the
+end, which CloudWatch turns into metrics without any PutMetricData calls.
+"""
+
+import functools
+import threading
+import time
+
+from contextlib import contextmanager
+
+from common.init_logging import setup_metrics_logger
+
+# Get the logger the EMF lines are written to
+metrics_logger = setup_metrics_logger()
+
+NAMESPACE = "Politiloggen"
+
+# DynamoDB operations counted as reads and writes
+DYNAMODB_READS = {"GetItem", "BatchGetItem", "Query", "Scan", "DescribeTable"}
+DYNAMODB_WRITES = {"PutItem", "BatchWriteItem", "UpdateItem", "DeleteItem"}
+
+
+class Metrics:
+    """
+    The metrics of one invocation. Safe to update from the worker threads of the handler.
+    """
+
+    def __init__(self, function):
+        """
+        :param function: The name of the handler, used as the metric dimension.
+        """
+        self.function = function
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, value=1, unit="Count"):
+        """
+        Add to a metric, creating it if needed.
+        :param name: The name of the metric.
+        :param value: The amount to add.
+        :param unit: The CloudWatch unit of the metric.
+        """
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def set_property(self, name, value):
+        """
+        Attach a value to the log line that is searchable in CloudWatch Logs but not a metric.
+        :param name: The name of the property.
+        :param value: The value, anything JSON serializable.
+        """
+        with self.lock:
+            self.properties[name] = value
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase of the handler, recorded as "<name>Duration" in milliseconds.
+        :param name: The name of the phase, e.g. "Fetch".
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}Duration", round((time.perf_counter() - started) * 1000, 3), "Milliseconds")
+
+    def document(self):
+        """
+        Build the EMF document.
+        :return: The document as a dict.
+        """
+        with self.lock:
+            values = dict(self.values)
+            units = dict(self.units)
+            properties = dict(self.properties)
+
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Function"]],
+                    "Metrics": [{"Name": name, "Unit": units[name]} for name in values],
+                }],
+            },
+            "Function": self.function,
+            **properties,
+            **values,
+        }
+
+    def flush(self):
+        """
+        Write the metrics as one EMF log line.
+        """
+        metrics_logger.info(self.document())
+
+
+# The metrics of the running invocation, or None outside a handler
+_current = None
+
+
+def current():
+    """
+    Get the metrics of the running invocation.
+    :return: The Metrics, or a throwaway one outside of a handler so callers never have to check.
+    """
+    return _current or Metrics("none")
+
+
+def add(name, value=1, unit="Count"):
+    """
+    Add to a metric of the running invocation, see Metrics.add().
+    """
+    if _current is not None:
+        _current.add(name, value, unit)
+
+
+def phase(name):
+    """
+    Time a phase of the running invocation, see Metrics.phase().
+    """
+    return current().phase(name)
+
+
+def record_http_status(status_code):
+    """
+    Count an HTTP response by status class, or a request that got no response at all.
+    :param status_code: The status code, or None for a connection error or timeout.
+    """
+    add(f"HTTP{status_code // 100}xx" if status_code else "HTTPErrors")
+
+
+def _count_aws_call(model, **kwargs):
+    if model.service_model.service_name != "dynamodb":
+        return
+    if model.name in DYNAMODB_READS:
+        add("DynamoDBReads")
+    elif model.name in DYNAMODB_WRITES:
+        add("DynamoDBWrites")
+
+
+def instrument(client):
+    """
+    Count the DynamoDB reads and writes made through a boto3 client.
+    :param client: The boto3 client, e.g. resource.meta.client.
+    :return: The client.
+    """
+    client.meta.events.register("after-call", _count_aws_call, unique_id="politiloggen-metrics")
+    return client
+
+
+def emit_metrics(function):
+    """
+    Decorator for a Lambda handler that collects metrics for each invocation and writes them when it returns.
+    :param function: The name of the handler, used as the metric dimension.
+    :return: The decorator.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            global _current
+
+            _current = Metrics(function)
+            started = time.perf_counter()
+            result = None
+            try:
+                result = handler(*args, **kwargs)
+                return result
+            finally:
+                _current.add("TotalDuration", round((time.perf_counter() - started) * 1000, 3), "Milliseconds")
+                status = result.get("statusCode") if isinstance(result, dict) else result
+                _current.set_property("StatusCode", status)
+                _current.flush()
+                _current = None
+        return wrapper
+    return decorator
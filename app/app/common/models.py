@@ -0,0 +1,89 @@
+"""
+Typed model of the politiloggen threads and messages.
+Threads are parsed once from the API JSON. Every message keeps a reference to its thread rather than a copy of the
+thread's fields, and is turned into a database item or read by the notification code without copying it again.
+"""
+
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class Thread:
+    """
+    A thread from the API, an incident with the messages posted about it.
+    """
+    id: str
+    district: str
+    municipality: str
+    is_active: bool
+    created_on: str
+    updated_on: str
+    category: str
+    messages: list = field(default_factory=list)
+
+    @classmethod
+    def from_api(cls, data):
+        """
+        Parse a thread from the API.
+        :param data: A thread from "messageThreads".
+        :return: The Thread, with its messages.
+        """
+        thread = cls(
+            id=data["id"],
+            district=data["district"],
+            municipality=data["municipality"],
+            is_active=data["isActive"],
+            created_on=data["createdOn"],
+            updated_on=data["updatedOn"],
+            category=data["category"],
+        )
+        thread.messages = [
+            Message(id=message["id"], text=message["text"], has_image=message["hasImage"], thread=thread)
+            for message in data["messages"]
+        ]
+        return thread
+
+
+@dataclass(slots=True)
+class Message:
+    """
+    A message in a thread. The fields of the thread are read through it, not copied.
+    """
+    id: str
+    text: str
+    has_image: bool
+    # Left out of repr and comparisons, the thread refers back to its messages
+    thread: Thread = field(repr=False, compare=False)
+    # Whether the message starts a thread we haven't seen before, set when it is stored
+    new_thread: bool = False
+
+    @property
+    def thread_id(self):
+        return self.thread.id
+
+    @property
+    def municipality(self):
+        return self.thread.municipality
+
+    @property
+    def category(self):
+        return self.thread.category
+
+    def to_item(self):
+        """
+        Build the database item of the message, with the fields of its thread.
+        :return: The item.
+        """
+        thread = self.thread
+        return {
+            "thread_id": thread.id,
+            "message_id": self.id,
+            "text": self.text,
+            "district": thread.district,
+            "municipality": thread.municipality,
+            "isActive": thread.is_active,
+            "hasImage": self.has_image,
+            "createdOn": thread.created_on,
+            "updatedOn": thread.updated_on,
+            "category": thread.category,
+        }
@@ -0,0 +1,98 @@
+"""
+In-process cache of IDs we know are already stored.
+Most of the IDs a poller checks were already seen by the same warm container a minute earlier, so a hit here skips
+the DynamoDB read entirely. Only IDs confirmed stored (found in, or written to, the database) are added, so a hit
+is always exact; a miss falls through to DynamoDB.
+"""
+
+import os
+import sys
+
+from collections import OrderedDict
+
+# How many IDs to remember per cache, the least recently used are dropped first
+SEEN_CACHE_SIZE = int(os.environ.get("SEEN_CACHE_SIZE", 10000))
+
+
+class SeenCache:
+    """
+    A bounded LRU set of IDs, meant to live at module level so it survives warm invocations.
+    """
+
+    def __init__(self, max_size=None):
+        """
+        :param max_size: The most IDs to keep. Defaults to SEEN_CACHE_SIZE.
+        """
+        self.max_size = max_size or SEEN_CACHE_SIZE
+        self._ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, key):
+        """
+        Check if an ID has been seen, counting the hit or miss and marking it as recently used.
+        :param key: The ID. Any hashable value, e.g. a (thread_id, message_id) tuple.
+        :return: True if the ID is known to be stored.
+        """
+        if key in self._ids:
+            self._ids.move_to_end(key)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def add(self, key):
+        """
+        Remember that an ID is stored, dropping the least recently used ID if the cache is full.
+        :param key: The ID.
+        """
+        self._ids[key] = None
+        self._ids.move_to_end(key)
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def update(self, keys):
+        """
+        Remember that several IDs are stored.
+        :param keys: The IDs.
+        """
+        for key in keys:
+            self.add(key)
+
+    def clear(self):
+        """
+        Forget every ID and reset the counters.
+        """
+        self._ids.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def memory_bytes(self):
+        """
+        Estimate the memory used by the cache, the dict itself plus the IDs it holds.
+        :return: The estimate in bytes.
+        """
+        size = sys.getsizeof(self._ids)
+        for key in self._ids:
+            size += sys.getsizeof(key)
+            if isinstance(key, tuple):
+                size += sum(sys.getsizeof(part) for part in key)
+        return size
+
+    def stats(self):
+        """
+        Report how well the cache is doing in this container.
+        :return: A dict with "size", "hits", "misses", "hit_ratio" and "memory_bytes".
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "memory_bytes": self.memory_bytes(),
+        }
@@ -0,0 +1,499 @@
+"""
+Storage backends for the pollers.
+Everything the pollers persist (messages, seen IDs, keywords, feed and query state) is an item with a one or two part
+key, so a table is accessed through a small Storage interface. DynamoDBStorage is used in Lambda, SQLiteStorage lets
+the local runners and the tests work offline. The backend is picked with the STORAGE_BACKEND environment variable.
+"""
+
+import abc
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from decimal import Decimal
+
+from common import aws_cache
+from common.dynamodb import UnprocessedKeysException, batch_get_items
+from common.init_logging import setup_logger
+
+# Get the logger
+logger = setup_logger(__name__)
+
+# "dynamodb" or "sqlite"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "dynamodb")
+
+# The database file used by the SQLite backend
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "politiloggen.db")
+
+# How many keys to look up per statement, SQLite limits the number of parameters in one statement
+SQLITE_BATCH_SIZE = 400
+
+_connections = {}
+
+# SQLite connections are shared by every table, so access to them is serialized
+_sqlite_lock = threading.RLock()
+
+
+class StorageException(Exception):
+    """
+    Exception for when the storage backend can't be read or written.
+    """
+    pass
+
+
+class Storage(abc.ABC):
+    """
+    A table of items, each identified by the values of its key attributes. A backend implements every method.
+    """
+
+    def __init__(self, name, key_names):
+        """
+        :param name: The name of the table.
+        :param key_names: The key attributes, the partition key and optionally the sort key.
+        """
+        self.name = name
+        self.key_names = tuple(key_names)
+
+    @abc.abstractmethod
+    def get_item(self, key, projection=None):
+        """
+        Get a single item.
+        :param key: The key dict.
+        :param projection: Optional list of attribute names to return. Defaults to the whole item.
+        :return: The item, or None if it doesn't exist.
+        """
+
+    @abc.abstractmethod
+    def get_items(self, keys, projection=None):
+        """
+        Get many items in as few round trips as the backend allows.
+        :param keys: A list of key dicts.
+        :param projection: Optional list of attribute names to return. Defaults to the whole item.
+        :return: A list of the items that exist, in no particular order.
+        """
+
+    @abc.abstractmethod
+    def put_item(self, item):
+        """
+        Create or replace an item.
+        :param item: The item, including its key attributes.
+        """
+
+    @abc.abstractmethod
+    def put_item_if_newer(self, item, attribute):
+        """
+        Create or replace an item, unless the stored item has the same or a newer value for an attribute.
+        :param item: The item, including its key attributes and the attribute.
+        :param attribute: The name of the attribute to compare.
+        :return: True if the item was written, False if the stored item is not older.
+        """
+
+    @abc.abstractmethod
+    def put_item_if_absent(self, item):
+        """
+        Create an item, unless an item with the same key already exists.
+        :param item: The item, including its key attributes.
+        :return: True if the item was written, False if it already existed.
+        """
+
+    @abc.abstractmethod
+    def put_item_if_expired(self, item, attribute, now, owner_attribute):
+        """
+        Create or replace an item, unless the stored item is held by someone else and has not expired yet.
+        Used for leases, the holder renews its own item and anyone can take over an expired one.
+        :param item: The item, including its key attributes, the expiry and the owner.
+        :param attribute: The name of the expiry attribute.
+        :param now: The current time, in the same unit as the expiry.
+        :param owner_attribute: The name of the owner attribute.
+        :return: True if the item was written, False if someone else holds it.
+        """
+
+    @abc.abstractmethod
+    def put_items(self, items):
+        """
+        Create or replace many items in as few round trips as the backend allows.
+        :param items: The items.
+        """
+
+    @abc.abstractmethod
+    def scan(self):
+        """
+        Read every item in the table, a page at a time.
+        :return: A generator of the items, in no particular order.
+        """
+
+
+class DynamoDBStorage(Storage):
+    """
+    Storage backed by a DynamoDB table.
+    Errors from DynamoDB are caught through the client's exceptions, so botocore is only imported once a table is used.
+    """
+
+    def __init__(self, table, key_names):
+        """
+        :param table: The DynamoDB Table resource, or the name of the table to open on first use.
+        :param key_names: The key attributes of the table.
+        """
+        super().__init__(table if isinstance(table, str) else table.name, key_names)
+        self._table = None if isinstance(table, str) else table
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = aws_cache.get_resource("dynamodb").Table(self.name)
+        return self._table
+
+    @property
+    def errors(self):
+        return self.table.meta.client.exceptions
+
+    def get_item(self, key, projection=None):
+        request = {"Key": key}
+        if projection:
+            # Use expression attribute names so reserved words are safe to project
+            names = {f"#p{index}": name for index, name in enumerate(projection)}
+            request["ProjectionExpression"] = ", ".join(names)
+            request["ExpressionAttributeNames"] = names
+
+        try:
+            return self.table.get_item(**request).get("Item")
+        except self.errors.ClientError as error:
+            raise StorageException(f"Error reading {self.name}: {error.response['Error']['Message']}") from error
+
+    def get_items(self, keys, projection=None):
+        try:
+            return batch_get_items(self.table, keys, projection=projection)
+        except (self.errors.ClientError, UnprocessedKeysException) as error:
+            raise StorageException(f"Error reading {self.name}: {error}") from error
+
+    def put_item(self, item):
+        try:
+            self.table.put_item(Item=item)
+        except self.errors.ClientError as error:
+            raise StorageException(f"Error writing {self.name}: {error.response['Error']['Message']}") from error
+
+    def _put_item_if(self, item, condition, names, values=None):
+        """
+        Put an item if a condition holds.
+        The conditional puts are used from worker and heartbeat threads, so they go through the client of the table,
+        which unlike the resource is safe to share between threads. It is the resource's client, so it still takes
+        and converts plain Python values.
+        :param item: The item.
+        :param condition: The condition expression.
+        :param names: The expression attribute names.
+        :param values: The expression attribute values, if any.
+        :return: True if the item was written, False if the condition didn't hold.
+        """
+        request = {"TableName": self.name, "Item": item, "ConditionExpression": condition,
+                   "ExpressionAttributeNames": names}
+        if values:
+            request["ExpressionAttributeValues"] = values
+
+        try:
+            self.table.meta.client.put_item(**request)
+        except self.errors.ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise StorageException(f"Error writing {self.name}: {error.response['Error']['Message']}") from error
+        return True
+
+    def put_item_if_newer(self, item, attribute):
+        return self._put_item_if(
+            item,
+            "attribute_not_exists(#attribute) OR #attribute < :value",
+            {"#attribute": attribute},
+            {":value": item[attribute]},
+        )
+
+    def put_item_if_absent(self, item):
+        return self._put_item_if(item, "attribute_not_exists(#key)", {"#key": self.key_names[0]})
+
+    def put_item_if_expired(self, item, attribute, now, owner_attribute):
+        return self._put_item_if(
+            item,
+            "attribute_not_exists(#attribute) OR #attribute < :now OR #owner = :owner",
+            {"#attribute": attribute, "#owner": owner_attribute},
+            {":now": now, ":owner": item[owner_attribute]},
+        )
+
+    def put_items(self, items):
+        try:
+            # The batch writer takes care of chunking and retrying unprocessed items
+            with self.table.batch_writer(overwrite_by_pkeys=list(self.key_names)) as batch:
+                for item in items:
+                    batch.put_item(Item=item)
+        except self.errors.ClientError as error:
+            raise StorageException(f"Error writing {self.name}: {error.response['Error']['Message']}") from error
+
+    def scan(self):
+        request = {}
+        while True:
+            try:
+                response = self.table.scan(**request)
+            except self.errors.ClientError as error:
+                raise StorageException(f"Error reading {self.name}: {error.response['Error']['Message']}") from error
+
+            yield from response.get("Items", [])
+
+            if "LastEvaluatedKey" not in response:
+                return
+            request["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def json_default(value):
+    """
+    Serialize the types DynamoDB hands us that JSON doesn't know about.
+    :param value: The value.
+    :return: A JSON serializable value.
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Can't store {type(value).__name__} values")
+
+
+def get_connection(path):
+    """
+    Get the shared connection to a SQLite database, opened in WAL mode so readers don't block the writer.
+    :param path: The path of the database file, or ":memory:".
+    :return: The connection.
+    """
+    with _sqlite_lock:
+        if path not in _connections:
+            connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only risks the last transactions on power loss, never corruption
+            connection.execute("PRAGMA synchronous=NORMAL")
+            _connections[path] = connection
+        return _connections[path]
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage backed by a table in a local SQLite database.
+    Items are stored as JSON, keyed on the values of the key attributes.
+    """
+
+    def __init__(self, name, key_names, path=None):
+        """
+        :param name: The name of the table.
+        :param key_names: The key attributes, the partition key and optionally the sort key.
+        :param path: The database file. Defaults to SQLITE_PATH.
+        """
+        super().__init__(name, key_names)
+        if not re.fullmatch(r"[A-Za-z0-9_.-]+", name):
+            raise ValueError(f"Invalid table name: {name}")
+
+        self.connection = get_connection(path or SQLITE_PATH)
+
+        # The composite primary key is the index every lookup goes through
+        with _sqlite_lock:
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{name}" ('
+                f"pk TEXT NOT NULL, sk TEXT NOT NULL DEFAULT '', item TEXT NOT NULL, PRIMARY KEY (pk, sk)"
+                f") WITHOUT ROWID"
+            )
+
+    def _key(self, key):
+        """
+        Turn a key dict into the (pk, sk) of its row.
+        :param key: The key dict, or an item.
+        :return: A tuple of strings.
+        """
+        values = [str(key[name]) for name in self.key_names]
+        return values[0], values[1] if len(values) > 1 else ""
+
+    @staticmethod
+    def _project(item, projection):
+        if not projection:
+            return item
+        return {name: item[name] for name in projection if name in item}
+
+    def _execute(self, statement, rows):
+        """
+        Run a statement for many rows in a single transaction.
+        :param statement: The SQL statement.
+        :param rows: The parameters for each row.
+        :return: The number of rows changed.
+        """
+        try:
+            with _sqlite_lock:
+                cursor = self.connection.cursor()
+                cursor.execute("BEGIN")
+                try:
+                    cursor.executemany(statement, rows)
+                    # Read the count before COMMIT resets it
+                    changed = cursor.rowcount
+                    cursor.execute("COMMIT")
+                except Exception:
+                    cursor.execute("ROLLBACK")
+                    raise
+                return changed
+        except sqlite3.Error as error:
+            raise StorageException(f"Error writing {self.name}: {error}") from error
+
+    def get_item(self, key, projection=None):
+        items = self.get_items([key], projection=projection)
+        return items[0] if items else None
+
+    def get_items(self, keys, projection=None):
+        row_keys = list(dict.fromkeys(self._key(key) for key in keys))
+        items = []
+        try:
+            with _sqlite_lock:
+                for start in range(0, len(row_keys), SQLITE_BATCH_SIZE):
+                    chunk = row_keys[start:start + SQLITE_BATCH_SIZE]
+                    conditions = " OR ".join(["(pk = ? AND sk = ?)"] * len(chunk))
+                    rows = self.connection.execute(
+                        f'SELECT item FROM "{self.name}" WHERE {conditions}',
+                        [value for row_key in chunk for value in row_key],
+                    ).fetchall()
+                    items.extend(self._project(json.loads(row[0]), projection) for row in rows)
+        except sqlite3.Error as error:
+            raise StorageException(f"Error reading {self.name}: {error}") from error
+        return items
+
+    def put_item(self, item):
+        self.put_items([item])
+
+    def put_item_if_newer(self, item, attribute):
+        if not re.fullmatch(r"[A-Za-z0-9_]+", attribute):
+            raise ValueError(f"Invalid attribute name: {attribute}")
+
+        # An upsert that only replaces the row when the stored value is missing or older, in one statement
+        changed = self._execute(
+            f'INSERT INTO "{self.name}" (pk, sk, item) VALUES (?, ?, ?) '
+            f"ON CONFLICT (pk, sk) DO UPDATE SET item = excluded.item "
+            f"WHERE json_extract(item, '$.{attribute}') IS NULL "
+            f"OR json_extract(item, '$.{attribute}') < json_extract(excluded.item, '$.{attribute}')",
+            [(*self._key(item), json.dumps(item, default=json_default))],
+        )
+        return changed > 0
+
+    def put_item_if_absent(self, item):
+        changed = self._execute(
+            f'INSERT INTO "{self.name}" (pk, sk, item) VALUES (?, ?, ?) ON CONFLICT (pk, sk) DO NOTHING',
+            [(*self._key(item), json.dumps(item, default=json_default))],
+        )
+        return changed > 0
+
+    def put_item_if_expired(self, item, attribute, now, owner_attribute):
+        for name in (attribute, owner_attribute):
+            if not re.fullmatch(r"[A-Za-z0-9_]+", name):
+                raise ValueError(f"Invalid attribute name: {name}")
+
+        changed = self._execute(
+            f'INSERT INTO "{self.name}" (pk, sk, item) VALUES (?, ?, ?) '
+            f"ON CONFLICT (pk, sk) DO UPDATE SET item = excluded.item "
+            f"WHERE json_extract(item, '$.{attribute}') IS NULL "
+            f"OR json_extract(item, '$.{attribute}') < ? "
+            f"OR json_extract(item, '$.{owner_attribute}') = json_extract(excluded.item, '$.{owner_attribute}')",
+            [(*self._key(item), json.dumps(item, default=json_default), now)],
+        )
+        return changed > 0
+
+    def put_items(self, items):
+        if not items:
+            return
+        self._execute(
+            f'INSERT OR REPLACE INTO "{self.name}" (pk, sk, item) VALUES (?, ?, ?)',
+            [(*self._key(item), json.dumps(item, default=json_default)) for item in items],
+        )
+
+    def scan(self):
+        # Page through the primary key, the lock is only held while a page is read
+        last_key = ("", "")
+        while True:
+            try:
+                with _sqlite_lock:
+                    rows = self.connection.execute(
+                        f'SELECT pk, sk, item FROM "{self.name}" WHERE (pk, sk) > (?, ?) ORDER BY pk, sk LIMIT ?',
+                        [*last_key, SQLITE_BATCH_SIZE],
+                    ).fetchall()
+            except sqlite3.Error as error:
+                raise StorageException(f"Error reading {self.name}: {error}") from error
+
+            for row in rows:
+                yield json.loads(row[2])
+
+            if len(rows) < SQLITE_BATCH_SIZE:
+                return
+            last_key = rows[-1][0], rows[-1][1]
+
+
+class ThrottledStorage(Storage):
+    """
+    Wraps another storage to write at most a number of items per second, in batches, e.g. for a backfill that must
+    not eat the capacity the pollers need. Reads are passed through as they are.
+    """
+
+    def __init__(self, storage, rate, batch_size=25):
+        """
+        :param storage: The storage to write to.
+        :param rate: The maximum number of items written per second.
+        :param batch_size: The number of items written at a time, at most the 25 of a DynamoDB BatchWriteItem.
+        """
+        super().__init__(storage.name, storage.key_names)
+        self.storage = storage
+        self.rate = rate
+        self.batch_size = batch_size
+        self._next_write = 0.0
+
+    def _wait(self, count):
+        """
+        Sleep until writing a number of items keeps us within the rate.
+        :param count: The number of items about to be written.
+        """
+        now = time.monotonic()
+        if self._next_write > now:
+            time.sleep(self._next_write - now)
+        self._next_write = max(now, self._next_write) + count / self.rate
+
+    def get_item(self, key, projection=None):
+        return self.storage.get_item(key, projection=projection)
+
+    def get_items(self, keys, projection=None):
+        return self.storage.get_items(keys, projection=projection)
+
+    def scan(self):
+        return self.storage.scan()
+
+    def put_item(self, item):
+        self._wait(1)
+        self.storage.put_item(item)
+
+    def put_item_if_newer(self, item, attribute):
+        self._wait(1)
+        return self.storage.put_item_if_newer(item, attribute)
+
+    def put_item_if_absent(self, item):
+        self._wait(1)
+        return self.storage.put_item_if_absent(item)
+
+    def put_item_if_expired(self, item, attribute, now, owner_attribute):
+        self._wait(1)
+        return self.storage.put_item_if_expired(item, attribute, now, owner_attribute)
+
+    def put_items(self, items):
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            self._wait(len(batch))
+            self.storage.put_items(batch)
+
+
+def get_storage(name, key_names):
+    """
+    Get the storage for a table, with the backend selected by STORAGE_BACKEND.
+    :param name: The name of the table.
+    :param key_names: The key attributes of the table.
+    :return: A Storage.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(name, key_names)
+    if STORAGE_BACKEND == "dynamodb":
+        return DynamoDBStorage(name, key_names)
+    raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
@@ -0,0 +1,89 @@
+"""
+Fan-out-on-write of new feed entries to per-user timelines.
+When a poller stores a new entry, a copy is written to the 'user_timeline' table for every user subscribed to the
+feed, so get_tweets can read a user's timeline with a single query. Rows expire through DynamoDB TTL.
+"""
+
+import os
+import time
+
+from common.init_logging import setup_logger
+
+# Get the logger
+logger = setup_logger(__name__)
+
+TIMELINE_TABLE_NAME = 'user_timeline'
+USER_FEEDS_TABLE_NAME = 'user_feeds'
+
+# Index on user_feeds with feed_url as the partition key, to find the subscribers of a feed
+FEED_USERS_INDEX_NAME = 'FeedUsersIndex'
+
+# How long timeline rows are kept before DynamoDB expires them
+TIMELINE_RETENTION_DAYS = int(os.environ.get("TIMELINE_RETENTION_DAYS", 30))
+
+# How long the subscribers of a feed are cached
+SUBSCRIBERS_CACHE_TTL = int(os.environ.get("SUBSCRIBERS_CACHE_TTL", 300))
+
+_subscribers = {}
+
+
+def get_subscribers(dynamodb, feed_url):
+    """
+    Get the users subscribed to a feed, through the reverse feed to users index.
+    :param dynamodb: The DynamoDB resource.
+    :param feed_url: The URL of the feed.
+    :return: A list of user ids.
+    """
+    cached = _subscribers.get(feed_url)
+    if cached and time.monotonic() - cached[0] < SUBSCRIBERS_CACHE_TTL:
+        return cached[1]
+
+    from boto3.dynamodb.conditions import Key
+
+    table = dynamodb.Table(USER_FEEDS_TABLE_NAME)
+    users = []
+    query_kwargs = {"IndexName": FEED_USERS_INDEX_NAME, "KeyConditionExpression": Key("feed_url").eq(feed_url)}
+    while True:
+        response = table.query(**query_kwargs)
+        users.extend(item["user"] for item in response["Items"])
+        if "LastEvaluatedKey" not in response:
+            break
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    _subscribers[feed_url] = (time.monotonic(), users)
+    return users
+
+
+def timeline_item(user, entry):
+    """
+    Build the timeline row of an entry for one user.
+    :param user: The user id.
+    :param entry: A dict with at least "id", "feed_url" and "date" (ISO 8601, so it sorts by time).
+    :return: The item for the user_timeline table.
+    """
+    return {
+        **entry,
+        "user": user,
+        "sort_key": f"{entry['date']}#{entry['id']}",
+        "expires_at": int(time.time()) + TIMELINE_RETENTION_DAYS * 24 * 60 * 60,
+    }
+
+
+def fan_out_entry(dynamodb, entry):
+    """
+    Append a new entry to the timeline of every subscriber of its feed.
+    :param dynamodb: The DynamoDB resource.
+    :param entry: A dict with at least "id", "feed_url" and "date".
+    :return: The number of timelines the entry was written to.
+    """
+    users = get_subscribers(dynamodb, entry["feed_url"])
+    if not users:
+        return 0
+
+    table = dynamodb.Table(TIMELINE_TABLE_NAME)
+    with table.batch_writer(overwrite_by_pkeys=["user", "sort_key"]) as batch:
+        for user in users:
+            batch.put_item(Item=timeline_item(user, entry))
+
+    logger.info("Added entry %s to %d timelines", entry["id"], len(users))
+    return len(users)
@@ -1,27 +1,59 @@
+import calendar
 import json
 import os
-import time
 import random
+import threading
+import time
 
-import pync
-
-import boto3
-import feedparser
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+# pync, feedparser and the AWS clients are loaded on first use, so a cold start doesn't wait for them
+from common import archive, aws_cache, http, metrics, storage
+from common.keyword_filter import KEYWORDS_TABLE_NAME, get_filter
+from common.seen_cache import SeenCache
+from common.timeline import fan_out_entry
 
 # Get DEBUG environment variable
 DEBUG = os.environ.get("DEBUG", False)
 
-# Get the service resource.
-dynamodb = boto3.resource("dynamodb")
-ssm = boto3.client("ssm")
-
-# Select the dynamodb table 'rss_entries'
-table = dynamodb.Table("rss_entries")
-
-# Set the sleep time between checks
-SLEEP_TIME = 60
+# Select the 'rss_entries' table, in DynamoDB or a local SQLite database depending on STORAGE_BACKEND
+table = storage.get_storage("rss_entries", ("id",))
+
+# The ignored keywords, maintained by the add_keyword and remove_keyword functions
+keywords_table = storage.get_storage(KEYWORDS_TABLE_NAME, ("id",))
+
+# How many feeds to fetch at the same time
+FEED_MAX_WORKERS = int(os.environ.get("FEED_MAX_WORKERS", 8))
+
+# ETag and Last-Modified per feed, kept between checks
+feed_states = {}
+
+# Entry ids known to be in the database, kept between checks
+seen_entries = SeenCache()
+
+# The scheduler fetches feeds at the same time, but their entries are processed one feed at a time
+process_lock = threading.Lock()
+
+# Keywords to ignore if the ignored_keywords table can't be read
+IGNORED_KEYWORDS = [
+    "haugesund",
+    "stord",
+    "sveio",
+    "bømlo",
+    "tysvær",
+    "vindafjord",
+    "brann",
+    "ørland",
+    "redningshelikopter rygge",
+    "arendal",
+    "oslo",
+    "bergen",
+    "oslofjorden",
+    "sørlandet",
+    "hordaland",
+    "vestland",
+    "trondheim",
+]
 
 # List of RSS feeds to check
 RSS_FEEDS = [
@@ -36,7 +68,7 @@ def get_parameter(name):
     :param name: The name of the parameter.
     :return: The parameter's value.
     """
-    response = ssm.get_parameter(Name=name, WithDecryption=True)
+    response = aws_cache.get_client("ssm").get_parameter(Name=name, WithDecryption=True)
     return response["Parameter"]["Value"]
 
 
@@ -59,6 +91,8 @@ def notify_local(
     :param tweet_url: The URL to the tweet to open when clicking the notification
     :return: None
     """
+    import pync
+
     pync.notify(
         message=text,
         title=title,
@@ -70,18 +104,44 @@ def notify_local(
     )
 
 
+def entry_item(feed_url, entry):
+    """
+    Build the database item for a feed entry.
+    :param feed_url: The URL of the feed the entry is from.
+    :param entry: The entry, as parsed by feedparser.
+    :return: The item, with the date as sortable ISO 8601 in UTC and the TTL in "expires_at".
+    """
+    published = entry.get("published_parsed") or time.gmtime()
+    item = {
+        "id": entry.id,
+        "feed_url": feed_url,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", published),
+        "title": entry.get("title", ""),
+        "link": entry.get("link", ""),
+        "author": entry.get("author", ""),
+    }
+
+    # Expire the entry after RETENTION_DAYS, archived to S3 first, see common.archive
+    expiry = archive.expires_at()
+    if expiry is not None:
+        item[archive.TTL_ATTRIBUTE] = expiry
+    return item
+
+
 def check_entry(entry_id):
     """
     Check if the id of the entry exists in the database.
     :param entry_id: The id of the entry to check
     :return: True if the entry exists in the database, False otherwise
     """
-    try:
-        # Try to get the item from the DynamoDB table
-        response = table.get_item(Key={"id": entry_id})
+    # Entries we have already seen stored don't need a database read
+    if entry_id in seen_entries:
+        return True
 
-        # If the item exists in the table, the response will contain an 'Item' key
-        if "Item" in response:
+    try:
+        # Try to get the item from the table
+        if table.get_item({"id": entry_id}, projection=["id"]):
+            seen_entries.add(entry_id)
             return True
 
     except Exception as e:
@@ -91,171 +151,275 @@ def check_entry(entry_id):
     return False
 
 
-def lambda_handler(event, context):
-    for feed_url in RSS_FEEDS:
-        # Get the current entries from the RSS feed
-        feed = feedparser.parse(feed_url)
+def load_feed_states(feed_urls):
+    """
+    Load the ETag and Last-Modified headers we last saw for each feed.
+    Only feeds we don't already know about are read, with one batched read.
+    :param feed_urls: The URLs of the feeds.
+    """
+    missing = [feed_url for feed_url in feed_urls if feed_url not in feed_states]
+    if not missing:
+        return
 
-        # Get the author of the tweet
-        tweet_author = feed.feed.title
+    try:
+        items = table.get_items([{"id": f"feed_state_{feed_url}"} for feed_url in missing])
+    except Exception as e:
+        print(f"Encountered an error while loading feed states: {e}")
+        return
 
-        # Get the latest entry
-        latest_entry = feed.entries[0]
+    found = {item["id"]: item for item in items}
+    for feed_url in missing:
+        item = found.get(f"feed_state_{feed_url}", {})
+        feed_states[feed_url] = {"etag": item.get("etag"), "modified": item.get("modified")}
 
-        # Use a unique key for each feed's last_seen_id
-        last_seen_id_key = f"last_seen_id_{feed_url}"
 
-        # Retrieve the last seen entry ID from the database
-        try:
-            last_seen_id = table.get_item(Key={"id": last_seen_id_key})["Item"]["value"]
-        except:
-            last_seen_id = None
+def save_feed_state(feed_url, response):
+    """
+    Remember the ETag and Last-Modified headers of a feed we have processed.
+    :param feed_url: The URL of the feed.
+    :param response: The response the feed was parsed from.
+    """
+    state = {"etag": response.headers.get("ETag"), "modified": response.headers.get("Last-Modified")}
+    if state == feed_states.get(feed_url):
+        return
 
-        # Check if the latest entry is new
+    feed_states[feed_url] = state
+    try:
+        table.put_item({"id": f"feed_state_{feed_url}", **{k: v for k, v in state.items() if v}})
+    except Exception as e:
+        print(f"Encountered an error while saving the state of {feed_url}: {e}")
 
-        if DEBUG:
-            last_seen_id = random.randint(0, 100000000)
 
-        if latest_entry.id != last_seen_id:
-            # Print a log message that no new entry was found
-            print(
-                "New tweet detected, checking if there might be more entries since the last check"
-            )
+def fetch_feed(feed_url):
+    """
+    Fetch a feed with a conditional GET, so unchanged feeds cost a cheap 304 and no parsing.
+    :param feed_url: The URL of the feed.
+    :return: The response, or None if the feed is unchanged or could not be fetched.
+    """
+    state = feed_states.get(feed_url) or {}
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("modified"):
+        headers["If-Modified-Since"] = state["modified"]
+
+    # Get the current entries from the RSS feed over the shared, retrying HTTP session
+    try:
+        response = http.request("GET", feed_url, headers=headers)
+        response.raise_for_status()
+    except http.RequestException as e:
+        print(f"Encountered an error while fetching {feed_url}: {e}")
+        return None
 
-            # If there is a new entry, retrieve the latest 10 entries
-            entries = feed.entries[:10]
+    if response.status_code == 304:
+        print(time.strftime("%H:%M:%S") + f": Feed {feed_url} is unchanged, skipping")
+        return None
 
-            # Reverse the list so that the oldest entry is first
-            entries.reverse()
+    return response
 
-            # Check each entry
-            for entry in entries:
-                # Debug
-                if DEBUG:
-                    # Print the entry title
-                    print("DEBUG: " + time.strftime("%H:%M:%S") + f":")
-                    print(json.dumps(entry, indent=4, sort_keys=True))
 
-                if check_entry(entry.id):
-                    # Print a log message that the entry already exists in the database starting with the current
-                    # time in hh:mm:ss format
-                    print(
-                        time.strftime("%H:%M:%S")
-                        + ": Entry already exists in database, continuing to next entry"
-                    )
+def process_feed(feed_url, feed, keyword_filter):
+    """
+    Check a parsed feed for new entries, notify about them and store them in the database.
+    :param feed_url: The URL of the feed.
+    :param feed: The feed, as parsed by feedparser.
+    :param keyword_filter: The compiled filter for ignored keywords.
+    """
+    if not feed.entries:
+        print(f"Feed {feed_url} has no entries, skipping")
+        return
 
-                    # Count the number of entries that already exist in the database
-                    # If all entries already exist, there's no need to continue
-                    if entries.index(entry) == len(entries) - 1:
-                        print("All entries already exist in database, exiting")
-                        break
-                    continue
-
-                # List of keywords to check for in the entry title
-                ignored_keywords = [
-                    "haugesund",
-                    "stord",
-                    "sveio",
-                    "bømlo",
-                    "tysvær",
-                    "vindafjord",
-                    "brann",
-                    "ørland",
-                    "redningshelikopter rygge",
-                    "arendal",
-                    "oslo",
-                    "bergen",
-                    "oslofjorden",
-                    "sørlandet",
-                    "hordaland",
-                    "vestland",
-                    "trondheim",
-                ]
-
-                # If DEBUG is enabled, print the ignored keywords
-                if DEBUG:
-                    print(
-                        "DEBUG: "
-                        + time.strftime("%H:%M:%S")
-                        + " - Ignored keywords: "
-                        + str(ignored_keywords)
-                    )
+    # Get the author of the tweet
+    tweet_author = feed.feed.title
 
-                # Initialize a flag for ignored keywords
-                contains_ignored_keyword = False
-
-                # Iterate over the keywords
-                for keyword in ignored_keywords:
-                    # Check if the keyword is in the entry title
-                    if keyword in entry.title.lower():
-                        # Print a log message with the ignored keyword
-                        print(
-                            f"Entry contains ignored keyword '{keyword}', continuing to next entry"
-                        )
-                        contains_ignored_keyword = True
-                        break
-
-                if contains_ignored_keyword:
-                    continue
-
-                # Check if the entry is a retweet
-                if entry.title.startswith("RT"):
-                    print("Entry is a retweet, continuing to next entry")
-                    continue
-
-                # Check if the entry is a reply
-                if entry.title.startswith("R to @"):
-                    print("Entry is a reply, continuing to next entry")
-                    continue
-
-                # Print a log message with the entry title
-                print(f"New entry found: {entry.published} - {entry.title}")
-
-                # Check if running on macOS
-                if os.uname().sysname == "Darwin":
-                    # Generate the texts for the notification
-                    notification_author = f"New Tweet from {entry.author}"
-                    notification_text = (
-                        f"{entry.title}\n({entry.published})\n{entry.link}"
-                    )
-                    notification_subtitle = f"Published: {entry.published}"
-                    notification_url = f"{entry.link}"
-
-                    # Send the notification
-                    try:
-                        notify_local(title=notification_author, text=notification_text, subtitle="Test",
-                                     tweet_url=notification_url)
-
-                        # Log the notification
-                        print(
-                            f"Sent notification: {notification_author}: {notification_text} - {notification_subtitle}"
-                        )
-                    except Exception as e:
-                        print(f"Encountered an error while sending notification: {e}")
-
-                # Add the new tweet to the database
+    # Get the latest entry
+    latest_entry = feed.entries[0]
+
+    # Use a unique key for each feed's last_seen_id
+    last_seen_id_key = f"last_seen_id_{feed_url}"
+
+    # Retrieve the last seen entry ID from the database
+    try:
+        last_seen_id = table.get_item({"id": last_seen_id_key})["value"]
+    except:
+        last_seen_id = None
+
+    # Check if the latest entry is new
+
+    if DEBUG:
+        last_seen_id = random.randint(0, 100000000)
+
+    if latest_entry.id != last_seen_id:
+        # Print a log message that no new entry was found
+        print(
+            "New tweet detected, checking if there might be more entries since the last check"
+        )
+
+        # If there is a new entry, retrieve the latest 10 entries
+        entries = feed.entries[:10]
+
+        # Reverse the list so that the oldest entry is first
+        entries.reverse()
+
+        # Check each entry
+        for entry in entries:
+            # Debug
+            if DEBUG:
+                # Print the entry title
+                print("DEBUG: " + time.strftime("%H:%M:%S") + f":")
+                print(json.dumps(entry, indent=4, sort_keys=True))
+
+            if check_entry(entry.id):
+                # Print a log message that the entry already exists in the database starting with the current
+                # time in hh:mm:ss format
+                print(
+                    time.strftime("%H:%M:%S")
+                    + ": Entry already exists in database, continuing to next entry"
+                )
+
+                # Count the number of entries that already exist in the database
+                # If all entries already exist, there's no need to continue
+                if entries.index(entry) == len(entries) - 1:
+                    print("All entries already exist in database, exiting")
+                    break
+                continue
+
+            # Check if the entry title contains any of the ignored keywords
+            keyword = keyword_filter.match(entry.title)
+            if keyword:
+                # Print a log message with the ignored keyword
+                print(
+                    f"Entry contains ignored keyword '{keyword}', continuing to next entry"
+                )
+                continue
+
+            # Check if the entry is a retweet
+            if entry.title.startswith("RT"):
+                print("Entry is a retweet, continuing to next entry")
+                continue
+
+            # Check if the entry is a reply
+            if entry.title.startswith("R to @"):
+                print("Entry is a reply, continuing to next entry")
+                continue
+
+            # Print a log message with the entry title
+            print(f"New entry found: {entry.published} - {entry.title}")
+
+            # Check if running on macOS
+            if os.uname().sysname == "Darwin":
+                # Generate the texts for the notification
+                notification_author = f"New Tweet from {entry.author}"
+                notification_text = (
+                    f"{entry.title}\n({entry.published})\n{entry.link}"
+                )
+                notification_subtitle = f"Published: {entry.published}"
+                notification_url = f"{entry.link}"
+
+                # Send the notification
                 try:
-                    # Add the entry id to the database
-                    table.put_item(Item={"id": entry.id})
-                    print(f"Added entry to database: {entry.id}")
+                    notify_local(title=notification_author, text=notification_text, subtitle="Test",
+                                 tweet_url=notification_url)
+                    metrics.add("Notifications")
 
+                    # Log the notification
+                    print(
+                        f"Sent notification: {notification_author}: {notification_text} - {notification_subtitle}"
+                    )
                 except Exception as e:
-                    print(f"Encountered an error while adding entry to database: {e}")
+                    print(f"Encountered an error while sending notification: {e}")
 
-            # Update the last seen entry ID in the database to the latest entry
+            # Add the new tweet to the database
+            item = entry_item(feed_url, entry)
             try:
-                table.put_item(Item={"id": last_seen_id_key, "value": latest_entry.id})
+                # Add the entry to the database, with the feed and date so it can be found per feed
+                table.put_item(item)
+                seen_entries.add(entry.id)
+                metrics.add("NewEntries")
+                print(f"Added entry to database: {entry.id}")
+
             except Exception as e:
-                print(
-                    f"Encountered an error while updating {last_seen_id_key} to database: {e}"
-                )
+                print(f"Encountered an error while adding entry to database: {e}")
+                continue
+
+            # Add the new tweet to the timeline of everyone subscribed to the feed, timelines only live in DynamoDB
+            if storage.STORAGE_BACKEND == "dynamodb":
+                try:
+                    fan_out_entry(aws_cache.get_resource("dynamodb"), item)
+                except Exception as e:
+                    print(f"Encountered an error while adding entry to timelines: {e}")
 
-        else:
+        # Update the last seen entry ID in the database to the latest entry
+        try:
+            table.put_item({"id": last_seen_id_key, "value": latest_entry.id})
+        except Exception as e:
             print(
-                time.strftime("%H:%M:%S")
-                + f": No new entry found for {tweet_author}. Waiting for {SLEEP_TIME} seconds before next check "
+                f"Encountered an error while updating {last_seen_id_key} to database: {e}"
             )
 
+    else:
+        print(time.strftime("%H:%M:%S") + f": No new entry found for {tweet_author}")
+
+
+def poll_feed(feed_url):
+    """
+    Check a single feed for new entries, for the scheduler in common.feed_scheduler.
+    :param feed_url: The URL of the feed.
+    :return: The publish times of the entries in the feed, or None if it was unchanged or could not be fetched.
+    """
+    with process_lock:
+        load_feed_states([feed_url])
+
+    response = fetch_feed(feed_url)
+    if response is None:
+        return None
+
+    import feedparser
+
+    feed = feedparser.parse(response.content)
+    with process_lock:
+        # Cached between checks, see common.keyword_filter
+        keyword_filter = get_filter(keywords_table, default=IGNORED_KEYWORDS)
+        process_feed(feed_url, feed, keyword_filter)
+        save_feed_state(feed_url, response)
+
+    return [calendar.timegm(entry.published_parsed) for entry in feed.entries if entry.get("published_parsed")]
+
+
+@metrics.emit_metrics("nitter")
+def lambda_handler(event, context):
+    with metrics.phase("LoadState"):
+        load_feed_states(RSS_FEEDS)
+
+        # Load the ignored keywords, cached between checks
+        keyword_filter = get_filter(keywords_table, default=IGNORED_KEYWORDS)
+
+    # If DEBUG is enabled, print the ignored keywords
+    if DEBUG:
+        print(
+            "DEBUG: "
+            + time.strftime("%H:%M:%S")
+            + " - Ignored keywords: "
+            + str(sorted(keyword_filter.keywords.values()))
+        )
+
+    # Fetch every feed at the same time, the parsing and database work is done one feed at a time below
+    with metrics.phase("Fetch"), ThreadPoolExecutor(max_workers=min(FEED_MAX_WORKERS, len(RSS_FEEDS))) as executor:
+        responses = list(executor.map(fetch_feed, RSS_FEEDS))
+
+    with metrics.phase("Process"):
+        import feedparser
+
+        for feed_url, response in zip(RSS_FEEDS, responses):
+            if response is None:
+                continue
+
+            metrics.add("ChangedFeeds")
+            process_feed(feed_url, feedparser.parse(response.content), keyword_filter)
+            save_feed_state(feed_url, response)
+
+    print(f"Seen cache: {seen_entries.stats()}")
+
 
 if __name__ == "__main__":
     # Verify that we're not running in AWS Lambda
@@ -267,6 +431,9 @@ if __name__ == "__main__":
         tweet_url="https://nitter.net/politietsorvest/status/1437450000000000000",
     )
 
-    while True:
-        lambda_handler(None, None)
-        time.sleep(SLEEP_TIME)  # waits for 60 seconds before the next execution
+    # Poll every feed on its own schedule. Only the local daemon needs asyncio, so the Lambda doesn't import it.
+    import asyncio
+
+    from common import feed_scheduler
+
+    asyncio.run(feed_scheduler.run(RSS_FEEDS, poll_feed))
@@ -1,39 +1,124 @@
+import base64
+import binascii
 import boto3
 import json
 
 from boto3.dynamodb.conditions import Key
 
+# Number of entries per page, and the most a caller can ask for
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+
+
+class InvalidRequestException(Exception):
+    """
+    Exception for a limit or cursor the caller made up or mangled.
+    """
+    pass
+
+
+def encode_cursor(last_key):
+    """
+    Encode the key of the last entry on a page as an opaque cursor.
+    :param last_key: The LastEvaluatedKey of the query, or None on the last page.
+    :return: The cursor as a URL-safe string, or None on the last page.
+    """
+    if not last_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, user_id):
+    """
+    Decode a cursor created by encode_cursor().
+    :param cursor: The cursor, or None for the first page.
+    :param user_id: The user the page is for.
+    :return: The key to continue the query from, or None for the first page.
+    :raises InvalidRequestException: If the cursor was not created by encode_cursor() for this user.
+    """
+    if not cursor:
+        return None
+
+    try:
+        last_key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (AttributeError, UnicodeError, binascii.Error, ValueError) as error:
+        raise InvalidRequestException(f"Invalid cursor: {error}") from error
+
+    # The key is passed on to DynamoDB as the start key, so only accept a key in this user's timeline
+    if (
+        not isinstance(last_key, dict)
+        or set(last_key) != {"user", "sort_key"}
+        or last_key["user"] != user_id
+        or not isinstance(last_key["sort_key"], str)
+    ):
+        raise InvalidRequestException("Invalid cursor")
+    return last_key
+
+
+def parse_limit(limit):
+    """
+    Parse the page size asked for.
+    :param limit: The limit from the event, or None for the default.
+    :return: The page size, at most MAX_PAGE_SIZE.
+    :raises InvalidRequestException: If the limit is not a positive whole number.
+    """
+    if limit is None or limit == "":
+        return PAGE_SIZE
+
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError) as error:
+        raise InvalidRequestException(f"Invalid limit: {limit!r}") from error
+
+    if limit < 1:
+        raise InvalidRequestException(f"Invalid limit: {limit}")
+    return min(limit, MAX_PAGE_SIZE)
+
 
 def lambda_handler(event, context):
     """
-    This function gets the latest 10 RSS entries from the user_feeds table in DynamoDB.
-    :param event:  The event data from the Lambda trigger.
+    This function gets the latest RSS entries from the feeds a user is subscribed to.
+    The pollers write every new entry to the user_timeline table for each subscriber, and add_feed seeds it with the
+    newest entries of a feed when the user subscribes, so this is a single query for one page of the user's timeline,
+    newest first. Pass the returned cursor to get the next page.
+    :param event:  The event data from the Lambda trigger, with "user_id" and optionally "cursor" and "limit".
     :param context:  The context data from the Lambda trigger.
-    :return:
+    :return: The entries and the cursor for the next page, which is None on the last page. 400 if the limit or the
+        cursor is invalid.
     """
-    dynamodb = boto3.resource("dynamodb")
-    user_feeds_table = dynamodb.Table("user_feeds")
-    rss_entries_table = dynamodb.Table("rss_entries")
-
     user_id = event['user_id']
+    try:
+        limit = parse_limit(event.get('limit'))
+        start_key = decode_cursor(event.get('cursor'), user_id)
+    except InvalidRequestException as error:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(str(error))
+        }
 
-    response = user_feeds_table.query(
-        KeyConditionExpression=Key('user').eq(user_id)
-    )
-    feed_urls = [item['feed_url'] for item in response['Items']]
+    dynamodb = boto3.resource("dynamodb")
+    user_timeline_table = dynamodb.Table("user_timeline")
 
-    entries = []
-    for feed_url in feed_urls:
-        response = rss_entries_table.query(
-            KeyConditionExpression=Key('feed_url').eq(feed_url)
-        )
-        entries.extend(response['Items'])
+    query_kwargs = {
+        "KeyConditionExpression": Key('user').eq(user_id),
+        "ScanIndexForward": False,
+        "Limit": limit,
+    }
+    if start_key:
+        query_kwargs["ExclusiveStartKey"] = start_key
+
+    response = user_timeline_table.query(**query_kwargs)
 
-    # Sort entries by date, and get the latest ones
-    entries.sort(key=lambda x: x['date'], reverse=True)
-    latest_entries = entries[:10]
+    # Strip the timeline bookkeeping, callers only care about the entries
+    latest_entries = [
+        {name: value for name, value in item.items() if name not in ("user", "sort_key", "expires_at")}
+        for item in response['Items']
+    ]
 
     return {
         'statusCode': 200,
-        'body': json.dumps(latest_entries)
+        'body': json.dumps(
+            {'entries': latest_entries, 'cursor': encode_cursor(response.get('LastEvaluatedKey'))},
+            default=str,
+        )
     }
@@ -1,19 +1,40 @@
 import boto3
 import json
 
+from botocore.exceptions import ClientError
+
 
 def lambda_handler(event, context):
+    """
+    This function removes a keyword from the set of ignored keywords in DynamoDB.
+    The keyword is removed with a single atomic update, which also bumps the version so pollers reload their filters.
+    :param event:  The event data from the Lambda trigger.
+    :param context:  The context data from the Lambda trigger.
+    :return: A message indicating the success or failure of the function.
+    """
     dynamodb = boto3.resource("dynamodb")
     table = dynamodb.Table("ignored_keywords")
 
-    keyword = event['keyword']
+    keyword = event['keyword'].strip()
 
-    response = table.get_item(Key={"id": "keywords"})
-    keywords = response['Item']['keywords']
+    if not keyword:
+        return {
+            'statusCode': 400,
+            'body': json.dumps('Keyword can not be empty')
+        }
 
-    if keyword in keywords:
-        keywords.remove(keyword)
-        table.put_item(Item={"id": "keywords", "keywords": keywords})
+    try:
+        table.update_item(
+            Key={"id": "keywords"},
+            UpdateExpression="DELETE #keywords :keywords ADD #version :one",
+            ConditionExpression="contains(#keywords, :keyword)",
+            ExpressionAttributeNames={"#keywords": "keywords", "#version": "version"},
+            ExpressionAttributeValues={":keywords": {keyword}, ":keyword": keyword, ":one": 1},
+        )
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # The keyword is not in the set, nothing to do
 
     return {
         'statusCode': 200,
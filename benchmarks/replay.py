@@ -0,0 +1,422 @@
+"""
+Replay benchmark for the polling Lambdas.
+Replays synthetic politiloggen payloads and nitter RSS feeds against local stubs (moto for DynamoDB and SSM, a fake
+HTTP layer for the politiloggen API, Pushover and nitter) and reports, per scenario and phase, the wall time, the
+number of AWS and HTTP calls by operation, the bytes sent and received and the peak memory.
+
+Usage:
+    python benchmarks/replay.py --threads 10 100 1000 --output benchmark-results.json
+
+Requires moto, which the test suite already uses.
+Peak memory is measured with tracemalloc, which slows the run down, so compare wall times between results of this
+script rather than with production timings.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest import mock
+from urllib.parse import urlencode, urlsplit
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "app")
+sys.path.insert(0, APP_DIR)
+
+# moto needs a region and credentials, and the per-message logging would drown out the results
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-north-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import boto3  # noqa: E402
+import requests  # noqa: E402
+
+from botocore.handlers import BUILTIN_HANDLERS  # noqa: E402
+from moto import mock_dynamodb, mock_ssm  # noqa: E402
+
+DEFAULT_THREAD_COUNTS = [10, 100, 1000]
+
+MUNICIPALITIES = ["Stavanger", "Sandnes", "Sola", "Randaberg", "Klepp", "Time", "Hå", "Gjesdal"]
+
+
+class CallRecorder:
+    """
+    Counts calls by operation and the bytes going each way.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def record(self, operation, sent, received):
+        """
+        Record one call.
+        :param operation: The name of the operation, e.g. "dynamodb.BatchGetItem".
+        :param sent: The size of the request body in bytes.
+        :param received: The size of the response body in bytes.
+        """
+        self.calls[operation] += 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+
+    def results(self):
+        return {
+            "calls": dict(sorted(self.calls.items())),
+            "total_calls": sum(self.calls.values()),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+# The recorder for the phase being measured, swapped by measure()
+_recorder = CallRecorder()
+
+
+def _on_request_created(request, operation_name=None, **kwargs):
+    body = request.body or b""
+    _recorder.bytes_sent += len(body.encode("utf-8") if isinstance(body, str) else body)
+
+
+def _on_after_call(http_response, model, **kwargs):
+    _recorder.record(f"{model.service_model.service_name}.{model.name}", 0, len(http_response.content or b""))
+
+
+def install_aws_hooks():
+    """
+    Count every AWS call through botocore's event hooks.
+    moto replaces the default session when a mock starts, so the hooks are added to the handlers every new session
+    is created with, the same way moto installs its own.
+    """
+    handlers = [("request-created", _on_request_created), ("after-call", _on_after_call)]
+    for handler in handlers:
+        if handler not in BUILTIN_HANDLERS:
+            BUILTIN_HANDLERS.append(handler)
+    boto3.setup_default_session()
+
+
+def make_threads(count, now):
+    """
+    Build a synthetic politiloggen payload.
+    :param count: The number of threads.
+    :param now: The time of the newest update.
+    :return: A list of threads, newest first, each with two messages.
+    """
+    threads = []
+    for index in range(count):
+        updated_on = (now - timedelta(minutes=index)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        municipality = MUNICIPALITIES[index % len(MUNICIPALITIES)]
+        threads.append({
+            "id": f"bench-{index}",
+            "district": "Sør-Vest politidistrikt",
+            "municipality": municipality,
+            "isActive": index % 3 != 0,
+            "createdOn": updated_on,
+            "updatedOn": updated_on,
+            "category": "Savnet" if index % 2 else "Redning",
+            "messages": [
+                {"id": f"bench-{index}-0", "text": f"Savnet person meldt i {municipality}.", "hasImage": False},
+                {"id": f"bench-{index}-1", "text": "Personen er funnet i god behold.", "hasImage": False},
+            ],
+        })
+    return threads
+
+
+def make_feed(feed_url, count, now):
+    """
+    Build a synthetic nitter RSS feed.
+    :param feed_url: The URL of the feed.
+    :param count: The number of entries.
+    :param now: The time of the newest entry.
+    :return: The feed as bytes.
+    """
+    account = urlsplit(feed_url).path.strip("/").split("/")[0]
+    items = []
+    for index in range(count):
+        published = format_datetime(now - timedelta(minutes=index))
+        link = f"https://nitter.net/{account}/status/{10 ** 18 + index}"
+        items.append(
+            f"<item><title>Trafikkulykke på E39 ved Sandnes, nummer {index}</title>"
+            f"<dc:creator>@{account}</dc:creator><pubDate>{published}</pubDate>"
+            f"<guid>{link}</guid><link>{link}</link></item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/"><channel>'
+        f"<title>{account} / Twitter</title><link>{feed_url}</link>{''.join(items)}</channel></rss>"
+    ).encode("utf-8")
+
+
+def make_response(url, status_code, content, headers=None):
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+
+class FakeHttp:
+    """
+    Stands in for requests.Session.request, serving the politiloggen API, Pushover and nitter from memory.
+    """
+
+    def __init__(self, threads=(), feeds=None):
+        """
+        :param threads: The threads the politiloggen API serves, newest first.
+        :param feeds: A dict of feed URL to RSS bytes.
+        """
+        self.threads = list(threads)
+        self.feeds = feeds or {}
+
+    def __call__(self, session, method, url, **kwargs):
+        body = kwargs.get("json")
+        sent = 0
+        if body is not None:
+            sent = len(json.dumps(body).encode("utf-8"))
+        elif kwargs.get("data") is not None:
+            sent = len(urlencode(kwargs["data"]).encode("utf-8"))
+
+        response = self.respond(method, url, body, kwargs.get("headers") or {})
+        host = urlsplit(url).hostname
+        _recorder.record(f"http.{host}", sent, len(response.content or b""))
+        return response
+
+    def respond(self, method, url, body, headers):
+        host = urlsplit(url).hostname
+
+        if host == "politiloggen-vis-frontend.bks-prod.politiet.no":
+            page = self.threads[body["skip"]:body["skip"] + body["take"]]
+            return make_response(url, 200, json.dumps({"messageThreads": page}).encode("utf-8"))
+
+        if host == "api.pushover.net":
+            return make_response(url, 200, b'{"status":1,"request":"benchmark"}')
+
+        if url in self.feeds:
+            content = self.feeds[url]
+            etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+            if headers.get("If-None-Match") == etag:
+                return make_response(url, 304, b"", {"ETag": etag})
+            return make_response(url, 200, content, {"ETag": etag, "Content-Type": "application/rss+xml"})
+
+        return make_response(url, 404, b"Not Found")
+
+
+def measure(name, thread_count, phase, run):
+    """
+    Run one phase of a scenario and measure it.
+    :param name: The name of the scenario.
+    :param thread_count: The number of threads or entries replayed.
+    :param phase: The name of the phase, e.g. "first_run".
+    :param run: A callable doing the work.
+    :return: A dict with the measurements.
+    """
+    global _recorder
+
+    _recorder = CallRecorder()
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        wall_time = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "scenario": name,
+        "threads": thread_count,
+        "phase": phase,
+        "status": result.get("statusCode") if isinstance(result, dict) else result,
+        "wall_time_s": round(wall_time, 4),
+        "peak_memory_bytes": peak,
+        **_recorder.results(),
+    }
+
+
+def reset_caches(app):
+    """
+    Reset the module level caches, so every scenario starts as a cold container.
+    :param app: The politiloggen Lambda module.
+    """
+    from common import aws_cache, keyword_filter, timeline
+
+    aws_cache.invalidate()
+    keyword_filter.invalidate()
+    timeline._subscribers.clear()
+    app._last_digests.clear()
+    app._high_water_marks.clear()
+    app._seen.clear()
+    app._query_specs = None
+    app._run_stats.update(runs=0, short_circuits=0)
+
+
+def create_tables(app):
+    """
+    Create the tables and parameters the Lambdas expect, outside the measured phases.
+    :param app: The politiloggen Lambda module.
+    """
+    dynamodb = boto3.resource("dynamodb")
+    app.create_database(dynamodb)
+
+    key_schema = [{"AttributeName": "id", "KeyType": "HASH"}]
+    definitions = [{"AttributeName": "id", "AttributeType": "S"}]
+    for table_name in ("ignored_keywords", "rss_entries"):
+        dynamodb.create_table(
+            TableName=table_name, KeySchema=key_schema, AttributeDefinitions=definitions, BillingMode="PAY_PER_REQUEST"
+        )
+    dynamodb.create_table(
+        TableName="user_feeds",
+        KeySchema=[{"AttributeName": "user", "KeyType": "HASH"}, {"AttributeName": "feed_url", "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": "user", "AttributeType": "S"},
+            {"AttributeName": "feed_url", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[{
+            "IndexName": "FeedUsersIndex",
+            "KeySchema": [{"AttributeName": "feed_url", "KeyType": "HASH"}],
+            "Projection": {"ProjectionType": "KEYS_ONLY"},
+        }],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.create_table(
+        TableName="user_timeline",
+        KeySchema=[{"AttributeName": "user", "KeyType": "HASH"}, {"AttributeName": "sort_key", "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": "user", "AttributeType": "S"},
+            {"AttributeName": "sort_key", "AttributeType": "S"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+    ssm = boto3.client("ssm")
+    ssm.put_parameter(Name="pushover_user_key", Value="benchmark-user", Type="String")
+    ssm.put_parameter(Name="pushover_api_token", Value="benchmark-token", Type="String")
+
+
+def load_desktop_notifier():
+    """
+    Load desktop-notifier.py, which can't be imported by name.
+    :return: The module.
+    """
+    spec = importlib.util.spec_from_file_location("desktop_notifier", os.path.join(APP_DIR, "desktop-notifier.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_politiloggen(app, thread_count):
+    """
+    Replay a burst of updated threads through the politiloggen Lambda, then the same payload again.
+    The high-water mark is seeded before the burst, so the first run pages through every thread.
+    :param app: The politiloggen Lambda module.
+    :param thread_count: The number of threads in the payload.
+    :return: The measurements of both phases.
+    """
+    reset_caches(app)
+    now = datetime.now(timezone.utc)
+    fake = FakeHttp(threads=make_threads(thread_count, now))
+
+    key = app.query_key(app.DISTRICT, app.CATEGORIES)
+    entries = app.storage.get_storage(app.TABLE_NAME, app.TABLE_KEY_NAMES)
+    entries.put_item({
+        "thread_id": app.STATE_THREAD_ID,
+        "message_id": f"hwm#{key}",
+        "updatedOn": (now - timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    })
+
+    max_pages = math.ceil(thread_count / app.PAGE_SIZE) + 1
+    with mock.patch.object(requests.Session, "request", autospec=True, side_effect=fake), \
+            mock.patch.object(app, "MAX_PAGES", max_pages):
+        return [
+            measure("politiloggen", thread_count, "first_run", lambda: app.lambda_handler(None, None)),
+            measure("politiloggen", thread_count, "unchanged", lambda: app.lambda_handler(None, None)),
+        ]
+
+
+def run_nitter(notifier, thread_count):
+    """
+    Replay RSS feeds with new entries through the nitter poller, then the same feeds again.
+    :param notifier: The desktop-notifier module.
+    :param thread_count: The number of entries per feed.
+    :return: The measurements of both phases.
+    """
+    notifier.feed_states.clear()
+    notifier.seen_entries.clear()
+    now = datetime.now(timezone.utc)
+    fake = FakeHttp(feeds={feed_url: make_feed(feed_url, thread_count, now) for feed_url in notifier.RSS_FEEDS})
+
+    boto3.resource("dynamodb").Table("user_feeds").put_item(
+        Item={"user": "benchmark", "feed_url": notifier.RSS_FEEDS[0]}
+    )
+
+    # Never show desktop notifications from a benchmark, and keep the poller's printing out of the report
+    with mock.patch.object(requests.Session, "request", autospec=True, side_effect=fake), \
+            mock.patch.object(notifier, "notify_local"), contextlib.redirect_stdout(io.StringIO()):
+        return [
+            measure("nitter", thread_count, "first_run", lambda: notifier.lambda_handler(None, None)),
+            measure("nitter", thread_count, "unchanged", lambda: notifier.lambda_handler(None, None)),
+        ]
+
+
+def run_benchmarks(thread_counts):
+    """
+    Run every scenario for every thread count.
+    :param thread_counts: The numbers of threads to replay.
+    :return: The results, ready to be written as JSON.
+    """
+    install_aws_hooks()
+    import app
+
+    # The handlers' EMF lines would be mixed into the report
+    logging.getLogger("metrics").setLevel(logging.WARNING)
+
+    notifier = load_desktop_notifier()
+    results = []
+    for thread_count in thread_counts:
+        with mock_dynamodb(), mock_ssm():
+            create_tables(app)
+            results.extend(run_politiloggen(app, thread_count))
+            results.extend(run_nitter(notifier, thread_count))
+
+    return {
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic payloads through the polling Lambdas.")
+    parser.add_argument("--threads", type=int, nargs="+", default=DEFAULT_THREAD_COUNTS,
+                        help="The numbers of threads to replay (default: 10 100 1000)")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.threads)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+
+    for result in report["results"]:
+        print(
+            f"{result['scenario']:>12} {result['threads']:>5} {result['phase']:<10} "
+            f"{result['wall_time_s']:>8.3f}s {result['total_calls']:>5} calls "
+            f"{result['bytes_sent'] + result['bytes_received']:>10} bytes {result['peak_memory_bytes']:>11} peak"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Cold-start budget for the polling Lambdas.
+Imports each handler module in a fresh interpreter with `python -X importtime` and fails if the import takes longer
+than the budget, or if it pulls in one of the heavy dependencies that should only be imported on first use.
+
+Usage:
+    python benchmarks/startup.py --budget-ms 100
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "app")
+
+# The import time budget per handler, in milliseconds
+STARTUP_BUDGET_MS = float(os.environ.get("STARTUP_BUDGET_MS", 100))
+
+# Modules that must not be imported when the handler module is loaded
+DEFERRED_MODULES = ("boto3", "botocore", "requests", "urllib3", "feedparser", "pync")
+
+# How to import each handler. desktop-notifier.py can't be imported by name, so it is loaded by path.
+HANDLERS = {
+    "app": "import app",
+    "desktop-notifier": (
+        "import importlib.util; "
+        "spec = importlib.util.spec_from_file_location('desktop_notifier', 'desktop-notifier.py'); "
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+    ),
+}
+
+# "import time: self [us] | cumulative | imported package", with the package indented by its depth
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def parse_importtime(output):
+    """
+    Parse the output of `python -X importtime`.
+    :param output: What the interpreter wrote to stderr.
+    :return: A list of (module, cumulative microseconds, depth) tuples, in the order the imports finished.
+    """
+    imports = []
+    for line in output.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            imports.append((match.group(4), int(match.group(2)), len(match.group(3)) // 2))
+    return imports
+
+
+def measure(code, runs=3):
+    """
+    Measure the import time of a handler in fresh interpreters.
+    :param code: The Python code that imports the handler, run from the app directory.
+    :param runs: How many times to measure, the fastest run is reported to keep noise out.
+    :return: A dict with "import_ms", the "deferred" modules that were imported anyway and the "slowest" imports.
+    """
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=APP_DIR, capture_output=True, text=True, check=True,
+        )
+        imports = parse_importtime(result.stderr)
+
+        # Everything imported by the snippet, leaving out the interpreter's own startup (site and friends)
+        start = next(index for index, (module, _, _) in enumerate(imports) if module == "site") + 1
+        imports = imports[start:]
+        total = sum(cumulative for _, cumulative, depth in imports if depth == 0)
+
+        if best is None or total < best[0]:
+            best = (total, imports)
+
+    total, imports = best
+    top_level = {module.split(".")[0] for module, _, _ in imports}
+    slowest = sorted(((cumulative, module) for module, cumulative, depth in imports if depth <= 1), reverse=True)
+    return {
+        "import_ms": round(total / 1000, 1),
+        "deferred": sorted(top_level.intersection(DEFERRED_MODULES)),
+        "slowest": [(module, round(cumulative / 1000, 1)) for cumulative, module in slowest[:5]],
+    }
+
+
+def deferred_imports(code):
+    """
+    Find the heavy dependencies a handler imports at load, without timing anything.
+    :param code: The Python code that imports the handler, run from the app directory.
+    :return: The sorted list of DEFERRED_MODULES that were imported.
+    """
+    probe = f"{code}\nimport sys\nprint(' '.join(sorted({{name.split('.')[0] for name in sys.modules}})))"
+    result = subprocess.run([sys.executable, "-c", probe], cwd=APP_DIR, capture_output=True, text=True, check=True)
+    return sorted(set(result.stdout.split()).intersection(DEFERRED_MODULES))
+
+
+def check(budget_ms=None):
+    """
+    Measure every handler against the budget.
+    :param budget_ms: The budget in milliseconds. Defaults to STARTUP_BUDGET_MS.
+    :return: A dict of handler name to its measurement, each with an "ok" flag.
+    """
+    budget_ms = budget_ms or STARTUP_BUDGET_MS
+    results = {}
+    for name, code in HANDLERS.items():
+        result = measure(code)
+        result["ok"] = result["import_ms"] <= budget_ms and not result["deferred"]
+        results[name] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the handlers against a budget.")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS,
+                        help=f"The import time budget per handler (default: {STARTUP_BUDGET_MS:g})")
+    args = parser.parse_args()
+
+    results = check(args.budget_ms)
+    for name, result in results.items():
+        print(f"{name}: {result['import_ms']} ms (budget {args.budget_ms:g} ms) {'ok' if result['ok'] else 'FAILED'}")
+        if result["deferred"]:
+            print(f"  imports {', '.join(result['deferred'])} at load, these should be imported on first use")
+        for module, milliseconds in result["slowest"]:
+            print(f"  {milliseconds:>7} ms  {module}")
+
+    sys.exit(0 if all(result["ok"] for result in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
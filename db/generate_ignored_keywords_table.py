@@ -10,13 +10,13 @@ def create_ignored_keywords_table():
         TableName='ignored_keywords',
         KeySchema=[
             {
-                'AttributeName': 'keyword',
+                'AttributeName': 'id',
                 'KeyType': 'HASH'
             }
         ],
         AttributeDefinitions=[
             {
-                'AttributeName': 'keyword',
+                'AttributeName': 'id',
                 'AttributeType': 'S'
             },
         ],
@@ -36,9 +36,13 @@ def insert_ignored_keywords(keywords):
     dynamodb = boto3.resource('dynamodb')
     table = dynamodb.Table('ignored_keywords')
 
-    with table.batch_writer() as batch:
-        for keyword in keywords:
-            batch.put_item(Item={'keyword': keyword})
+    # All keywords live in a single item as a string set, with a version that is bumped on every change
+    table.update_item(
+        Key={'id': 'keywords'},
+        UpdateExpression='ADD #keywords :keywords, #version :one',
+        ExpressionAttributeNames={'#keywords': 'keywords', '#version': 'version'},
+        ExpressionAttributeValues={':keywords': set(keywords), ':one': 1},
+    )
 
     print("Inserted keywords successfully.")
 
@@ -0,0 +1,78 @@
+import time
+
+import boto3
+
+TABLE_NAME = 'politiloggen-entries'
+
+# The index created by older versions of app.py, with a copy of every item
+OLD_INDEX_NAME = 'DisctrictIndex'
+
+# The keys-only index new tables are created with
+NEW_INDEX_NAME = 'DistrictIndex'
+
+
+def describe_table(client):
+    return client.describe_table(TableName=TABLE_NAME)['Table']
+
+
+def wait_for_index(client, index_name, deleted=False):
+    # Creating an index backfills it from the whole table, which can take a while on a big one
+    while True:
+        indexes = {index['IndexName']: index for index in describe_table(client).get('GlobalSecondaryIndexes', [])}
+        if deleted and index_name not in indexes:
+            return
+        if not deleted and indexes.get(index_name, {}).get('IndexStatus') == 'ACTIVE':
+            return
+        print(f"Waiting for {index_name}...")
+        time.sleep(30)
+
+
+def enable_ttl(client):
+    status = client.describe_time_to_live(TableName=TABLE_NAME)['TimeToLiveDescription']['TimeToLiveStatus']
+    if status in ('ENABLED', 'ENABLING'):
+        print("TTL is already enabled.")
+        return
+
+    client.update_time_to_live(
+        TableName=TABLE_NAME,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'},
+    )
+    print("Enabled TTL on expires_at.")
+
+
+def migrate_district_index(client):
+    indexes = {index['IndexName'] for index in describe_table(client).get('GlobalSecondaryIndexes', [])}
+
+    # Create the new index before dropping the old one, so the table is never without one
+    if NEW_INDEX_NAME not in indexes:
+        client.update_table(
+            TableName=TABLE_NAME,
+            AttributeDefinitions=[{'AttributeName': 'district', 'AttributeType': 'S'}],
+            GlobalSecondaryIndexUpdates=[{
+                'Create': {
+                    'IndexName': NEW_INDEX_NAME,
+                    'KeySchema': [{'AttributeName': 'district', 'KeyType': 'HASH'}],
+                    'Projection': {'ProjectionType': 'KEYS_ONLY'},
+                }
+            }],
+        )
+        print(f"Creating {NEW_INDEX_NAME}.")
+    wait_for_index(client, NEW_INDEX_NAME)
+
+    # Only one index can be changed at a time, so the old one is dropped once the new one is active
+    if OLD_INDEX_NAME in indexes:
+        client.update_table(
+            TableName=TABLE_NAME,
+            GlobalSecondaryIndexUpdates=[{'Delete': {'IndexName': OLD_INDEX_NAME}}],
+        )
+        print(f"Deleting {OLD_INDEX_NAME}.")
+        wait_for_index(client, OLD_INDEX_NAME, deleted=True)
+
+    print("District index migrated.")
+
+
+if __name__ == '__main__':
+    # Safe to run again, every step is skipped once it is done
+    dynamodb_client = boto3.client('dynamodb')
+    enable_ttl(dynamodb_client)
+    migrate_district_index(dynamodb_client)
@@ -8,6 +8,30 @@ resource "aws_dynamodb_table" "rss_entries" {
     name = "id"
     type = "S"
   }
+
+  attribute {
+    name = "feed_url"
+    type = "S"
+  }
+
+  attribute {
+    name = "date"
+    type = "S"
+  }
+
+  # Lets add_feed seed a new subscriber's timeline with the newest entries of a feed
+  global_secondary_index {
+    name            = "FeedDateIndex"
+    hash_key        = "feed_url"
+    range_key       = "date"
+    projection_type = "ALL"
+  }
+
+  # Entries expire after RETENTION_DAYS, archived to S3 first by the archive lambda
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
 }
 
 # Create a DynamoDB table to store the RSS feeds each user is subscribed to
@@ -28,4 +52,50 @@ resource "aws_dynamodb_table" "user_feeds" {
   hash_key  = "user"
   range_key = "feed_url"
 
-}
\ No newline at end of file
+  # Reverse index from a feed to its subscribers, used to fan new entries out to their timelines
+  global_secondary_index {
+    name            = "FeedUsersIndex"
+    hash_key        = "feed_url"
+    projection_type = "KEYS_ONLY"
+  }
+}
+
+# Create a DynamoDB table with a precomputed timeline per user, written by the pollers for every new entry and
+# seeded by add_feed when a user subscribes to a feed
+resource "aws_dynamodb_table" "user_timeline" {
+  name         = "user_timeline"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "user"
+  range_key    = "sort_key"
+
+  attribute {
+    name = "user"
+    type = "S"
+  }
+
+  # The entry date followed by the entry id, so the timeline sorts by time
+  attribute {
+    name = "sort_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# Create a DynamoDB table to store the ignored keywords. All keywords live in a single item with a string set and a
+# version number, see db/generate_ignored_keywords_table.py
+# Deployments that created the table with that script must import it before the first apply, see the README:
+#   terraform import aws_dynamodb_table.ignored_keywords ignored_keywords
+resource "aws_dynamodb_table" "ignored_keywords" {
+  name         = "ignored_keywords"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "id"
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+}
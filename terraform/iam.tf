@@ -56,7 +56,8 @@ resource "aws_iam_policy" "lambda_exec_policy" {
       "Sid": "AllowAccessToSpecificParameters",
       "Effect": "Allow",
       "Action": [
-        "ssm:GetParameter"
+        "ssm:GetParameter",
+        "ssm:GetParameters"
       ],
       "Resource": [
         "arn:aws:ssm:${var.region}:${var.account_id}:parameter/pushover_user_key",
@@ -70,10 +71,30 @@ resource "aws_iam_policy" "lambda_exec_policy" {
       ],
       "Resource": [
                 "arn:aws:dynamodb:${var.region}:${var.account_id}:table/user_feeds",
+                "arn:aws:dynamodb:${var.region}:${var.account_id}:table/user_feeds/index/*",
+                "arn:aws:dynamodb:${var.region}:${var.account_id}:table/user_timeline",
                 "arn:aws:dynamodb:${var.region}:${var.account_id}:table/ignored_keywords",
                 "arn:aws:dynamodb:${var.region}:${var.account_id}:table/rss_entries",
+                "arn:aws:dynamodb:${var.region}:${var.account_id}:table/rss_entries/index/*",
                 "arn:aws:dynamodb:${var.region}:${var.account_id}:table/politiloggen-entries"
             ]
+    },
+    {
+      "Sid": "AllowArchiveWrites",
+      "Effect": "Allow",
+      "Action": [
+        "s3:GetObject",
+        "s3:PutObject"
+      ],
+      "Resource": "arn:aws:s3:::politiloggen-archive-${var.account_id}/*"
+    },
+    {
+      "Sid": "AllowArchiveList",
+      "Effect": "Allow",
+      "Action": [
+        "s3:ListBucket"
+      ],
+      "Resource": "arn:aws:s3:::politiloggen-archive-${var.account_id}"
     }
   ]
 }
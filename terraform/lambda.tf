@@ -188,4 +188,51 @@ resource "aws_lambda_function" "remove_keyword_lambda" {
   }
 
   depends_on = [aws_iam_role_policy_attachment.lambda_exec]
-}
\ No newline at end of file
+}
+
+### ARCHIVE LAMBDA ###
+# Bucket for the archive of expiring entries, as gzipped JSON Lines partitioned by date
+resource "aws_s3_bucket" "archive" {
+  bucket = "politiloggen-archive-${var.account_id}"
+}
+
+# Copies the entries that are about to expire to the archive, runs from the app code
+resource "aws_lambda_function" "archive_lambda" {
+  function_name    = "archive_lambda"
+  handler          = "app.archive_handler"
+  runtime          = "python3.10"
+  role             = aws_iam_role.lambda_exec.arn
+  source_code_hash = data.archive_file.app_lambda_zip.output_base64sha256
+  filename         = data.archive_file.app_lambda_zip.output_path
+  layers           = [aws_lambda_layer_version.lambda_layer.arn]
+  timeout          = 900
+
+  environment {
+    variables = {
+      USER_AWS_REGION = var.region
+      ARCHIVE_BUCKET  = aws_s3_bucket.archive.bucket
+    }
+  }
+
+  depends_on = [aws_iam_role_policy_attachment.lambda_exec]
+}
+
+# Archive once a day, well within ARCHIVE_HORIZON_DAYS
+resource "aws_cloudwatch_event_rule" "every_day" {
+  name                = "every_day"
+  schedule_expression = "rate(1 day)"
+}
+
+resource "aws_cloudwatch_event_target" "every_day" {
+  rule      = aws_cloudwatch_event_rule.every_day.name
+  target_id = "archive_lambda_target"
+  arn       = aws_lambda_function.archive_lambda.arn
+}
+
+resource "aws_lambda_permission" "allow_cloudwatch_archive" {
+  statement_id  = "AllowExecutionFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.archive_lambda.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.every_day.arn
+}
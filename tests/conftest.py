@@ -0,0 +1,31 @@
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The Lambda code is packaged from app/app, so make its modules importable the same way
+APP_DIR = os.path.join(ROOT, "app", "app")
+sys.path.insert(0, APP_DIR)
+
+# moto needs a region, and we never want the tests to touch real AWS credentials
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-north-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+# Import the Lambda module now, before the repository root shadows it with the app/ package
+import app  # noqa: E402,F401
+
+
+def load_module(path, name):
+    """
+    Load a module from a file that can't be imported by name, like the API functions that are each packaged as
+    lambda_function.py, or the benchmark scripts.
+    :param path: The path of the file, relative to the repository root.
+    :param name: The name to give the module.
+    :return: The module.
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
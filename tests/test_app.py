@@ -4,13 +4,19 @@ import boto3
 from moto import mock_dynamodb, mock_ssm
 import json
 import os
+import tempfile
+import threading
+import time
+
+from common.lease import Lease
+from common.storage import SQLiteStorage
 
 
 class TestLambdaFunction(unittest.TestCase):
     @mock_dynamodb
     @mock_ssm
     @patch('feedparser.parse')
-    @patch('requests.post')
+    @patch('requests.Session.request')
     def test_lambda_handler(self, mock_requests_post, mock_feedparser_parse):
         # Now import your lambda function script
         import app
@@ -54,6 +60,7 @@ class TestLambdaFunction(unittest.TestCase):
 
         # Mock the requests.post method
         mock_requests_post.return_value.status_code = 200
+        mock_requests_post.return_value.json.return_value = {'messageThreads': []}
 
         # Call the lambda_handler function
         response = app.lambda_handler({}, {})
@@ -61,8 +68,181 @@ class TestLambdaFunction(unittest.TestCase):
         # Assert that the function returned successfully
         self.assertEqual(response, {'statusCode': 200, 'body': json.dumps("Ran successfully!")})
 
+    @mock_dynamodb
+    @mock_ssm
+    @patch('requests.Session.request')
+    def test_unchanged_payload_short_circuits(self, mock_session_request):
+        import app
+        from common import aws_cache
+
+        aws_cache.invalidate()
+        app._last_digests.clear()
+        app._seen.clear()
+        app._run_stats.update(runs=0, short_circuits=0)
+
+        ssm = boto3.client('ssm')
+        ssm.put_parameter(Name='pushover_user_key', Value='test_pushover_user_key', Type='String')
+        ssm.put_parameter(Name='pushover_api_token', Value='test_pushover_api_token', Type='String')
+
+        mock_session_request.return_value.status_code = 200
+        mock_session_request.return_value.json.return_value = {'messageThreads': [{
+            'id': 't1', 'district': 'Sør-Vest politidistrikt', 'municipality': 'Stavanger', 'isActive': True,
+            'createdOn': '2023-10-01T10:00:00Z', 'updatedOn': '2023-10-01T10:00:00Z', 'category': 'Savnet',
+            'messages': [{'id': 'm1', 'text': 'Savnet person', 'hasImage': False}],
+        }]}
+
+        with patch.object(app, 'store_threads_and_messages', wraps=app.store_threads_and_messages) as store:
+            app.lambda_handler({}, {})
+            app.lambda_handler({}, {})
+
+        self.assertEqual(store.call_count, 1)
+        # One API call per run and one Pushover notification
+        self.assertEqual(mock_session_request.call_count, 3)
+        self.assertEqual(app._run_stats['short_circuits'], 1)
+
+    @mock_dynamodb
+    @mock_ssm
+    @patch('common.http.time.sleep')
+    @patch('requests.Session.request')
+    def test_failing_district_does_not_block_others(self, mock_session_request, mock_sleep):
+        import app
+        from common import aws_cache
+
+        aws_cache.invalidate()
+        app._last_digests.clear()
+        app._seen.clear()
+        app._high_water_marks.clear()
+
+        def api(method, url, json=None, data=None, timeout=None):
+            if json['district'] == 'Vest politidistrikt':
+                return Mock(status_code=503, text='Service Unavailable')
+            return Mock(status_code=200, json=Mock(return_value={'messageThreads': []}))
+
+        mock_session_request.side_effect = api
+        queries = [
+            {'district': 'Sør-Vest politidistrikt', 'categories': ['Savnet']},
+            {'district': 'Vest politidistrikt', 'categories': ['Redning']},
+        ]
+
+        with patch.dict(os.environ, {'POLITILOGGEN_QUERIES': json.dumps(queries)}):
+            response = app.lambda_handler({}, {})
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertIn(app.query_key('Sør-Vest politidistrikt', ['Savnet']), app._last_digests)
+
+    @mock_dynamodb
+    @mock_ssm
+    def test_slow_district_does_not_block_others(self):
+        import app
+        from common import aws_cache
+
+        aws_cache.invalidate()
+        app._last_digests.clear()
+        app._seen.clear()
+        app._high_water_marks.clear()
+
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def poll_query(spec, key):
+            if spec['district'] == 'Vest politidistrikt':
+                release.wait(5)
+            return {'key': key, 'digest': 'abc', 'threads': []}
+
+        queries = [
+            {'district': 'Sør-Vest politidistrikt', 'categories': ['Savnet']},
+            {'district': 'Vest politidistrikt', 'categories': ['Redning']},
+        ]
+
+        started = time.monotonic()
+        with patch.dict(os.environ, {'POLITILOGGEN_QUERIES': json.dumps(queries)}), \
+                patch.object(app, 'QUERY_TIMEOUT', 0.2), patch.object(app, 'poll_query', side_effect=poll_query):
+            response = app.lambda_handler({}, {})
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertIn(app.query_key('Sør-Vest politidistrikt', ['Savnet']), app._last_digests)
+        self.assertIsNone(app._last_digests.get(app.query_key('Vest politidistrikt', ['Redning'])))
+
     # Additional test methods would go here to test other aspects of the function
 
 
+class TestPollUntil(unittest.TestCase):
+    def setUp(self):
+        import app
+
+        self.app = app
+        path = os.path.join(tempfile.mkdtemp(), "politiloggen.db")
+        self.entries = SQLiteStorage(app.TABLE_NAME, app.TABLE_KEY_NAMES, path=path)
+
+    @patch('app.time.sleep')
+    def test_polls_until_deadline_and_releases_lease(self, mock_sleep):
+        clock = [0.0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+
+        with patch.object(self.app, 'POLL_INTERVAL', 10), patch('app.time.monotonic', lambda: clock[0]), \
+                patch.object(self.app, 'poll', return_value=200) as poll:
+            response = self.app.poll_until(self.entries, deadline=45)
+
+        self.assertEqual(response, 200)
+        # Polls at 0, 10, 20, 30 and 40 seconds, the next one would start past the deadline
+        self.assertEqual(poll.call_count, 5)
+        poll.assert_called_with(self.entries, claim=True)
+        lease = self.entries.get_item({'thread_id': self.app.STATE_THREAD_ID, 'message_id': 'lease#poller'})
+        self.assertEqual(lease['expiresAt'], 0)
+
+    def test_lease_is_kept_through_a_poll_longer_than_the_lease(self):
+        key = {'thread_id': self.app.STATE_THREAD_ID, 'message_id': 'lease#poller'}
+        taken = []
+
+        def slow_poll(entries, claim):
+            # Runs well past the lease duration, another invocation tries to take over halfway
+            time.sleep(0.5)
+            taken.append(Lease(self.entries, key, 0.3).acquire())
+            time.sleep(0.3)
+            return 200
+
+        with patch.object(self.app, 'LEASE_DURATION', 0.3), patch.object(self.app, 'poll', side_effect=slow_poll):
+            response = self.app.poll_until(self.entries, deadline=time.monotonic())
+
+        self.assertEqual(response, 200)
+        self.assertEqual(taken, [False])
+
+    def test_stops_polling_when_the_lease_is_lost(self):
+        key = {'thread_id': self.app.STATE_THREAD_ID, 'message_id': 'lease#poller'}
+
+        def stalled_poll(entries, claim):
+            # Another invocation took over the lease while this one was stalled, the next heartbeat notices
+            entries.put_item({**key, 'owner': 'other', 'expiresAt': 2 ** 50})
+            time.sleep(0.3)
+            return 200
+
+        with patch.object(self.app, 'LEASE_DURATION', 0.3), patch.object(self.app, 'POLL_INTERVAL', 0), \
+                patch.object(self.app, 'poll', side_effect=stalled_poll) as poll:
+            self.app.poll_until(self.entries, deadline=time.monotonic() + 60)
+
+        self.assertEqual(poll.call_count, 1)
+        # The lease stays with the one that took it over
+        self.assertEqual(self.entries.get_item(key)['owner'], 'other')
+
+    def test_skips_run_while_another_invocation_polls(self):
+        other = Lease(self.entries, {'thread_id': self.app.STATE_THREAD_ID, 'message_id': 'lease#poller'}, 60)
+        other.acquire()
+
+        with patch.object(self.app, 'poll') as poll:
+            response = self.app.poll_until(self.entries, deadline=0)
+
+        poll.assert_not_called()
+        self.assertEqual(response['statusCode'], 200)
+
+    def test_deadline_comes_from_the_lambda_context(self):
+        context = Mock(get_remaining_time_in_millis=Mock(return_value=300_000))
+
+        with patch('app.time.monotonic', return_value=1000.0):
+            deadline = self.app.get_deadline({}, context)
+
+        self.assertEqual(deadline, 1000.0 + 300 - self.app.POLL_DEADLINE_MARGIN)
+
+
 if __name__ == '__main__':
     unittest.main()
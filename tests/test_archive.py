@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from calendar import timegm
+from unittest.mock import patch
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_s3
+
+from common import archive, aws_cache
+from common.storage import SQLiteStorage
+
+DAY = 24 * 60 * 60
+NOW = timegm((2024, 6, 1, 0, 0, 0))
+
+
+def read_segment(s3, key):
+    body = s3.get_object(Bucket="archive", Key=key)["Body"].read()
+    return [json.loads(line) for line in gzip.decompress(body).decode("utf-8").splitlines()]
+
+
+@mock_s3
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        aws_cache.invalidate()
+        self.addCleanup(aws_cache.invalidate)
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket="archive")
+
+        path = os.path.join(tempfile.mkdtemp(), "politiloggen.db")
+        self.entries = SQLiteStorage("politiloggen-entries", ("thread_id", "message_id"), path=path)
+
+    def export(self, now=NOW, **kwargs):
+        return archive.export_expiring(
+            self.entries, "createdOn", bucket="archive", horizon_days=7, retention_days=365, now=now, **kwargs
+        )
+
+    def test_expires_at(self):
+        self.assertEqual(archive.expires_at(30, now=NOW), NOW + 30 * DAY)
+        self.assertIsNone(archive.expires_at(0, now=NOW))
+
+    def test_expiring_items_are_archived_by_date(self):
+        self.entries.put_items([
+            {"thread_id": "t1", "message_id": "m1", "createdOn": "2023-06-03T10:00:00Z", "expires_at": NOW + DAY},
+            {"thread_id": "t1", "message_id": "m2", "createdOn": "2023-06-04T10:00:00Z", "expires_at": NOW + 2 * DAY},
+            # Not expiring yet, and state without a date
+            {"thread_id": "t2", "message_id": "m3", "createdOn": "2024-05-01T10:00:00Z", "expires_at": NOW + 300 * DAY},
+            {"thread_id": "#state", "message_id": "queries", "queries": []},
+        ])
+
+        result = self.export()
+
+        self.assertEqual(result["items"], 2)
+        self.assertEqual(len(result["segments"]), 2)
+        self.assertTrue(result["segments"][0].startswith("archive/politiloggen-entries/dt=2023-06-03/part-"))
+        self.assertEqual([item["message_id"] for item in read_segment(self.s3, result["segments"][0])], ["m1"])
+
+    def test_items_are_archived_once(self):
+        self.entries.put_item({"thread_id": "t1", "message_id": "m1", "createdOn": "2023-06-03T10:00:00Z",
+                               "expires_at": NOW + DAY})
+        self.export()
+        self.entries.put_item({"thread_id": "t1", "message_id": "m2", "createdOn": "2023-06-09T10:00:00Z",
+                               "expires_at": NOW + 7 * DAY})
+
+        result = self.export(now=NOW + DAY)
+
+        self.assertEqual([item["message_id"] for item in read_segment(self.s3, result["segments"][0])], ["m2"])
+        self.assertEqual(result["items"], 1)
+
+    def test_items_without_ttl_are_archived_and_backfilled(self):
+        self.entries.put_item({"thread_id": "t1", "message_id": "m1", "createdOn": "2022-01-01T10:00:00Z"})
+
+        result = self.export()
+
+        self.assertEqual(result["items"], 1)
+        stored = self.entries.get_item({"thread_id": "t1", "message_id": "m1"})
+        self.assertEqual(stored["expires_at"], timegm((2022, 1, 1, 0, 0, 0)) + 365 * DAY)
+
+    def test_large_partitions_are_split_into_segments(self):
+        self.entries.put_items([
+            {"thread_id": "t1", "message_id": f"m{index}", "createdOn": "2023-06-03T10:00:00Z",
+             "expires_at": NOW + DAY, "text": "x" * 100}
+            for index in range(50)
+        ])
+
+        result = self.export(segment_bytes=1000)
+
+        self.assertGreater(len(result["segments"]), 1)
+        archived = [item for key in result["segments"] for item in read_segment(self.s3, key)]
+        self.assertEqual(len(archived), 50)
+
+    def test_missing_watermark_without_list_permission(self):
+        # Without s3:ListBucket a missing key is a 403, not NoSuchKey
+        denied = ClientError({"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "GetObject")
+        with patch.object(self.s3, "get_object", side_effect=denied):
+            self.assertEqual(archive.load_watermark(self.s3, "archive", "archive/watermark.json"), 0)
+
+        throttled = ClientError({"Error": {"Code": "SlowDown", "Message": "Slow Down"}}, "GetObject")
+        with patch.object(self.s3, "get_object", side_effect=throttled):
+            with self.assertRaises(ClientError):
+                archive.load_watermark(self.s3, "archive", "archive/watermark.json")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import patch
+
+import boto3
+from moto import mock_ssm
+
+from common import aws_cache
+
+
+@mock_ssm
+class TestAwsCache(unittest.TestCase):
+    def setUp(self):
+        aws_cache.invalidate()
+        ssm = boto3.client('ssm')
+        ssm.put_parameter(Name='pushover_user_key', Value='user', Type='SecureString')
+        ssm.put_parameter(Name='pushover_api_token', Value='token', Type='SecureString')
+
+    def tearDown(self):
+        aws_cache.invalidate()
+
+    def test_clients_and_resources_are_reused(self):
+        self.assertIs(aws_cache.get_client('ssm'), aws_cache.get_client('ssm'))
+        self.assertIs(aws_cache.get_resource('dynamodb'), aws_cache.get_resource('dynamodb'))
+
+    def test_secrets_are_fetched_once(self):
+        client = aws_cache.get_client('ssm')
+        with patch.object(client, 'get_parameters', wraps=client.get_parameters) as get_parameters:
+            for _ in range(5):
+                secrets = aws_cache.get_secrets(['pushover_user_key', 'pushover_api_token'])
+
+        self.assertEqual(secrets, {'pushover_user_key': 'user', 'pushover_api_token': 'token'})
+        self.assertEqual(get_parameters.call_count, 1)
+
+    def test_missing_secret_is_none(self):
+        self.assertEqual(aws_cache.get_secrets(['does_not_exist']), {'does_not_exist': None})
+
+    def test_invalidate_refetches_secrets(self):
+        self.assertEqual(aws_cache.get_secrets(['pushover_api_token'])['pushover_api_token'], 'token')
+        boto3.client('ssm').put_parameter(Name='pushover_api_token', Value='rotated', Type='SecureString',
+                                          Overwrite=True)
+
+        # Still served from the cache until it is invalidated
+        self.assertEqual(aws_cache.get_secrets(['pushover_api_token'])['pushover_api_token'], 'token')
+        aws_cache.invalidate(secrets_only=True)
+        self.assertEqual(aws_cache.get_secrets(['pushover_api_token'])['pushover_api_token'], 'rotated')
+
+    def test_verified_tables(self):
+        self.assertFalse(aws_cache.is_table_verified('politiloggen-entries'))
+        aws_cache.mark_table_verified('politiloggen-entries')
+        self.assertTrue(aws_cache.is_table_verified('politiloggen-entries'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+import argparse
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from common.storage import SQLiteStorage, ThrottledStorage
+from tests.test_store import make_thread
+
+DATE_FROM = datetime(2023, 1, 1)
+DATE_TO = datetime(2023, 7, 1)
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        import app
+        import backfill
+
+        self.app = app
+        self.backfill = backfill
+        app._seen.clear()
+        path = os.path.join(tempfile.mkdtemp(), "politiloggen.db")
+        self.entries = SQLiteStorage(app.TABLE_NAME, app.TABLE_KEY_NAMES, path=path)
+
+        # 23 threads in the range, newest first, served a page at a time
+        self.threads = [make_thread(f"t{index}", [f"t{index}", f"m{index}"]) for index in range(23)]
+        patcher = patch.object(app, "fetch_page", side_effect=self.fetch_page)
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Don't actually wait for the write rate
+        patcher = patch("common.storage.time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch_page(self, district, categories, page, date_from, date_to, page_size):
+        return self.threads[page * page_size:(page + 1) * page_size]
+
+    def run_backfill(self, **kwargs):
+        return self.backfill.backfill(
+            self.entries, "Sør-Vest politidistrikt", ["Savnet"], DATE_FROM, DATE_TO, page_size=10, **kwargs
+        )
+
+    def test_stores_every_page_without_notifying(self):
+        with patch.object(self.app, "dispatch_notifications") as dispatch:
+            checkpoint = self.run_backfill()
+
+        dispatch.assert_not_called()
+        self.assertEqual((checkpoint["page"], checkpoint["threads"], checkpoint["messages"]), (3, 23, 46))
+        self.assertTrue(checkpoint["done"])
+        self.assertIsNotNone(self.entries.get_item({"thread_id": "t22", "message_id": "m22"}))
+
+    def test_resumes_from_checkpoint(self):
+        first = self.run_backfill(max_pages=2)
+        self.assertFalse(first["done"])
+
+        # A new run with another page size continues in the pages of the first one
+        self.fetch.reset_mock()
+        checkpoint = self.backfill.backfill(
+            self.entries, "Sør-Vest politidistrikt", ["Savnet"], DATE_FROM, DATE_TO, page_size=50
+        )
+
+        self.assertEqual([call.args[2] for call in self.fetch.call_args_list], [2])
+        self.assertEqual(checkpoint["threads"], 23)
+        self.assertTrue(checkpoint["done"])
+
+        # Done backfills don't fetch anything
+        self.fetch.reset_mock()
+        self.run_backfill()
+        self.fetch.assert_not_called()
+
+    def test_refuses_recent_range(self):
+        for date_to in (datetime.now(timezone.utc), datetime.utcnow(), datetime.now(timezone(timedelta(hours=2)))):
+            with self.assertRaises(ValueError):
+                self.backfill.backfill(self.entries, "Sør-Vest politidistrikt", ["Savnet"], DATE_FROM, date_to)
+
+    def test_dates_with_offsets(self):
+        date_from = self.backfill.parse_date("2023-01-01T01:00+01:00")
+        date_to = self.backfill.parse_date("2023-07-01T00:00Z")
+
+        utc_from, utc_to = DATE_FROM.replace(tzinfo=timezone.utc), DATE_TO.replace(tzinfo=timezone.utc)
+        self.assertEqual((date_from, date_to), (utc_from, utc_to))
+        self.assertEqual(self.backfill.parse_date("2023-07-01"), utc_to)
+        with self.assertRaises(argparse.ArgumentTypeError):
+            self.backfill.parse_date("July 1st")
+
+        # Resumes the same backfill as the naive UTC dates
+        self.run_backfill(max_pages=1)
+        checkpoint = self.backfill.backfill(
+            self.entries, "Sør-Vest politidistrikt", ["Savnet"], date_from, date_to, page_size=10
+        )
+        self.assertEqual(checkpoint["page"], 3)
+
+
+class TestThrottledStorage(unittest.TestCase):
+    @patch("common.storage.time.sleep")
+    @patch("common.storage.time.monotonic", return_value=100.0)
+    def test_writes_are_batched_and_rate_limited(self, mock_monotonic, mock_sleep):
+        path = os.path.join(tempfile.mkdtemp(), "throttled.db")
+        storage = SQLiteStorage("throttled", ("id",), path=path)
+        throttled = ThrottledStorage(storage, rate=10, batch_size=25)
+
+        with patch.object(storage, "put_items", wraps=storage.put_items) as put_items:
+            throttled.put_items([{"id": str(index)} for index in range(60)])
+
+        self.assertEqual([len(call.args[0]) for call in put_items.call_args_list], [25, 25, 10])
+        # 25 items at 10 per second before each of the next two batches
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [2.5, 5.0])
+        self.assertEqual(len(list(throttled.scan())), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+import boto3
+from moto import mock_dynamodb, mock_ssm
+
+from tests.conftest import load_module
+
+
+@mock_dynamodb
+@mock_ssm
+class TestReplayBenchmark(unittest.TestCase):
+    def test_politiloggen_scenario(self):
+        import app
+
+        replay = load_module("benchmarks/replay.py", "replay")
+        replay.create_tables(app)
+
+        first_run, unchanged = replay.run_politiloggen(app, 20)
+
+        self.assertEqual(first_run["status"], 200)
+        # Every thread is new and gets its own digest notification, the unchanged payload is one API call
+        self.assertEqual(first_run["calls"]["http.api.pushover.net"], 20)
+        self.assertEqual(unchanged["calls"], {"http.politiloggen-vis-frontend.bks-prod.politiet.no": 1})
+        self.assertGreater(first_run["peak_memory_bytes"], 0)
+        self.assertGreater(first_run["bytes_received"], unchanged["bytes_received"])
+
+    def test_nitter_scenario(self):
+        import app
+
+        replay = load_module("benchmarks/replay.py", "replay")
+        replay.create_tables(app)
+        replay.reset_caches(app)
+        notifier = replay.load_desktop_notifier()
+
+        first_run, unchanged = replay.run_nitter(notifier, 5)
+
+        # Every feed is fetched on both runs, the unchanged feeds answer 304 without a body
+        self.assertEqual(first_run["calls"], {"http.nitter.net": len(notifier.RSS_FEEDS)})
+        self.assertEqual(unchanged["calls"], {"http.nitter.net": len(notifier.RSS_FEEDS)})
+        self.assertGreater(first_run["bytes_received"], 0)
+        self.assertEqual(unchanged["bytes_received"], 0)
+
+        # The new entries of the subscribed feed are fanned out to the subscriber's timeline
+        timeline = boto3.resource("dynamodb").Table("user_timeline").scan()["Items"]
+        self.assertEqual(len(timeline), 5)
+        self.assertTrue(all(item["feed_url"] == notifier.RSS_FEEDS[0] for item in timeline))
+
+
+if __name__ == '__main__':
+    unittest.main()
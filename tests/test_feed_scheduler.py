@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+from unittest.mock import Mock, patch
+
+from common import feed_scheduler
+from common.feed_scheduler import FeedSchedule
+
+
+def make_schedule():
+    # No jitter, so the intervals can be checked exactly
+    rng = Mock(uniform=Mock(return_value=1))
+    return FeedSchedule("https://example.com/rss", min_interval=30, max_interval=1800, rng=rng)
+
+
+class TestFeedSchedule(unittest.TestCase):
+    def test_quiet_feed_backs_off_to_the_maximum(self):
+        schedule = make_schedule()
+
+        delays = [schedule.update(None, now) for now in range(0, 20000, 1000)]
+
+        self.assertEqual(delays[:3], [45, 67.5, 101.25])
+        self.assertEqual(delays[-1], 1800)
+
+    def test_interval_follows_posting_frequency(self):
+        busy, weekly = make_schedule(), make_schedule()
+        now = 1_000_000
+
+        # One post every 5 minutes, and one post a week
+        busy.update([now - 300 * n for n in range(10)], now)
+        weekly.update([now - 7 * 86400 * n for n in range(1, 4)], now)
+        for _ in range(20):
+            busy.update(None, now)
+            weekly.update(None, now)
+
+        self.assertLess(busy.interval, 300)
+        self.assertEqual(weekly.interval, 1800)
+
+    def test_new_post_shrinks_the_interval(self):
+        schedule = make_schedule()
+        now = 1_000_000
+        schedule.update([now - 3600 * n for n in range(1, 6)], now)
+        for _ in range(10):
+            schedule.update(None, now)
+        quiet_interval = schedule.interval
+
+        schedule.update([now + 10], now + 10)
+
+        # At least halved, more as the new post also raises the posting frequency
+        self.assertLessEqual(schedule.interval, quiet_interval / 2)
+        self.assertEqual(schedule.post_times[-1], now + 10)
+
+    def test_jitter_spreads_polls(self):
+        schedule = FeedSchedule("https://example.com/rss", min_interval=100, max_interval=100)
+
+        delays = {round(schedule.update(None, 0), 3) for _ in range(20)}
+
+        self.assertGreater(len(delays), 1)
+        self.assertTrue(all(80 <= delay <= 120 for delay in delays))
+
+
+class TestRun(unittest.TestCase):
+    def test_feeds_are_polled_on_their_own_schedules(self):
+        polls = []
+
+        async def main():
+            stop = asyncio.Event()
+
+            def poll(feed_url):
+                polls.append(feed_url)
+                if feed_url == "broken":
+                    raise ValueError("bad feed")
+                if len(polls) >= 4:
+                    stop.set()
+                return None
+
+            with patch.object(feed_scheduler, "FEED_JITTER", 0):
+                return await feed_scheduler.run(["a", "broken"], poll, stop)
+
+        with patch.object(feed_scheduler, "FEED_MIN_INTERVAL", 0.01), \
+                patch.object(feed_scheduler, "FEED_MAX_INTERVAL", 0.01):
+            schedules = asyncio.run(main())
+
+        # The broken feed keeps its own schedule and doesn't stop the other one
+        self.assertEqual(set(polls), {"a", "broken"})
+        self.assertGreaterEqual(len(polls), 4)
+        self.assertEqual([schedule.feed_url for schedule in schedules], ["a", "broken"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch, Mock
+
+import app
+
+
+def make_page(updated_ons):
+    response = Mock(status_code=200)
+    response.json.return_value = {
+        "messageThreads": [{"id": f"t-{updated_on}", "updatedOn": updated_on} for updated_on in updated_ons]
+    }
+    return response
+
+
+class TestFetchApiData(unittest.TestCase):
+    @patch('app.PAGE_SIZE', 2)
+    @patch('requests.Session.request')
+    def test_first_run_fetches_one_page(self, mock_session_request):
+        mock_session_request.side_effect = [make_page(["2023-10-01T10:04", "2023-10-01T10:03"])]
+
+        data = app.fetch_api_data(since=None)
+
+        self.assertEqual(len(data["messageThreads"]), 2)
+        self.assertEqual(mock_session_request.call_count, 1)
+
+    @patch('app.PAGE_SIZE', 2)
+    @patch('requests.Session.request')
+    def test_pages_until_known_territory(self, mock_session_request):
+        mock_session_request.side_effect = [
+            make_page(["2023-10-01T10:09", "2023-10-01T10:08"]),
+            make_page(["2023-10-01T10:07", "2023-10-01T10:06"]),
+            make_page(["2023-10-01T10:05", "2023-10-01T10:04"]),
+        ]
+
+        data = app.fetch_api_data(since="2023-10-01T10:05")
+
+        self.assertEqual(
+            [thread["updatedOn"] for thread in data["messageThreads"]],
+            ["2023-10-01T10:09", "2023-10-01T10:08", "2023-10-01T10:07", "2023-10-01T10:06"],
+        )
+        self.assertEqual([call.kwargs["json"]["skip"] for call in mock_session_request.call_args_list], [0, 2, 4])
+
+    @patch('requests.Session.request')
+    def test_nothing_new(self, mock_session_request):
+        mock_session_request.side_effect = [make_page(["2023-10-01T10:05"])]
+
+        self.assertEqual(app.fetch_api_data(since="2023-10-01T10:05"), {"messageThreads": []})
+
+    @patch('common.http.time.sleep')
+    @patch('requests.Session.request')
+    def test_api_error(self, mock_session_request, mock_sleep):
+        mock_session_request.return_value = Mock(status_code=503, text="Service Unavailable")
+
+        with self.assertRaises(app.ApiUnavailableException):
+            app.fetch_api_data()
+
+    def test_merge_threads_keeps_newest_copy(self):
+        merged = app.merge_threads([
+            [{"id": "t1", "updatedOn": "2023-10-01T10:00"}, {"id": "t2", "updatedOn": "2023-10-01T10:00"}],
+            [{"id": "t1", "updatedOn": "2023-10-01T10:05"}],
+        ])
+
+        self.assertEqual(sorted((t["id"], t["updatedOn"]) for t in merged),
+                         [("t1", "2023-10-01T10:05"), ("t2", "2023-10-01T10:00")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import base64
+import json
+import unittest
+
+import boto3
+from moto import mock_dynamodb
+
+from common import timeline
+from tests.conftest import load_module
+
+
+def encode(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+@mock_dynamodb
+class TestTimeline(unittest.TestCase):
+    def setUp(self):
+        timeline._subscribers.clear()
+        self.get_tweets = load_module("app/get_tweets/lambda_function.py", "get_tweets_lambda")
+        self.add_feed = load_module("app/add_feed/lambda_function.py", "add_feed_lambda")
+        self.dynamodb = boto3.resource('dynamodb')
+        self.user_feeds = self.dynamodb.create_table(
+            TableName='user_feeds',
+            KeySchema=[{'AttributeName': 'user', 'KeyType': 'HASH'}, {'AttributeName': 'feed_url', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'user', 'AttributeType': 'S'},
+                {'AttributeName': 'feed_url', 'AttributeType': 'S'},
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'FeedUsersIndex',
+                'KeySchema': [{'AttributeName': 'feed_url', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'KEYS_ONLY'},
+            }],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        self.dynamodb.create_table(
+            TableName='user_timeline',
+            KeySchema=[{'AttributeName': 'user', 'KeyType': 'HASH'}, {'AttributeName': 'sort_key', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'user', 'AttributeType': 'S'},
+                {'AttributeName': 'sort_key', 'AttributeType': 'S'},
+            ],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        self.rss_entries = self.dynamodb.create_table(
+            TableName='rss_entries',
+            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'id', 'AttributeType': 'S'},
+                {'AttributeName': 'feed_url', 'AttributeType': 'S'},
+                {'AttributeName': 'date', 'AttributeType': 'S'},
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'FeedDateIndex',
+                'KeySchema': [
+                    {'AttributeName': 'feed_url', 'KeyType': 'HASH'},
+                    {'AttributeName': 'date', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+            }],
+            BillingMode='PAY_PER_REQUEST',
+        )
+
+        self.user_feeds.put_item(Item={'user': 'kmoberg', 'feed_url': 'a'})
+        self.user_feeds.put_item(Item={'user': 'kmoberg', 'feed_url': 'b'})
+        self.user_feeds.put_item(Item={'user': 'someone', 'feed_url': 'b'})
+
+    def add_entries(self):
+        for minute in range(12):
+            feed = 'a' if minute % 2 else 'b'
+            entry = {
+                'id': f'{feed}{minute}', 'feed_url': feed, 'date': f'2023-10-01T10:{minute:02d}:00Z', 'title': 'Tweet',
+            }
+            self.rss_entries.put_item(Item=entry)
+            timeline.fan_out_entry(self.dynamodb, entry)
+
+    def get_page(self, user='kmoberg', cursor=None, limit=5):
+        response = self.get_tweets.lambda_handler({'user_id': user, 'cursor': cursor, 'limit': limit}, None)
+        return json.loads(response['body'])
+
+    def test_fan_out_reaches_every_subscriber(self):
+        self.assertEqual(timeline.fan_out_entry(self.dynamodb, {'id': 'b0', 'feed_url': 'b', 'date': '2023-10-01'}), 2)
+        self.assertEqual(timeline.fan_out_entry(self.dynamodb, {'id': 'x0', 'feed_url': 'x', 'date': '2023-10-01'}), 0)
+
+    def test_timeline_rows_expire(self):
+        item = timeline.timeline_item('kmoberg', {'id': 'a1', 'feed_url': 'a', 'date': '2023-10-01T10:00:00Z'})
+
+        self.assertEqual(item['sort_key'], '2023-10-01T10:00:00Z#a1')
+        self.assertGreater(item['expires_at'], 0)
+
+    def test_timeline_is_newest_first(self):
+        self.add_entries()
+
+        dates = [entry['date'] for entry in self.get_page(limit=50)['entries']]
+
+        self.assertEqual(len(dates), 12)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertEqual(len(self.get_page(user='someone', limit=50)['entries']), 6)
+
+    def test_cursor_pages_through_timeline(self):
+        self.add_entries()
+
+        ids = []
+        cursor = None
+        while True:
+            page = self.get_page(cursor=cursor)
+            self.assertLessEqual(len(page['entries']), 5)
+            ids.extend(entry['id'] for entry in page['entries'])
+            cursor = page['cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(len(ids), 12)
+        self.assertEqual(len(set(ids)), 12)
+
+    def test_entries_have_no_timeline_bookkeeping(self):
+        self.add_entries()
+
+        entry = self.get_page(limit=50)['entries'][0]
+
+        self.assertEqual(entry, {'id': 'a11', 'feed_url': 'a', 'date': '2023-10-01T10:11:00Z', 'title': 'Tweet'})
+
+    def test_new_subscriber_timeline_is_seeded(self):
+        self.add_entries()
+
+        response = self.add_feed.lambda_handler({'body': json.dumps({'user_id': 'newcomer', 'feed_url': 'a'})}, None)
+        page = self.get_page(user='newcomer', limit=50)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual([entry['id'] for entry in page['entries']], ['a11', 'a9', 'a7', 'a5', 'a3', 'a1'])
+
+        # Entries of the feed from then on are fanned out to the new subscriber as well
+        timeline._subscribers.clear()
+        self.assertEqual(timeline.fan_out_entry(self.dynamodb, {'id': 'a13', 'feed_url': 'a', 'date': '2023-10-02'}), 2)
+
+    def test_invalid_limit_is_rejected(self):
+        for limit in ('ten', '0', '-1'):
+            response = self.get_tweets.lambda_handler({'user_id': 'kmoberg', 'limit': limit}, None)
+            self.assertEqual(response['statusCode'], 400)
+
+    def test_invalid_cursor_is_rejected(self):
+        # Not base64, not JSON, a start key in another user's timeline and a start key with extra attributes
+        for cursor in ('%%%', base64.urlsafe_b64encode(b'{nope').decode('ascii'), encode(['kmoberg']),
+                       encode({'user': 'someone', 'sort_key': '2023-10-01T10:00:00Z#b0'}),
+                       encode({'user': 'kmoberg', 'sort_key': 1}),
+                       encode({'user': 'kmoberg', 'sort_key': '2023', 'id': 'a1'})):
+            response = self.get_tweets.lambda_handler({'user_id': 'kmoberg', 'cursor': cursor}, None)
+            self.assertEqual(response['statusCode'], 400, cursor)
+
+
+if __name__ == '__main__':
+    unittest.main()
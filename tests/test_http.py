@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch, Mock
+
+import requests
+
+from common import http
+
+
+@patch('common.http.time.sleep')
+@patch('requests.Session.request')
+class TestHttp(unittest.TestCase):
+    def test_retries_server_errors(self, mock_session_request, mock_sleep):
+        mock_session_request.side_effect = [Mock(status_code=502), Mock(status_code=503), Mock(status_code=200)]
+
+        response = http.request("GET", "https://nitter.net/politietsorvest/rss")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_session_request.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    def test_does_not_retry_client_errors(self, mock_session_request, mock_sleep):
+        mock_session_request.return_value = Mock(status_code=404)
+
+        self.assertEqual(http.request("GET", "https://nitter.net/unknown/rss").status_code, 404)
+        self.assertEqual(mock_session_request.call_count, 1)
+
+    def test_raises_after_last_attempt(self, mock_session_request, mock_sleep):
+        mock_session_request.side_effect = requests.exceptions.ConnectionError("refused")
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            http.request("GET", "https://nitter.net/politietsorvest/rss", max_attempts=3)
+        self.assertEqual(mock_session_request.call_count, 3)
+
+    def test_gives_up_when_deadline_is_spent(self, mock_session_request, mock_sleep):
+        mock_session_request.return_value = Mock(status_code=500)
+
+        with patch('common.http.backoff_delay', return_value=5):
+            response = http.request("GET", "https://nitter.net/politietsorvest/rss", deadline=1)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(mock_session_request.call_count, 1)
+
+    def test_per_host_timeout(self, mock_session_request, mock_sleep):
+        mock_session_request.return_value = Mock(status_code=200)
+
+        http.request("POST", "https://api.pushover.net/1/messages.json", data={})
+
+        self.assertEqual(mock_session_request.call_args.kwargs["timeout"], 15)
+
+    def test_does_not_resend_post_after_it_was_sent(self, mock_session_request, mock_sleep):
+        # Pushover may have accepted the message before the response timed out
+        mock_session_request.side_effect = [requests.exceptions.ReadTimeout("timed out"), Mock(status_code=200)]
+
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            http.request("POST", "https://api.pushover.net/1/messages.json", data={})
+        self.assertEqual(mock_session_request.call_count, 1)
+
+    def test_does_not_resend_post_on_server_errors(self, mock_session_request, mock_sleep):
+        mock_session_request.return_value = Mock(status_code=503)
+
+        self.assertEqual(http.request("POST", "https://api.pushover.net/1/messages.json", data={}).status_code, 503)
+        self.assertEqual(mock_session_request.call_count, 1)
+
+    def test_retries_post_that_was_not_sent(self, mock_session_request, mock_sleep):
+        mock_session_request.side_effect = [requests.exceptions.ConnectTimeout("timed out"), Mock(status_code=200)]
+
+        response = http.request("POST", "https://api.pushover.net/1/messages.json", data={})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_session_request.call_count, 2)
+
+    def test_retries_idempotent_post(self, mock_session_request, mock_sleep):
+        mock_session_request.side_effect = [requests.exceptions.ReadTimeout("timed out"), Mock(status_code=200)]
+
+        response = http.request("POST", "https://politiloggen-vis-frontend.bks-prod.politiet.no/api/messagethread",
+                                json={}, idempotent=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_session_request.call_count, 2)
+
+    def test_session_is_shared(self, mock_session_request, mock_sleep):
+        self.assertIs(http.get_session(), http.get_session())
+        self.assertEqual(set(http.connection_stats()), {"requests", "opened", "reused"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import boto3
+from moto import mock_dynamodb
+
+from common import keyword_filter
+from common.keyword_filter import KeywordFilter
+from common.storage import DynamoDBStorage, SQLiteStorage
+
+
+class TestKeywordFilter(unittest.TestCase):
+    def test_match_is_case_insensitive(self):
+        self.assertEqual(KeywordFilter(["Bømlo"]).match("Trafikkuhell på BØMLO"), "Bømlo")
+
+    def test_longest_keyword_is_reported(self):
+        self.assertEqual(KeywordFilter(["oslo", "oslofjorden"]).match("Båt savnet i Oslofjorden"), "oslofjorden")
+
+    def test_decomposed_characters_match(self):
+        # "å" written as "a" followed by a combining ring
+        self.assertEqual(KeywordFilter(["påkjørsel"]).match("Pa\u030akjørsel i Sandnes"), "påkjørsel")
+
+    def test_swedish_spellings_match(self):
+        self.assertEqual(KeywordFilter(["bømlo"]).match("Bömlo"), "bømlo")
+
+    def test_checks_every_text(self):
+        self.assertEqual(KeywordFilter(["haugesund"]).match(None, "Savnet person", "Haugesund"), "haugesund")
+        self.assertIsNone(KeywordFilter(["haugesund"]).match("Savnet person", "Sandnes"))
+
+    def test_empty_filter_matches_nothing(self):
+        self.assertIsNone(KeywordFilter([]).match("Anything"))
+
+
+@mock_dynamodb
+class TestLoadKeywords(unittest.TestCase):
+    def setUp(self):
+        keyword_filter.invalidate()
+
+    def tearDown(self):
+        keyword_filter.invalidate()
+
+    def create_table(self):
+        table = boto3.resource('dynamodb').create_table(
+            TableName='ignored_keywords',
+            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        return table, DynamoDBStorage(table, ("id",))
+
+    def test_loads_keyword_set(self):
+        table, storage = self.create_table()
+        table.put_item(Item={'id': 'keywords', 'keywords': {'stord', 'sveio'}, 'version': 2})
+
+        keyword_filter_ = keyword_filter.get_filter(storage)
+
+        self.assertEqual(keyword_filter_.match("Brann på Stord"), "stord")
+        self.assertEqual(keyword_filter_.version, 2)
+
+    @patch('common.keyword_filter.KEYWORD_CACHE_TTL', 0)
+    def test_filter_is_only_rebuilt_when_version_changes(self):
+        table, storage = self.create_table()
+        table.put_item(Item={'id': 'keywords', 'keywords': {'stord'}, 'version': 1})
+
+        first = keyword_filter.get_filter(storage)
+        self.assertIs(keyword_filter.get_filter(storage), first)
+
+        table.put_item(Item={'id': 'keywords', 'keywords': {'stord', 'sveio'}, 'version': 2})
+        second = keyword_filter.get_filter(storage)
+
+        self.assertIsNot(second, first)
+        self.assertEqual(second.match("Sveio"), "sveio")
+
+    def test_default_is_used_when_table_is_missing(self):
+        storage = DynamoDBStorage(boto3.resource('dynamodb').Table('ignored_keywords'), ("id",))
+
+        self.assertEqual(keyword_filter.get_filter(storage, default=["oslo"]).match("Oslo"), "oslo")
+
+    def test_default_is_used_when_keywords_item_is_missing(self):
+        table, storage = self.create_table()
+
+        self.assertEqual(keyword_filter.get_filter(storage, default=["oslo"]).match("Oslo"), "oslo")
+
+    @patch('common.keyword_filter.KEYWORD_CACHE_TTL', 0)
+    def test_seeded_keywords_replace_the_default(self):
+        table, storage = self.create_table()
+        keyword_filter.get_filter(storage, default=["oslo"])
+
+        table.put_item(Item={'id': 'keywords', 'keywords': {'stord'}, 'version': 1})
+        seeded = keyword_filter.get_filter(storage, default=["oslo"])
+
+        self.assertIsNone(seeded.match("Oslo"))
+        self.assertEqual(seeded.match("Stord"), "stord")
+
+    def test_empty_keyword_set_is_not_replaced_by_the_default(self):
+        table, storage = self.create_table()
+        table.put_item(Item={'id': 'keywords', 'version': 3})
+
+        self.assertIsNone(keyword_filter.get_filter(storage, default=["oslo"]).match("Oslo"))
+
+    def test_loads_keywords_from_sqlite(self):
+        path = os.path.join(tempfile.mkdtemp(), "keywords.db")
+        storage = SQLiteStorage('ignored_keywords', ("id",), path=path)
+        storage.put_item({'id': 'keywords', 'keywords': {'stord', 'sveio'}, 'version': 1})
+
+        self.assertEqual(keyword_filter.get_filter(storage).match("Brann på Stord"), "stord")
+
+
+if __name__ == '__main__':
+    unittest.main()
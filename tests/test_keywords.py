@@ -0,0 +1,46 @@
+import unittest
+
+import boto3
+from moto import mock_dynamodb
+
+from tests.conftest import load_module
+
+
+@mock_dynamodb
+class TestKeywordLambdas(unittest.TestCase):
+    def setUp(self):
+        self.add_keyword = load_module("app/add_keyword/lambda_function.py", "add_keyword_lambda")
+        self.remove_keyword = load_module("app/remove_keyword/lambda_function.py", "remove_keyword_lambda")
+        self.table = boto3.resource('dynamodb').create_table(
+            TableName='ignored_keywords',
+            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+
+    def get_item(self):
+        return self.table.get_item(Key={'id': 'keywords'}).get('Item', {})
+
+    def test_add_and_remove(self):
+        self.add_keyword.lambda_handler({'keyword': 'stord'}, None)
+        self.add_keyword.lambda_handler({'keyword': 'sveio'}, None)
+        self.assertEqual(self.get_item()['keywords'], {'stord', 'sveio'})
+        self.assertEqual(self.get_item()['version'], 2)
+
+        self.remove_keyword.lambda_handler({'keyword': 'stord'}, None)
+        self.assertEqual(self.get_item()['keywords'], {'sveio'})
+        self.assertEqual(self.get_item()['version'], 3)
+
+    def test_noop_changes_do_not_bump_version(self):
+        self.add_keyword.lambda_handler({'keyword': 'stord'}, None)
+        self.add_keyword.lambda_handler({'keyword': 'stord'}, None)
+        self.remove_keyword.lambda_handler({'keyword': 'sveio'}, None)
+
+        self.assertEqual(self.get_item()['version'], 1)
+
+    def test_empty_keyword_is_rejected(self):
+        self.assertEqual(self.add_keyword.lambda_handler({'keyword': ' '}, None)['statusCode'], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from common.lease import Lease, LeaseLostException
+from common.storage import SQLiteStorage
+
+
+class TestLease(unittest.TestCase):
+    def setUp(self):
+        path = os.path.join(tempfile.mkdtemp(), "lease.db")
+        self.storage = SQLiteStorage("leases", ("thread_id", "message_id"), path=path)
+        self.key = {"thread_id": "#state", "message_id": "lease#poller"}
+
+    def test_only_one_holder(self):
+        first = Lease(self.storage, self.key, 60)
+        second = Lease(self.storage, self.key, 60)
+
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertTrue(first.held)
+        self.assertFalse(second.held)
+
+    def test_release_frees_the_lease(self):
+        first = Lease(self.storage, self.key, 60)
+        first.acquire()
+        first.release()
+
+        self.assertFalse(first.held)
+        self.assertTrue(Lease(self.storage, self.key, 60).acquire())
+
+    def test_expired_lease_is_taken_over(self):
+        first = Lease(self.storage, self.key, 60)
+        second = Lease(self.storage, self.key, 60)
+
+        with patch("common.lease.now_ms", return_value=1_000_000):
+            first.acquire()
+        with patch("common.lease.now_ms", return_value=1_000_000 + 61_000):
+            self.assertTrue(second.acquire())
+            with self.assertRaises(LeaseLostException):
+                first.renew()
+
+        self.assertEqual(self.storage.get_item(self.key)["owner"], second.owner)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import io
+import json
+import logging
+import os
+import unittest
+from unittest.mock import patch
+
+from common import init_logging
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        # Every test builds its own shared handler
+        patcher = patch.object(init_logging, "_handler", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_record(self, level, msg, *args):
+        return logging.LogRecord("test", level, "app.py", 42, msg, args, None)
+
+    def test_formatters_are_built_once(self):
+        formatter = init_logging.CustomFormatter()
+
+        with patch("logging.Formatter.__init__") as formatter_init:
+            output = formatter.format(self.make_record(logging.INFO, "Stored %s", "m1"))
+
+        formatter_init.assert_not_called()
+        self.assertIn("Stored m1", output)
+
+    def test_json_formatter(self):
+        record = self.make_record(logging.WARNING, "Retrying %d keys", 3)
+
+        document = json.loads(init_logging.JsonFormatter().format(record))
+
+        self.assertEqual(document["level"], "WARNING")
+        self.assertEqual(document["message"], "Retrying 3 keys")
+        self.assertEqual(document["location"], "app.py:42")
+        self.assertTrue(document["time"].endswith("Z"))
+
+    def test_lambda_gets_json_on_stdout(self):
+        stdout = io.StringIO()
+        environment = {"AWS_EXECUTION_ENV": "AWS_Lambda_python3.10", "LOG_LEVEL": "INFO"}
+        with patch.dict(os.environ, environment), patch("sys.stdout", stdout):
+            logger = init_logging.setup_logger("test_lambda_gets_json_on_stdout")
+            logger.info("New message %s", "m1")
+
+        self.assertFalse(logger.propagate)
+        self.assertEqual(json.loads(stdout.getvalue())["message"], "New message m1")
+
+    def test_disabled_levels_are_not_formatted(self):
+        logger = init_logging.setup_logger("test_disabled_levels_are_not_formatted")
+        logger.setLevel(logging.INFO)
+
+        class Payload:
+            def __str__(self):
+                raise AssertionError("formatted a disabled record")
+
+        logger.debug("Pushover data: %s", Payload())
+
+    def test_queue_handler(self):
+        with patch.object(init_logging, "LOG_QUEUE", True):
+            handler = init_logging.get_handler()
+        listener = init_logging._listener
+        self.addCleanup(init_logging.stop_listener)
+
+        self.assertIsInstance(handler, logging.handlers.QueueHandler)
+        self.assertIsInstance(listener.handlers[0], logging.StreamHandler)
+
+
+if __name__ == '__main__':
+    unittest.main()
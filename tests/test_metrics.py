@@ -0,0 +1,83 @@
+import json
+import unittest
+from unittest.mock import patch
+
+import boto3
+from moto import mock_dynamodb
+
+from common import aws_cache, metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_one_emf_line_per_invocation(self):
+        @metrics.emit_metrics("test")
+        def handler():
+            with metrics.phase("Fetch"):
+                metrics.record_http_status(200)
+                metrics.record_http_status(503)
+                metrics.record_http_status(None)
+            metrics.add("NewMessages", 3)
+            return {"statusCode": 200}
+
+        with patch.object(metrics.metrics_logger, "info") as emit:
+            self.assertEqual(handler(), {"statusCode": 200})
+
+        emit.assert_called_once()
+        document = json.loads(json.dumps(emit.call_args.args[0]))
+        definition = document["_aws"]["CloudWatchMetrics"][0]
+        names = {metric["Name"]: metric["Unit"] for metric in definition["Metrics"]}
+
+        self.assertEqual(definition["Dimensions"], [["Function"]])
+        self.assertEqual(document["Function"], "test")
+        self.assertEqual(document["StatusCode"], 200)
+        self.assertEqual(names["FetchDuration"], "Milliseconds")
+        self.assertEqual((document["HTTP2xx"], document["HTTP5xx"], document["HTTPErrors"]), (1, 1, 1))
+        self.assertEqual(document["NewMessages"], 3)
+        self.assertIn("TotalDuration", document)
+
+    def test_metrics_are_written_when_the_handler_fails(self):
+        @metrics.emit_metrics("test")
+        def handler():
+            raise ValueError("boom")
+
+        with patch.object(metrics.metrics_logger, "info") as emit, self.assertRaises(ValueError):
+            handler()
+
+        emit.assert_called_once()
+        self.assertIsNone(metrics._current)
+
+    def test_outside_a_handler_nothing_is_recorded(self):
+        metrics.add("NewMessages")
+
+        with metrics.phase("Fetch"):
+            pass
+
+        self.assertIsNone(metrics._current)
+
+    @mock_dynamodb
+    def test_dynamodb_calls_are_counted(self):
+        aws_cache.invalidate()
+        table = aws_cache.get_resource("dynamodb").create_table(
+            TableName="counted",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+        @metrics.emit_metrics("test")
+        def handler():
+            table.put_item(Item={"id": "a"})
+            table.get_item(Key={"id": "a"})
+            table.get_item(Key={"id": "b"})
+            # Clients made outside the cache are not instrumented
+            boto3.client("dynamodb").get_item(TableName="counted", Key={"id": {"S": "a"}})
+
+        with patch.object(metrics.metrics_logger, "info") as emit:
+            handler()
+
+        document = emit.call_args.args[0]
+        self.assertEqual((document["DynamoDBReads"], document["DynamoDBWrites"]), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
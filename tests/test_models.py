@@ -0,0 +1,41 @@
+import unittest
+
+from common.models import Thread
+from tests.test_store import make_thread
+
+
+class TestModels(unittest.TestCase):
+
+    def test_messages_share_their_thread(self):
+        thread = Thread.from_api(make_thread("t1", ["m1", "m2"]))
+
+        self.assertEqual([message.id for message in thread.messages], ["m1", "m2"])
+        self.assertTrue(all(message.thread is thread for message in thread.messages))
+        self.assertEqual((thread.messages[0].thread_id, thread.messages[0].category), ("t1", "Savnet"))
+
+    def test_to_item_matches_the_stored_item(self):
+        data = make_thread("t1", ["m1"])
+        message = Thread.from_api(data).messages[0]
+
+        self.assertEqual(message.to_item(), {
+            "thread_id": "t1",
+            "message_id": "m1",
+            "text": "Text m1",
+            "district": data["district"],
+            "municipality": data["municipality"],
+            "isActive": data["isActive"],
+            "hasImage": False,
+            "createdOn": data["createdOn"],
+            "updatedOn": data["updatedOn"],
+            "category": data["category"],
+        })
+
+    def test_no_instance_dicts(self):
+        thread = Thread.from_api(make_thread("t1", ["m1"]))
+
+        self.assertFalse(hasattr(thread, "__dict__"))
+        self.assertFalse(hasattr(thread.messages[0], "__dict__"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch, Mock
+
+import requests
+
+import app
+from common.models import Message, Thread
+
+
+def make_message(message_id, new_thread=False, thread_id="t1", text=None):
+    thread = Thread(
+        id=thread_id,
+        district="Sør-Vest politidistrikt",
+        municipality="Stavanger",
+        is_active=True,
+        created_on="2023-10-01T10:00:00Z",
+        updated_on="2023-10-01T10:05:00Z",
+        category="Savnet",
+    )
+    return Message(id=message_id, text=text or f"Text {message_id}", has_image=False, thread=thread,
+                   new_thread=new_thread)
+
+
+class TestNotifications(unittest.TestCase):
+    def test_only_first_notification_plays_alarm(self):
+        messages = [make_message("m1", new_thread=True), make_message("m2"), make_message("m3")]
+        notifications = [app.build_notification(message, index, len(messages)) for index, message in enumerate(messages)]
+
+        self.assertEqual([n["sound"] for n in notifications], ["MotorolaAlarm", "none", "none"])
+        self.assertEqual([n["priority"] for n in notifications], [2, 0, 0])
+        self.assertEqual(notifications[0]["title"], "NY ALARM - Savnet: Stavanger")
+        self.assertEqual(notifications[1]["title"], "ALARM UPDATE - Savnet: Stavanger")
+
+    @patch('requests.Session.request')
+    def test_emergency_priority_sets_retry_and_expire(self, mock_session_request):
+        mock_session_request.return_value = Mock(status_code=200, text="{}")
+
+        result = app.notify("title", "message", "user", "token", priority=2)
+
+        self.assertTrue(result["ok"])
+        data = mock_session_request.call_args.kwargs["data"]
+        self.assertEqual((data["retry"], data["expire"]), (120, 600))
+
+    @patch('requests.Session.request')
+    def test_dispatch_is_concurrent_and_bounded(self, mock_session_request):
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def post(*args, **kwargs):
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.pop()
+            return Mock(status_code=200, text="{}")
+
+        mock_session_request.side_effect = post
+        notifications = [app.build_notification(make_message(f"m{n}"), n, 6) for n in range(6)]
+
+        results = app.dispatch_notifications(notifications, "user", "token", max_workers=3)
+
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(result["ok"] for result in results))
+        self.assertEqual(max(peak), 3)
+
+    @patch('common.http.time.sleep')
+    @patch('requests.Session.request')
+    def test_dispatch_reports_failures(self, mock_session_request, mock_sleep):
+        def post(method, url, data, timeout):
+            if data["title"].endswith("m1"):
+                raise requests.exceptions.ConnectTimeout("timed out")
+            return Mock(status_code=200, text="{}")
+
+        mock_session_request.side_effect = post
+        notifications = [app.build_notification(make_message(f"m{n}"), n, 2) for n in range(2)]
+        notifications[1]["title"] += " m1"
+
+        results = app.dispatch_notifications(notifications, "user", "token", max_workers=1)
+
+        self.assertEqual([result["ok"] for result in results], [True, False])
+        self.assertIn("timed out", results[1]["error"])
+
+    def test_small_runs_are_not_coalesced(self):
+        messages = [make_message("m1", thread_id="t1"), make_message("m2", thread_id="t1")]
+
+        notifications = app.build_notifications(messages, threshold=5, min_thread_updates=3)
+
+        self.assertEqual([n["message_ids"] for n in notifications], [["m1"], ["m2"]])
+
+    def test_busy_thread_is_coalesced(self):
+        messages = [
+            make_message("m1", thread_id="t1"),
+            make_message("m2", thread_id="t2", new_thread=True),
+            make_message("m3", thread_id="t1"),
+            make_message("m4", thread_id="t1"),
+        ]
+
+        notifications = app.build_notifications(messages, threshold=5, min_thread_updates=3)
+
+        self.assertEqual([n["message_ids"] for n in notifications], [["m1", "m3", "m4"], ["m2"]])
+        self.assertEqual([n["sound"] for n in notifications], ["MotorolaAlarm", "none"])
+        self.assertEqual(notifications[0]["message"], "Text m1\n\nText m3\n\nText m4")
+        self.assertEqual(notifications[1]["priority"], 2)
+
+    def test_burst_is_coalesced_per_thread_with_highest_priority(self):
+        messages = [make_message("m1", thread_id="t1", new_thread=True), make_message("m2", thread_id="t1")]
+        messages += [make_message(f"x{n}", thread_id=f"t{n + 2}") for n in range(4)]
+
+        notifications = app.build_notifications(messages, threshold=5, min_thread_updates=3)
+
+        self.assertEqual(len(notifications), 5)
+        self.assertEqual(notifications[0]["message_ids"], ["m1", "m2"])
+        self.assertEqual(notifications[0]["priority"], 2)
+        self.assertTrue(notifications[0]["title"].startswith("NY ALARM"))
+
+    def test_digest_respects_message_limit(self):
+        messages = [make_message(f"m{n}", text="x" * 400) for n in range(5)]
+
+        notification = app.build_notifications(messages, threshold=10, min_thread_updates=2)[0]
+
+        self.assertEqual(len(notification["message"]), app.PUSHOVER_MESSAGE_LIMIT)
+        self.assertTrue(notification["message"].endswith("…"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import unittest
+
+from tests.conftest import load_module
+
+
+class TestStartup(unittest.TestCase):
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |     common.seen_cache\n"
+            "import time:      2000 |       2500 |   common\n"
+            "import time:       300 |       3100 | app\n"
+        )
+
+        imports = load_module("benchmarks/startup.py", "startup").parse_importtime(output)
+
+        self.assertEqual(imports, [("common.seen_cache", 120, 2), ("common", 2500, 1), ("app", 3100, 0)])
+
+    def test_handlers_defer_heavy_imports(self):
+        startup = load_module("benchmarks/startup.py", "startup")
+
+        for name, code in startup.HANDLERS.items():
+            with self.subTest(handler=name):
+                # boto3, botocore, requests and friends are imported on first use, not at load
+                self.assertEqual(startup.deferred_imports(code), [])
+
+    # Wall clock timings are too noisy for a shared CI runner, so the budget is only checked when asked for
+    @unittest.skipUnless(os.environ.get("STARTUP_BUDGET_CHECK"), "set STARTUP_BUDGET_CHECK=1 to check the budget")
+    def test_handlers_are_within_budget(self):
+        results = load_module("benchmarks/startup.py", "startup").check()
+
+        for name, result in results.items():
+            with self.subTest(handler=name):
+                self.assertTrue(result["ok"], result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,285 @@
+import abc
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import boto3
+from moto import mock_dynamodb
+
+from common import archive
+from common.models import Thread
+from common.seen_cache import SeenCache
+from common.storage import DynamoDBStorage, SQLiteStorage, Storage
+
+
+def make_thread(thread_id, message_ids):
+    return {
+        "id": thread_id,
+        "district": "Sør-Vest politidistrikt",
+        "municipality": "Stavanger",
+        "isActive": True,
+        "createdOn": "2023-10-01T10:00:00Z",
+        "updatedOn": "2023-10-01T10:05:00Z",
+        "category": "Savnet",
+        "messages": [{"id": message_id, "text": f"Text {message_id}", "hasImage": False} for message_id in message_ids],
+    }
+
+
+def parse_thread(thread_id, message_ids):
+    return Thread.from_api(make_thread(thread_id, message_ids))
+
+
+class StoreTests(abc.ABC):
+    """
+    Tests for storing messages and query state, run against every storage backend.
+    """
+
+    def setUp(self):
+        import app
+
+        self.app = app
+        app._last_digests.clear()
+        app._seen.clear()
+        app._high_water_marks.clear()
+        self.entries = self.make_storage()
+
+    @abc.abstractmethod
+    def make_storage(self):
+        """
+        Create an empty entries table in the backend under test.
+        """
+
+    def test_new_messages_are_stored_and_flagged(self):
+        new_messages = self.app.store_threads_and_messages(self.entries, [parse_thread("t1", ["m1", "m2"])])
+
+        self.assertEqual([message.id for message in new_messages], ["m1", "m2"])
+        self.assertEqual([message.new_thread for message in new_messages], [True, False])
+        stored = self.entries.get_items([{"thread_id": "t1", "message_id": "m1"}, {"thread_id": "t1", "message_id": "m2"}])
+        self.assertEqual(sorted(item["text"] for item in stored), ["Text m1", "Text m2"])
+
+    def test_existing_messages_are_skipped(self):
+        self.app.store_threads_and_messages(self.entries, [parse_thread("t1", ["m1"])])
+        new_messages = self.app.store_threads_and_messages(self.entries, [parse_thread("t1", ["m1", "m2"])])
+
+        self.assertEqual([message.id for message in new_messages], ["m2"])
+        self.assertFalse(new_messages[0].new_thread)
+
+    def test_existing_thread_marker_disables_new_thread(self):
+        self.entries.put_item({"thread_id": "t1", "message_id": "t1"})
+        new_messages = self.app.store_threads_and_messages(self.entries, [parse_thread("t1", ["m1"])])
+
+        self.assertFalse(new_messages[0].new_thread)
+
+    def test_large_payload_is_chunked(self):
+        threads = [parse_thread(f"t{index}", [f"m{index}-{n}" for n in range(5)]) for index in range(30)]
+        new_messages = self.app.store_threads_and_messages(self.entries, threads)
+        self.assertEqual(len(new_messages), 150)
+
+        # Second pass has 180 keys to check, more than one BatchGetItem request
+        self.app._seen.clear()
+        self.assertEqual(self.app.store_threads_and_messages(self.entries, threads), [])
+
+    def test_seen_messages_skip_the_database(self):
+        self.app.store_threads_and_messages(self.entries, [parse_thread("t1", ["m1", "m2"])])
+
+        with patch.object(self.entries, "get_items", wraps=self.entries.get_items) as batch_get:
+            new_messages = self.app.store_threads_and_messages(self.entries, [parse_thread("t1", ["m1", "m2", "m3"])])
+
+        # The thread summary and the new message are read, m1 and m2 come from the cache
+        keys = [call.args[0] for call in batch_get.call_args_list]
+        self.assertEqual(keys, [
+            [{"thread_id": "t1", "message_id": "#summary"}],
+            [{"thread_id": "t1", "message_id": "m3"}],
+        ])
+        self.assertEqual([message.id for message in new_messages], ["m3"])
+        self.assertEqual(self.app._seen.stats()["hits"], 2)
+
+    def test_unchanged_thread_costs_one_read(self):
+        thread = parse_thread("t1", [f"m{n}" for n in range(30)])
+        self.app.store_threads_and_messages(self.entries, [thread])
+        self.app._seen.clear()
+
+        with patch.object(self.entries, "get_items", wraps=self.entries.get_items) as batch_get, \
+                patch.object(self.entries, "put_items", wraps=self.entries.put_items) as batch_write:
+            new_messages = self.app.store_threads_and_messages(self.entries, [thread])
+
+        self.assertEqual(new_messages, [])
+        batch_get.assert_called_once_with([{"thread_id": "t1", "message_id": "#summary"}])
+        batch_write.assert_not_called()
+
+    def test_changed_thread_only_checks_new_messages(self):
+        self.app.store_threads_and_messages(self.entries, [parse_thread("t1", ["m1", "m2"])])
+        self.app._seen.clear()
+
+        thread = parse_thread("t1", ["m1", "m2", "m3"])
+        thread.updated_on = "2023-10-01T10:10:00Z"
+        new_messages = self.app.store_threads_and_messages(self.entries, [thread])
+
+        self.assertEqual([message.id for message in new_messages], ["m3"])
+        # The thread exists, so the new message doesn't start one
+        self.assertFalse(new_messages[0].new_thread)
+        summary = self.entries.get_item({"thread_id": "t1", "message_id": "#summary"})
+        self.assertEqual((summary["updatedOn"], summary["messageCount"]), ("2023-10-01T10:10:00Z", 3))
+        self.assertEqual(set(summary["messageIds"]), {"m1", "m2", "m3"})
+
+    def test_scan_pages_through_every_item(self):
+        items = [{"thread_id": f"t{index % 7}", "message_id": f"m{index}"} for index in range(450)]
+        self.entries.put_items(items)
+
+        with patch("common.storage.SQLITE_BATCH_SIZE", 100):
+            scanned = list(self.entries.scan())
+
+        self.assertEqual(sorted(item["message_id"] for item in scanned), sorted(item["message_id"] for item in items))
+
+    def test_messages_expire(self):
+        self.app.store_threads_and_messages(self.entries, [parse_thread("t1", ["m1"])])
+
+        stored = self.entries.get_item({"thread_id": "t1", "message_id": "m1"})
+        self.assertAlmostEqual(stored["expires_at"], archive.expires_at(), delta=5)
+        self.assertIn("expires_at", self.entries.get_item({"thread_id": "t1", "message_id": "#summary"}))
+
+    def test_put_item_if_absent(self):
+        self.assertTrue(self.entries.put_item_if_absent({"thread_id": "t1", "message_id": "m1", "text": "first"}))
+        self.assertFalse(self.entries.put_item_if_absent({"thread_id": "t1", "message_id": "m1", "text": "second"}))
+
+        self.assertEqual(self.entries.get_item({"thread_id": "t1", "message_id": "m1"})["text"], "first")
+
+    def test_put_item_if_expired(self):
+        key = {"thread_id": "#state", "message_id": "lease#poller"}
+
+        def take(owner, expires_at, now):
+            item = {**key, "owner": owner, "expiresAt": expires_at}
+            return self.entries.put_item_if_expired(item, "expiresAt", now, "owner")
+
+        self.assertTrue(take("a", 100, 50))
+        # Someone else can't take it before it expires, the holder can renew it
+        self.assertFalse(take("b", 200, 90))
+        self.assertTrue(take("a", 200, 90))
+        self.assertTrue(take("b", 300, 201))
+
+        self.assertEqual(self.entries.get_item(key)["owner"], "b")
+
+    def test_claimed_messages_are_not_new(self):
+        # Another poller stored m1 after our existence check
+        self.entries.put_item({"thread_id": "t1", "message_id": "m1"})
+
+        with patch.object(self.entries, "get_items", return_value=[]):
+            new_messages = self.app.store_threads_and_messages(
+                self.entries, [parse_thread("t1", ["m1", "m2"])], claim=True
+            )
+
+        self.assertEqual([message.id for message in new_messages], ["m2"])
+        self.assertIn(("t1", "m1"), self.app._seen)
+
+    def load_high_water_mark(self, key):
+        # Read the mark back as a cold container would
+        self.app._high_water_marks.clear()
+        self.app.load_query_state(self.entries, [key])
+        return self.app._high_water_marks[key]
+
+    def test_high_water_mark_only_moves_forward(self):
+        key = self.app.query_key("Sør-Vest politidistrikt", ["Savnet", "Redning"])
+        self.assertIsNone(self.load_high_water_mark(key))
+
+        self.app.save_high_water_mark(self.entries, key, "2023-10-01T10:05:00Z")
+        self.app.save_high_water_mark(self.entries, key, "2023-10-01T10:00:00Z")
+
+        self.assertEqual(self.app._high_water_marks[key], "2023-10-01T10:05:00Z")
+        self.assertEqual(self.load_high_water_mark(key), "2023-10-01T10:05:00Z")
+
+    def test_payload_digest_is_stable(self):
+        thread = make_thread("t1", ["m1"])
+        reordered = dict(reversed(list(thread.items())))
+
+        self.assertEqual(self.app.payload_digest([thread]), self.app.payload_digest([reordered]))
+        self.assertNotEqual(self.app.payload_digest([thread]), self.app.payload_digest([make_thread("t1", ["m2"])]))
+
+    def test_query_state_survives_cold_start(self):
+        self.app.save_payload_digest(self.entries, "key", "abc")
+        self.app.save_high_water_mark(self.entries, "key", "2023-10-01T10:05:00Z")
+        self.app._last_digests.clear()
+        self.app._high_water_marks.clear()
+
+        self.app.load_query_state(self.entries, ["key", "other"])
+
+        self.assertEqual(self.app._last_digests, {"key": "abc", "other": None})
+        self.assertEqual(self.app._high_water_marks, {"key": "2023-10-01T10:05:00Z", "other": None})
+
+
+class TestStoreDynamoDB(StoreTests, unittest.TestCase):
+    def setUp(self):
+        # The tests are inherited, so start moto here rather than decorating the class
+        mock = mock_dynamodb()
+        mock.start()
+        self.addCleanup(mock.stop)
+        super().setUp()
+
+    def make_storage(self):
+        table = boto3.resource("dynamodb").create_table(
+            TableName=self.app.TABLE_NAME,
+            KeySchema=[
+                {"AttributeName": "thread_id", "KeyType": "HASH"},
+                {"AttributeName": "message_id", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "thread_id", "AttributeType": "S"},
+                {"AttributeName": "message_id", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        return DynamoDBStorage(table, self.app.TABLE_KEY_NAMES)
+
+    def test_conditional_puts_go_through_the_client(self):
+        # The Table resource isn't safe to share between the claim and heartbeat threads, its client is
+        item = {"thread_id": "t1", "message_id": "m1", "updatedOn": "2023-10-01T10:05:00Z", "owner": "a"}
+        with patch.object(self.entries.table, "put_item", side_effect=AssertionError("resource used")):
+            self.assertTrue(self.entries.put_item_if_absent(item))
+            self.assertFalse(self.entries.put_item_if_absent(item))
+            self.assertFalse(self.entries.put_item_if_newer(item, "updatedOn"))
+            self.assertTrue(self.entries.put_item_if_expired({**item, "expiresAt": 2}, "expiresAt", 1, "owner"))
+            self.assertFalse(
+                self.entries.put_item_if_expired({**item, "expiresAt": 3, "owner": "b"}, "expiresAt", 1, "owner")
+            )
+
+
+class TestStoreSQLite(StoreTests, unittest.TestCase):
+    def make_storage(self):
+        path = os.path.join(tempfile.mkdtemp(), "politiloggen.db")
+        return SQLiteStorage(self.app.TABLE_NAME, self.app.TABLE_KEY_NAMES, path=path)
+
+
+class TestStorageInterface(unittest.TestCase):
+    def test_incomplete_backend_fails_when_created(self):
+        class NoScan(Storage):
+            get_item = get_items = put_item = put_items = lambda self, *args: None
+            put_item_if_newer = put_item_if_absent = put_item_if_expired = lambda self, *args: None
+
+        with self.assertRaisesRegex(TypeError, "scan"):
+            NoScan("table", ("id",))
+
+
+class TestSeenCache(unittest.TestCase):
+    def test_least_recently_used_is_dropped(self):
+        seen = SeenCache(max_size=2)
+        seen.update(["a", "b"])
+        self.assertIn("a", seen)
+        seen.add("c")
+
+        self.assertNotIn("b", seen)
+        self.assertIn("a", seen)
+        self.assertEqual(len(seen), 2)
+
+    def test_stats(self):
+        seen = SeenCache(max_size=10)
+        seen.add(("t1", "m1"))
+        self.assertIn(("t1", "m1"), seen)
+        self.assertNotIn(("t1", "m2"), seen)
+
+        stats = seen.stats()
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"], stats["hit_ratio"]), (1, 1, 1, 0.5))
+        self.assertGreater(stats["memory_bytes"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()